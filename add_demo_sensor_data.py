@@ -283,6 +283,18 @@ def create_demo_data(connection):
                 sys.stdout.write('+')
                 sys.stdout.flush()
 
+            # Raw inserts bypass the rollup tables: move their coverage watermark past the new
+            # readings so /api/historical_data reads them from sensordata until `flask rebuild-rollups`
+            cursor.execute("SHOW TABLES LIKE 'sensordata_rollup_coverage';")
+            if cursor.fetchone() and all_readings_data:
+                newest = max(reading['timestamp'] for reading in all_readings_data)
+                cursor.execute("""
+                    UPDATE sensordata_rollup_coverage
+                    SET covered_from = GREATEST(COALESCE(covered_from, 0),
+                                                (TIMESTAMPDIFF(SECOND, '1970-01-01 00:00:00', %s) DIV 60 + 1) * 60)
+                    WHERE id = 1
+                """, (newest,))
+
             connection.commit()
             print(f"\nSuccessfully inserted {inserted_count} records.")
 
@@ -0,0 +1,207 @@
+"""
+Historical backtest of an alarm rule.
+
+Replays a saved or draft AlarmRule over stored SensorData without writing
+Alarm rows: the metric column of the time range is fetched once as NumPy
+arrays, the rule condition is applied to the whole column at once, and
+alarms are resolved by jumping from each alarm to the next reading that can
+raise one (one binary search per alarm instead of a pass over every reading).
+
+The replay follows the live engine in app/alarm_engine.py, including its
+ALARM_COALESCE and ALARM_AUTO_CLEAR settings. With both on (the default), a
+run of consecutive triggering readings shares one alarm: the first reading
+past the cooldown raises it, the rest of the run is counted as occurrences,
+and the first non-triggering reading clears it. Without auto-clear the first
+alarm never closes, so every later trigger becomes an occurrence of it;
+without coalescing only the cooldown applies. What the replay cannot see:
+cooldowns and open alarms carried over from before the range, alarms cleared
+or acknowledged by hand, and suppression while a device is offline.
+
+Rules with duration_seconds or hysteresis are replayed with the same episode
+semantics as the engine's streaming windows: the hysteresis latch is a
+forward fill of the last entry/exit event, episodes are runs of readings in
+which the condition holds, and each episode contributes at most one alarm
+candidate (its first reading past the duration) to the cooldown pass. An
+episode's end clears its alarm, so with auto-clear episodes never coalesce.
+"""
+import time
+from datetime import datetime
+
+import numpy as np
+
+from app.database import db
+from app.models import AlarmCondition, SensorData, SENSOR_METRIC_COLUMNS
+
+# Alarm timestamps returned in full; the counts always cover the whole range
+DEFAULT_TIMESTAMP_LIMIT = 1000
+
+_SERIES_DTYPE = [('timestamp', 'datetime64[us]'), ('value', np.float64)]
+
+_CONDITION_MASKS = {
+    AlarmCondition.GREATER_THAN: np.greater,
+    AlarmCondition.LESS_THAN: np.less,
+    AlarmCondition.EQUALS: np.equal,
+}
+
+
+def load_series(metric, start=None, end=None, connection=None):
+    """
+    (timestamps as datetime64[us], values as float64) of the non-null readings of
+    one metric, ordered by time.
+    """
+    if metric not in SENSOR_METRIC_COLUMNS:
+        raise ValueError(f'Unknown sensor metric: {metric}')
+    column = SensorData.__table__.c[metric]
+    timestamp = SensorData.__table__.c.timestamp
+    statement = db.select(timestamp, column).where(column.isnot(None))
+    if start is not None:
+        statement = statement.where(timestamp >= start)
+    if end is not None:
+        statement = statement.where(timestamp <= end)
+    statement = statement.order_by(timestamp)
+
+    connection = connection if connection is not None else db.session.connection()
+    result = connection.execute(statement)
+    # Read the driver's tuples directly; building Row objects would cost more than the backtest
+    rows = result.cursor.fetchall()
+    result.close()
+    if rows and isinstance(rows[0][0], datetime) and rows[0][0].tzinfo is not None:
+        rows = [(value_time.replace(tzinfo=None), value) for value_time, value in rows]
+    series = np.array(rows, dtype=_SERIES_DTYPE)
+    return series['timestamp'], series['value']
+
+
+def fire_indices(epochs, cooldown):
+    """
+    Positions in the sorted `epochs` of triggering readings that raise an alarm:
+    the first one, then each first reading at least `cooldown` seconds after the previous alarm.
+    """
+    if cooldown <= 0 or len(epochs) == 0:
+        return np.arange(len(epochs))
+    fired = []
+    position = 0
+    while position < len(epochs):
+        fired.append(position)
+        position = int(np.searchsorted(epochs, epochs[position] + cooldown, side='left'))
+    return np.array(fired, dtype=np.intp)
+
+
+def coalesced_fire_indices(epochs, runs, cooldown):
+    """
+    (positions in the sorted `epochs` of triggers that raise an alarm, occurrences counted on each alarm)
+    when triggers arriving while the rule's alarm is open are coalesced into it. `runs` numbers the
+    stretch during which an alarm stays open (non-decreasing): a new alarm needs a later run and,
+    like fire_indices(), a trigger at least `cooldown` seconds after the previous alarm.
+    """
+    if len(epochs) == 0:
+        return np.arange(0), np.arange(0)
+    # Position of the first trigger of the next run, per trigger
+    next_run = np.searchsorted(runs, runs, side='right')
+    fired = []
+    position = 0
+    while position < len(epochs):
+        fired.append(position)
+        after = next_run[position]
+        if cooldown > 0:
+            after = max(after, int(np.searchsorted(epochs, epochs[position] + cooldown, side='left')))
+        position = after
+    fired = np.array(fired, dtype=np.intp)
+    return fired, next_run[fired] - fired
+
+
+def episode_candidates(values, epochs, condition, threshold, duration_seconds=0, hysteresis=0.0):
+    """
+    (mask of readings inside an episode, positions of the readings at which an episode
+    has held for duration_seconds) for a stateful rule over time-ordered readings.
+    """
+    if condition == AlarmCondition.GREATER_THAN:
+        enters, exits = values > threshold + hysteresis, values <= threshold - hysteresis
+    elif condition == AlarmCondition.LESS_THAN:
+        enters, exits = values < threshold - hysteresis, values >= threshold + hysteresis
+    else:
+        enters = values == threshold
+        exits = ~enters
+    # Hysteresis latch: inside the band a reading keeps the state set by the last entry or exit
+    positions = np.arange(len(values))
+    last_event = np.maximum.accumulate(np.where(enters | exits, positions, -1)) if len(values) else positions
+    holding = (last_event >= 0) & enters[np.maximum(last_event, 0)]
+
+    previous = np.concatenate(([False], holding[:-1]))
+    starts = np.flatnonzero(holding & ~previous)
+    episode = np.cumsum(holding & ~previous) - 1
+    since = epochs[starts][np.maximum(episode, 0)] if len(starts) else epochs
+    due = holding & (epochs - since >= duration_seconds)
+    # Epochs are ordered, so the first due reading of each episode is where `due` switches on
+    first_due = due & ~np.concatenate(([False], due[:-1]))
+    return holding, np.flatnonzero(first_due)
+
+
+def backtest_rule(metric, condition, threshold, cooldown_seconds=0, start=None, end=None,
+                  limit=DEFAULT_TIMESTAMP_LIMIT, connection=None, duration_seconds=0, hysteresis=0.0,
+                  coalesce=True, auto_clear=True):
+    """
+    Would-be alarms of a rule over [start, end], as an engine with the given
+    coalesce / auto_clear settings would raise them.
+    Returns a dict with the alarm count, the first `limit` alarm timestamps with their
+    occurrence counts and the number of readings scanned, matching the condition,
+    coalesced into open alarms and suppressed by the cooldown.
+    """
+    condition = AlarmCondition(condition)
+    threshold = float(threshold)
+    cooldown_seconds = int(cooldown_seconds or 0)
+    duration_seconds = int(duration_seconds or 0)
+    hysteresis = float(hysteresis or 0)
+
+    started = time.perf_counter()
+    timestamps, values = load_series(metric, start, end, connection)
+    loaded = time.perf_counter()
+
+    # Whole wall-clock seconds, as the live engine compares them
+    epochs = timestamps.astype('datetime64[s]').astype(np.int64)
+    if duration_seconds > 0 or hysteresis > 0:
+        holding, candidates = episode_candidates(values, epochs, condition, threshold, duration_seconds, hysteresis)
+        matching = int(np.count_nonzero(holding))
+        # Each episode's end clears its alarm
+        runs = np.arange(len(candidates))
+    else:
+        triggers = _CONDITION_MASKS[condition](values, threshold)
+        candidates = np.flatnonzero(triggers)
+        matching = len(candidates)
+        # The first reading that no longer triggers clears the alarm
+        runs = np.cumsum(triggers & ~np.concatenate(([False], triggers[:-1])))[candidates]
+    if not coalesce:
+        fired = fire_indices(epochs[candidates], cooldown_seconds)
+        occurrences = np.ones(len(fired), dtype=np.intp)
+    else:
+        if not auto_clear:
+            runs = np.zeros(len(candidates), dtype=np.intp)
+        fired, occurrences = coalesced_fire_indices(epochs[candidates], runs, cooldown_seconds)
+    coalesced = int(occurrences.sum()) - len(fired)
+    fired = candidates[fired]
+    finished = time.perf_counter()
+
+    alarm_times = timestamps[fired[:limit]].astype('datetime64[us]').tolist()
+    return {
+        'sensor_metric': metric,
+        'condition': condition.value,
+        'threshold_value': threshold,
+        'cooldown_period_seconds': cooldown_seconds,
+        'duration_seconds': duration_seconds,
+        'hysteresis': hysteresis,
+        'coalesce': bool(coalesce),
+        'auto_clear': bool(auto_clear),
+        'start_time': start.isoformat() if start else None,
+        'end_time': end.isoformat() if end else None,
+        'readings_scanned': int(len(values)),
+        'readings_matching': int(matching),
+        'alarm_count': int(len(fired)),
+        'occurrences_coalesced': coalesced,
+        'suppressed_by_cooldown': int(len(candidates) - len(fired) - coalesced),
+        'first_alarm': timestamps[fired[0]].item().isoformat() if len(fired) else None,
+        'last_alarm': timestamps[fired[-1]].item().isoformat() if len(fired) else None,
+        'alarm_timestamps': [value.isoformat() for value in alarm_times],
+        'alarm_occurrence_counts': occurrences[:limit].tolist(),
+        'truncated': len(fired) > limit,
+        'load_ms': round((loaded - started) * 1000, 1),
+        'evaluate_ms': round((finished - loaded) * 1000, 1),
+    }
@@ -0,0 +1,768 @@
+"""
+Evaluation of alarm rules against new sensor readings.
+
+Active AlarmRule rows are compiled into an in-memory index keyed by
+sensor_metric. Per metric, '>' and '<' rules are kept sorted by threshold,
+so the rules a value triggers are found with one bisect instead of comparing
+the value against every rule; '=' rules are looked up by threshold. A reading
+therefore only touches the rules that watch its columns, and only those that
+fire cost more than a comparison.
+
+The index is rebuilt only when rules change. Every transaction that adds,
+edits or deletes an AlarmRule through the ORM also bumps the single row of
+alarm_rule_set_version; the process that committed it rebuilds on its next
+evaluation, and every other worker process notices the new version within
+ALARM_RULES_CHECK_INTERVAL seconds (one primary key lookup per interval).
+
+Cooldowns are tracked in memory (last alarm time per rule, seeded from the
+alarms table when the index is built), as are the rules with open alarms.
+Alarms raised by a transaction only start their rule's cooldown once the
+transaction commits. With several worker processes, every transaction that
+raises, coalesces or clears rule alarms bumps alarm_state_version; a worker
+that finds it changed by another one (checked every ALARM_RULES_CHECK_INTERVAL
+seconds) seeds both again from the alarms table. Two workers evaluating the
+same rule within that interval, or in overlapping transactions, can still
+both raise an alarm; run a single ingest worker where that matters.
+
+Rules with duration_seconds or hysteresis are stateful: each keeps a small
+streaming window (since when its condition holds, whether that episode has
+alarmed, the newest reading seen), so "above 30 for 10 minutes" never
+re-reads history. A '>' rule enters its condition above threshold +
+hysteresis and leaves it at or below threshold - hysteresis ('<' mirrored;
+'=' rules ignore hysteresis). It alarms once per episode, when the condition
+has held for duration_seconds, subject to the cooldown. Windows start empty
+when the process starts and, like cooldowns, only advance once the
+transaction that carried the readings commits. Rules without either setting
+fire on every triggering sample, as before.
+
+Alarms clear themselves: once a reading shows the condition resolved (the
+value no longer triggers a plain rule, or a stateful rule's episode ends),
+the rule's active and acknowledged alarms move to CLEARED. The engine only
+watches rules that have uncleared alarms, and all clears of an evaluation
+cycle are applied with one set-based UPDATE. ALARM_AUTO_CLEAR=0 disables it.
+
+Alarm storms are damped twice. A rule that triggers again while its alarm is
+still open (active or acknowledged) does not raise another one: the trigger
+is counted on the open alarm (occurrence_count, last_seen), with one UPDATE
+per evaluation cycle for all such rules (ALARM_COALESCE=0 disables it). And
+while a device has an uncleared DEVICE_OFFLINE_ALARM_TYPE alarm, the rules
+of that device raise nothing at all; their triggers are only counted in the
+engine stats. The set of offline devices is cached like the rule index:
+transactions that change Device Offline alarms bump alarm_offline_set_version,
+which other workers check every ALARM_RULES_CHECK_INTERVAL seconds.
+"""
+import operator
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.alarm_events import alarm_events, record_created, record_occurrences
+from app.alarm_notifications import alarm_notifier
+from app.alarm_summary import record_inserted, set_alarm_status
+from app.database import db, executemany_rows
+from app.models import (Alarm, AlarmCondition, AlarmOfflineSetVersion, AlarmRule, AlarmRuleSetVersion,
+                        AlarmStateVersion, AlarmStatus, SensorData, SENSOR_METRIC_COLUMNS)
+from app.timeseries import wall_clock_epoch
+
+ALARM_TYPE = 'Sensor Threshold Exceeded'
+# Parent alarm: while one is open for a device, alarms of the device's rules are suppressed
+DEVICE_OFFLINE_ALARM_TYPE = 'Device Offline'
+ALARM_INSERT_COLUMNS = ['timestamp', 'device_id', 'alarm_type', 'severity', 'status', 'details',
+                        'triggered_by_rule_id', 'occurrence_count', 'last_seen']
+
+_CONDITION_TEXT = {
+    AlarmCondition.GREATER_THAN: 'above',
+    AlarmCondition.LESS_THAN: 'below',
+    AlarmCondition.EQUALS: 'equal to',
+}
+
+
+def _read_version(model, connection):
+    """Counter of a single-row version table (0 before the first change was recorded)."""
+    table = model.__table__
+    return connection.execute(db.select(table.c.version).where(table.c.id == 1)).scalar() or 0
+
+
+def _bump_version(model, connection):
+    """Increment a single-row version table in the caller's transaction."""
+    table = model.__table__
+    result = connection.execute(table.update().where(table.c.id == 1).values(version=table.c.version + 1))
+    if not result.rowcount:
+        connection.execute(table.insert().values(id=1, version=1))
+
+
+class CompiledRule:
+    """The fields of an AlarmRule needed to evaluate it, detached from the session."""
+    __slots__ = ('id', 'name', 'device_id', 'sensor_metric', 'condition', 'threshold_value', 'severity',
+                 'cooldown_period_seconds', 'duration_seconds', 'hysteresis')
+
+    def __init__(self, row):
+        for field in self.__slots__:
+            setattr(self, field, row[field])
+        self.cooldown_period_seconds = self.cooldown_period_seconds or 0
+        self.duration_seconds = self.duration_seconds or 0
+        self.hysteresis = self.hysteresis or 0.0
+
+    @property
+    def stateful(self):
+        return self.duration_seconds > 0 or self.hysteresis > 0
+
+    @property
+    def signature(self):
+        """What a streaming window depends on; a window survives rule edits that keep it."""
+        return (self.sensor_metric, self.condition, self.threshold_value, self.hysteresis, self.duration_seconds)
+
+    def entry_threshold(self):
+        if self.condition == AlarmCondition.GREATER_THAN:
+            return self.threshold_value + self.hysteresis
+        if self.condition == AlarmCondition.LESS_THAN:
+            return self.threshold_value - self.hysteresis
+        return self.threshold_value
+
+    def exits(self, value):
+        """Whether `value` ends an episode in which the condition held (for plain rules: no longer triggers)."""
+        if self.condition == AlarmCondition.GREATER_THAN:
+            return value <= self.threshold_value - self.hysteresis
+        if self.condition == AlarmCondition.LESS_THAN:
+            return value >= self.threshold_value + self.hysteresis
+        return value != self.threshold_value
+
+
+class _ThresholdIndex:
+    """Rules sorted by the threshold at which they trigger."""
+
+    def __init__(self, rules, threshold=operator.attrgetter('threshold_value')):
+        self.above = sorted((r for r in rules if r.condition == AlarmCondition.GREATER_THAN), key=threshold)
+        self.above_thresholds = [threshold(r) for r in self.above]
+        self.below = sorted((r for r in rules if r.condition == AlarmCondition.LESS_THAN), key=threshold)
+        self.below_thresholds = [threshold(r) for r in self.below]
+        self.equals = {}
+        for rule in rules:
+            if rule.condition == AlarmCondition.EQUALS:
+                self.equals.setdefault(threshold(rule), []).append(rule)
+
+    def triggered(self, value):
+        """Rules whose condition holds for `value`."""
+        # '>' rules with threshold < value are the sorted prefix; '<' rules with threshold > value the suffix
+        matched = self.above[:bisect_left(self.above_thresholds, value)]
+        matched += self.below[bisect_right(self.below_thresholds, value):]
+        if self.equals:
+            matched += self.equals.get(value, ())
+        return matched
+
+
+class MetricRules:
+    """Rules watching one metric, arranged for threshold lookups."""
+
+    def __init__(self, rules):
+        instant = [r for r in rules if not r.stateful]
+        self.stateful = [r for r in rules if r.stateful]
+        index = _ThresholdIndex(instant)
+        self.above, self.below, self.equals = index.above, index.below, index.equals
+        self._instant = index
+        # Stateful rules are looked up by the threshold that opens an episode
+        self._entering = _ThresholdIndex(self.stateful, CompiledRule.entry_threshold)
+        self.by_id = {rule.id: rule for rule in rules}
+        self.count = len(rules)
+
+    def triggered(self, value):
+        """Rules without a window whose condition holds for `value`."""
+        return self._instant.triggered(value)
+
+    def entering(self, value):
+        """Stateful rules whose condition starts to hold at `value`."""
+        return self._entering.triggered(value)
+
+
+class AlarmEngine:
+    """Compiled index of active alarm rules plus per-rule cooldown state."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None  # {metric: MetricRules}, built on first use
+        self._version = None  # alarm_rule_set_version the index was built from
+        self._checked_at = 0.0  # monotonic time of the last version check
+        self.version_check_interval = 1.0
+        self._last_fired = {}  # rule id -> epoch seconds of its last committed alarm
+        # rule id -> (epoch the condition started holding or None, episode alarmed, newest reading epoch)
+        self._windows = {}
+        self._signatures = {}  # rule id -> CompiledRule.signature its window was built for
+        self._open = set()  # ids of rules with alarms that are not cleared yet
+        self._state_version = None  # alarm_state_version cooldowns and open rules were seeded at
+        self._state_checked_at = 0.0
+        self._offline = None  # ids of devices with an open DEVICE_OFFLINE_ALARM_TYPE alarm, loaded on use
+        self._offline_generation = 0
+        self._offline_version = None  # alarm_offline_set_version the offline set was loaded at
+        self._offline_checked_at = 0.0
+        self.auto_clear = True
+        self.coalesce = True
+        self.rule_count = 0
+        self.stateful_rule_count = 0
+        # Counters for stats()
+        self.readings_evaluated = 0
+        self.rules_evaluated = 0
+        self.alarms_raised = 0
+        self.suppressed_by_cooldown = 0
+        self.clear_transitions = 0
+        self.alarms_cleared = 0
+        self.clear_updates = 0
+        self.occurrences_coalesced = 0
+        self.coalesce_updates = 0
+        self.suppressed_by_parent = 0
+        self.evaluation_seconds = 0.0
+        self.index_builds = 0
+        self.version_checks = 0
+        self.stale_index_rebuilds = 0
+        self.offline_version_checks = 0
+        self.stale_offline_reloads = 0
+        self.state_version_checks = 0
+        self.stale_state_reloads = 0
+
+    def init_app(self, app):
+        self.auto_clear = bool(app.config.get('ALARM_AUTO_CLEAR', self.auto_clear))
+        self.coalesce = bool(app.config.get('ALARM_COALESCE', self.coalesce))
+        self.version_check_interval = float(app.config.get('ALARM_RULES_CHECK_INTERVAL', self.version_check_interval))
+
+    def invalidate(self):
+        """Rebuild the rule index on next use (after rules changed)."""
+        with self._lock:
+            self._index = None
+
+    @staticmethod
+    def rules_version(connection):
+        """Current alarm_rule_set_version (0 before any rule change was recorded)."""
+        return _read_version(AlarmRuleSetVersion, connection)
+
+    @staticmethod
+    def bump_rules_version(connection):
+        """Record a rule change in the caller's transaction, for every worker process to see."""
+        _bump_version(AlarmRuleSetVersion, connection)
+
+    @staticmethod
+    def offline_version(connection):
+        """Current alarm_offline_set_version (0 before any Device Offline alarm change was recorded)."""
+        return _read_version(AlarmOfflineSetVersion, connection)
+
+    @staticmethod
+    def bump_offline_version(connection):
+        """Record a Device Offline alarm change in the caller's transaction, for every worker process to see."""
+        _bump_version(AlarmOfflineSetVersion, connection)
+
+    @staticmethod
+    def state_version(connection):
+        """Current alarm_state_version (0 before any rule alarm change was recorded)."""
+        return _read_version(AlarmStateVersion, connection)
+
+    def record_state_change(self, connection, session):
+        """Record raised, coalesced or cleared rule alarms once per transaction, for every worker process to see."""
+        if not session.info.get('alarm_state_changed'):
+            _bump_version(AlarmStateVersion, connection)
+            session.info['alarm_state_changed'] = True
+
+    def current_index(self, connection):
+        """The rule index, rebuilt if rules changed in this process or, checked at most every
+        version_check_interval seconds, in another one."""
+        index = self._index
+        if index is not None and time.monotonic() - self._checked_at >= self.version_check_interval:
+            self._checked_at = time.monotonic()
+            with self._lock:
+                self.version_checks += 1
+            if self.rules_version(connection) != self._version:
+                with self._lock:
+                    self.stale_index_rebuilds += 1
+                index = None
+        if index is None:
+            index = self.load(connection)
+        return index
+
+    def sync_alarm_state(self, connection):
+        """Seed cooldowns and open rules again if, checked at most every version_check_interval
+        seconds, another process changed rule alarms."""
+        if self._state_version is None or time.monotonic() - self._state_checked_at < self.version_check_interval:
+            return
+        self._state_checked_at = time.monotonic()
+        with self._lock:
+            self.state_version_checks += 1
+        if self.state_version(connection) != self._state_version:
+            with self._lock:
+                self.stale_state_reloads += 1
+            self.load_alarm_state(connection)
+
+    def load_alarm_state(self, connection):
+        """Seed the cooldowns (last alarm per rule) and the rules with open alarms from the alarms table."""
+        # Read before the alarms: a change committed in between only causes one more reload
+        version = self.state_version(connection)
+        alarms = Alarm.__table__
+        last_alarms = connection.execute(
+            db.select(alarms.c.triggered_by_rule_id, db.func.max(alarms.c.timestamp))
+            .where(alarms.c.triggered_by_rule_id.isnot(None))
+            .group_by(alarms.c.triggered_by_rule_id)
+        ).all()
+        open_rules = set(connection.execute(
+            db.select(alarms.c.triggered_by_rule_id).distinct()
+            .where(alarms.c.triggered_by_rule_id.isnot(None), alarms.c.status != AlarmStatus.CLEARED)
+        ).scalars())
+        with self._lock:
+            self._open = open_rules
+            self._state_version = version
+            self._state_checked_at = time.monotonic()
+            for rule_id, timestamp in last_alarms:
+                if timestamp is not None:
+                    epoch = wall_clock_epoch(timestamp)
+                    self._last_fired[rule_id] = max(self._last_fired.get(rule_id, epoch), epoch)
+
+    def commit_state_version(self, version):
+        """A transaction of this process committed rule alarm changes at `version`; its state is already applied."""
+        with self._lock:
+            if self._state_version == version - 1:
+                self._state_version = version
+
+    def invalidate_offline(self):
+        """Reload the offline devices on next use (after Device Offline alarms changed)."""
+        with self._lock:
+            self._offline = None
+            self._offline_generation += 1
+
+    def current_offline(self, connection):
+        """The offline devices, reloaded if they changed in this process or, checked at most every
+        version_check_interval seconds, in another one."""
+        offline = self._offline
+        if offline is not None and time.monotonic() - self._offline_checked_at >= self.version_check_interval:
+            self._offline_checked_at = time.monotonic()
+            with self._lock:
+                self.offline_version_checks += 1
+            if self.offline_version(connection) != self._offline_version:
+                with self._lock:
+                    self.stale_offline_reloads += 1
+                offline = None
+        if offline is None:
+            offline = self.load_offline(connection)
+        return offline
+
+    def load_offline(self, connection):
+        """Ids of the devices with an uncleared DEVICE_OFFLINE_ALARM_TYPE alarm."""
+        with self._lock:
+            generation = self._offline_generation
+        # Read before the alarms: a change committed in between only causes one more reload
+        version = self.offline_version(connection)
+        alarms = Alarm.__table__
+        offline = frozenset(connection.execute(
+            db.select(alarms.c.device_id).distinct()
+            .where(alarms.c.alarm_type == DEVICE_OFFLINE_ALARM_TYPE, alarms.c.device_id.isnot(None),
+                   alarms.c.status != AlarmStatus.CLEARED)
+        ).scalars())
+        with self._lock:
+            # Don't keep a set read before an invalidation that raced with the query
+            if generation == self._offline_generation:
+                self._offline = offline
+                self._offline_version = version
+                self._offline_checked_at = time.monotonic()
+        return offline
+
+    def load(self, connection):
+        """Build the rule index from the active rules and seed cooldowns from the alarms table."""
+        # Read before the rules: a change committed in between only causes one more rebuild
+        version = self.rules_version(connection)
+        rules_table = AlarmRule.__table__
+        rows = connection.execute(db.select(rules_table).where(rules_table.c.is_active.is_(True))).mappings()
+        rules = [CompiledRule(row) for row in rows if row['sensor_metric'] in SENSOR_METRIC_COLUMNS]
+        by_metric = {}
+        for rule in rules:
+            by_metric.setdefault(rule.sensor_metric, []).append(rule)
+        self.load_alarm_state(connection)
+
+        index = {metric: MetricRules(metric_rules) for metric, metric_rules in by_metric.items()}
+        signatures = {rule.id: rule.signature for rule in rules if rule.stateful}
+        with self._lock:
+            self._index = index
+            self._version = version
+            self._checked_at = time.monotonic()
+            self.rule_count = len(rules)
+            self.stateful_rule_count = len(signatures)
+            self.index_builds += 1
+            # Drop the windows of rules that are gone or now mean something else
+            self._windows = {rule_id: window for rule_id, window in self._windows.items()
+                             if self._signatures.get(rule_id) == signatures.get(rule_id)}
+            self._signatures = signatures
+        return index
+
+    def evaluate(self, readings, pending=None, index=None, windows=None, open_rules=None, cleared=None,
+                 coalesced=None, offline=None):
+        """
+        Alarm row dicts (over ALARM_INSERT_COLUMNS) for a batch of reading dicts.
+        `pending` maps rule id -> epoch of alarms raised earlier in the same, uncommitted
+        transaction; it is updated with the alarms raised here. `windows` and `open_rules`
+        (rule id -> has uncleared alarms) likewise hold uncommitted window and alarm state.
+        Ids of rules whose condition resolved are added to `cleared`; alarms raised in this
+        batch before their rule resolved are returned as already CLEARED.
+        Triggers of rules whose alarm was already open before the batch are collected in
+        `coalesced` (rule id -> alarm dict whose occurrence_count/last_seen are to be added to
+        the open alarm). Rules of devices in `offline` raise nothing.
+        """
+        started = time.perf_counter()
+        index = index if index is not None else self._index
+        pending = pending if pending is not None else {}
+        windows = windows if windows is not None else {}
+        open_rules = open_rules if open_rules is not None else {}
+        cleared = cleared if cleared is not None else set()
+        coalesced = coalesced if coalesced is not None else {}
+        if offline is None:
+            offline = self._offline or frozenset()
+        alarms = []
+        rules_evaluated = 0
+        suppressed = 0
+        suppressed_by_parent = 0
+        merged = 0
+        transitions = 0
+        if index:
+            watched = [(metric, index[metric]) for metric in SENSOR_METRIC_COLUMNS if metric in index]
+            last_fired = self._last_fired
+            committed_open = self._open
+            holding = {}  # metric -> {rule id: rule} of stateful rules inside an episode
+            uncleared = {}  # metric -> {rule id: rule} of rules with alarms that are not cleared
+            batch_alarms = {}  # rule id -> alarms raised in this batch and not cleared since
+
+            def fire(rule, metric, value, timestamp, epoch):
+                nonlocal suppressed, suppressed_by_parent, merged
+                if rule.device_id in offline:
+                    suppressed_by_parent += 1
+                    return
+                if self.coalesce and open_rules.get(rule.id, rule.id in committed_open):
+                    # Count the trigger on the rule's open alarm instead of raising another one
+                    merged += 1
+                    raised = batch_alarms.get(rule.id)
+                    if raised:
+                        raised[-1]['occurrence_count'] += 1
+                        raised[-1]['last_seen'] = timestamp
+                    elif rule.id in coalesced:
+                        coalesced[rule.id]['occurrence_count'] += 1
+                        coalesced[rule.id]['last_seen'] = timestamp
+                    else:
+                        coalesced[rule.id] = self._alarm(rule, metric, value, timestamp)
+                    return
+                previous = pending.get(rule.id, last_fired.get(rule.id))
+                if previous is not None and abs(epoch - previous) < rule.cooldown_period_seconds:
+                    suppressed += 1
+                    return
+                pending[rule.id] = epoch
+                alarm = self._alarm(rule, metric, value, timestamp)
+                alarms.append(alarm)
+                open_rules[rule.id] = True
+                batch_alarms.setdefault(rule.id, []).append(alarm)
+                if self.auto_clear:
+                    uncleared[metric][rule.id] = rule
+
+            def clear(rule, metric):
+                nonlocal transitions
+                transitions += 1
+                open_rules[rule.id] = False
+                del uncleared[metric][rule.id]
+                cleared.add(rule.id)
+                for alarm in batch_alarms.pop(rule.id, ()):
+                    alarm['status'] = AlarmStatus.CLEARED
+                if rule.id in coalesced:
+                    coalesced[rule.id]['status'] = AlarmStatus.CLEARED
+
+            for reading in readings:
+                timestamp = reading.get('timestamp')
+                if timestamp is None:
+                    continue
+                epoch = None
+                for metric, rules in watched:
+                    value = reading.get(metric)
+                    if value is None:
+                        continue
+                    rules_evaluated += rules.count
+                    if self.auto_clear:
+                        if metric not in uncleared:
+                            uncleared[metric] = self._uncleared(rules, open_rules)
+                        for rule in [r for r in uncleared[metric].values() if not r.stateful]:
+                            if rule.exits(value):
+                                clear(rule, metric)
+                    for rule in rules.triggered(value):
+                        if epoch is None:
+                            epoch = wall_clock_epoch(timestamp)
+                        fire(rule, metric, value, timestamp, epoch)
+                    if rules.stateful:
+                        if epoch is None:
+                            epoch = wall_clock_epoch(timestamp)
+                        if metric not in holding:
+                            holding[metric] = self._holding(rules, windows)
+                        due, ended = self._advance(rules, holding[metric], value, epoch, windows)
+                        for rule in ended:
+                            if self.auto_clear and rule.id in uncleared[metric]:
+                                clear(rule, metric)
+                        for rule in due:
+                            fire(rule, metric, value, timestamp, epoch)
+
+        with self._lock:
+            self.readings_evaluated += len(readings)
+            self.rules_evaluated += rules_evaluated
+            self.alarms_raised += len(alarms)
+            self.suppressed_by_cooldown += suppressed
+            self.suppressed_by_parent += suppressed_by_parent
+            self.occurrences_coalesced += merged
+            self.clear_transitions += transitions
+            self.evaluation_seconds += time.perf_counter() - started
+        return alarms
+
+    def _window(self, rule_id, windows):
+        return windows[rule_id] if rule_id in windows else self._windows.get(rule_id)
+
+    def _uncleared(self, rules, open_rules):
+        """Rules of one metric that have alarms waiting to be cleared."""
+        committed = self._open
+        candidates = committed.union(rule_id for rule_id, is_open in open_rules.items() if is_open)
+        return {rule_id: rules.by_id[rule_id] for rule_id in candidates
+                if rule_id in rules.by_id and open_rules.get(rule_id, rule_id in committed)}
+
+    def _holding(self, rules, windows):
+        """Stateful rules of one metric currently inside an episode."""
+        holding = {}
+        for rule in rules.stateful:
+            window = self._window(rule.id, windows)
+            if window is not None and window[0] is not None:
+                holding[rule.id] = rule
+        return holding
+
+    def _advance(self, rules, holding, value, epoch, windows):
+        """
+        Feed one value to the windows of a metric's stateful rules.
+        Returns (rules due to alarm, rules whose episode ended).
+        """
+        due = []
+        ended = []
+        for rule in list(holding.values()):
+            since, alarmed, newest = self._window(rule.id, windows)
+            if epoch < newest:
+                continue  # Older than what the window has seen; too late to count
+            if rule.exits(value):
+                windows[rule.id] = (None, False, epoch)
+                del holding[rule.id]
+                ended.append(rule)
+                continue
+            if not alarmed and epoch - since >= rule.duration_seconds:
+                due.append(rule)
+                alarmed = True
+            windows[rule.id] = (since, alarmed, epoch)
+        for rule in rules.entering(value):
+            if rule.id in holding:
+                continue
+            window = self._window(rule.id, windows)
+            if window is not None and epoch < window[2]:
+                continue
+            alarmed = rule.duration_seconds <= 0
+            if alarmed:
+                due.append(rule)
+            windows[rule.id] = (epoch, alarmed, epoch)
+            holding[rule.id] = rule
+        return due, ended
+
+    @staticmethod
+    def _alarm(rule, metric, value, timestamp):
+        details = (f"{rule.name}: {metric} {value:g} is {_CONDITION_TEXT[rule.condition]} "
+                   f"threshold {rule.threshold_value:g}")
+        if rule.duration_seconds:
+            details += f" for {rule.duration_seconds}s"
+        return {
+            'timestamp': timestamp,
+            'device_id': rule.device_id,
+            'alarm_type': ALARM_TYPE,
+            'severity': rule.severity,
+            'status': AlarmStatus.ACTIVE,
+            'details': details,
+            'triggered_by_rule_id': rule.id,
+            'occurrence_count': 1,
+            'last_seen': timestamp,
+        }
+
+    def process(self, connection, readings, session=None):
+        """Evaluate new readings and insert the resulting alarms on `connection` (no commit)."""
+        index = self.current_index(connection)
+        if not index:
+            return 0
+        self.sync_alarm_state(connection)
+        session = session if session is not None else db.session()
+        pending = session.info.setdefault('alarm_cooldowns', {})
+        windows = session.info.setdefault('alarm_windows', {})
+        open_rules = session.info.setdefault('alarm_open_rules', {})
+        offline = self.current_offline(connection)
+        cleared = set()
+        coalesced = {}
+        alarms = self.evaluate(readings, pending, index, windows, open_rules, cleared, coalesced, offline)
+        table = Alarm.__table__
+        if coalesced:
+            # Before the clears below, which may close the very alarms the triggers belong to
+            alarms += self._merge_occurrences(connection, session, coalesced)
+        if cleared:
+            # Alarms stored before this batch; the batch's own alarms already carry their final status
+            updated = set_alarm_status(
+                connection, session,
+                [table.c.triggered_by_rule_id.in_(sorted(cleared)),
+                 table.c.status.in_([AlarmStatus.ACTIVE, AlarmStatus.ACKNOWLEDGED])],
+                AlarmStatus.CLEARED,
+            )
+            with self._lock:
+                self.clear_updates += 1
+                self.alarms_cleared += updated
+        if alarms:
+            executemany_rows(connection, table.insert(), table, ALARM_INSERT_COLUMNS, alarms)
+            record_inserted(session, alarms)
+            record_created(session)
+            alarm_notifier.enqueue(connection, session, alarms)
+        if alarms or coalesced or cleared:
+            self.record_state_change(connection, session)
+            # Applied to this process's state at commit; no reload needed for it
+            session.info['alarm_state_version'] = self.state_version(connection)
+        return len(alarms)
+
+    def _merge_occurrences(self, connection, session, coalesced):
+        """
+        Add coalesced triggers to the open alarm of their rule (its newest uncleared one).
+        Returns the alarms to insert instead for rules whose alarm was cleared meanwhile (e.g. by hand).
+        """
+        table = Alarm.__table__
+        open_alarms = dict(connection.execute(
+            db.select(table.c.triggered_by_rule_id, db.func.max(table.c.id))
+            .where(table.c.triggered_by_rule_id.in_(sorted(coalesced)), table.c.status != AlarmStatus.CLEARED)
+            .group_by(table.c.triggered_by_rule_id)
+        ).all())
+        updates = [{'alarm_id': open_alarms[rule_id], 'added': alarm['occurrence_count'], 'seen': alarm['last_seen']}
+                   for rule_id, alarm in coalesced.items() if rule_id in open_alarms]
+        if updates:
+            connection.execute(
+                table.update().where(table.c.id == db.bindparam('alarm_id'))
+                .values(occurrence_count=table.c.occurrence_count + db.bindparam('added'),
+                        last_seen=db.bindparam('seen', type_=table.c.last_seen.type)),
+                updates,
+            )
+            if alarm_events.started:
+                merged = sorted(update['alarm_id'] for update in updates)
+                record_occurrences(session, connection.execute(
+                    db.select(table.c.id, table.c.occurrence_count, table.c.last_seen).where(table.c.id.in_(merged))
+                ).all())
+            with self._lock:
+                self.coalesce_updates += 1
+        return [alarm for rule_id, alarm in coalesced.items() if rule_id not in open_alarms]
+
+    def commit_cooldowns(self, fired):
+        """Start the cooldowns of alarms whose transaction committed."""
+        with self._lock:
+            for rule_id, epoch in fired.items():
+                self._last_fired[rule_id] = max(self._last_fired.get(rule_id, epoch), epoch)
+
+    def commit_windows(self, windows):
+        """Keep the streaming windows advanced by a committed transaction (unless a newer one won)."""
+        with self._lock:
+            for rule_id, window in windows.items():
+                current = self._windows.get(rule_id)
+                if rule_id in self._signatures and (current is None or window[2] >= current[2]):
+                    self._windows[rule_id] = window
+
+    def commit_open_rules(self, open_rules):
+        """Track which rules have uncleared alarms after a committed transaction."""
+        with self._lock:
+            # Copied, not updated in place: evaluate() reads the set without the lock
+            opened = {rule_id for rule_id, is_open in open_rules.items() if is_open}
+            self._open = (self._open - set(open_rules)) | opened
+
+    def stats(self):
+        with self._lock:
+            seconds = self.evaluation_seconds
+            return {
+                'rules_indexed': self.rule_count,
+                'stateful_rules': self.stateful_rule_count,
+                'windows_in_episode': sum(1 for window in self._windows.values() if window[0] is not None),
+                'index_builds': self.index_builds,
+                'rules_version': self._version,
+                'version_checks': self.version_checks,
+                'stale_index_rebuilds': self.stale_index_rebuilds,
+                'readings_evaluated': self.readings_evaluated,
+                'rules_evaluated': self.rules_evaluated,
+                'alarms_raised': self.alarms_raised,
+                'suppressed_by_cooldown': self.suppressed_by_cooldown,
+                'auto_clear': self.auto_clear,
+                'rules_with_uncleared_alarms': len(self._open),
+                'clear_transitions': self.clear_transitions,
+                'clear_updates': self.clear_updates,
+                'alarms_cleared': self.alarms_cleared,
+                'coalesce': self.coalesce,
+                'occurrences_coalesced': self.occurrences_coalesced,
+                'coalesce_updates': self.coalesce_updates,
+                'offline_devices': len(self._offline) if self._offline is not None else None,
+                'offline_version': self._offline_version,
+                'offline_version_checks': self.offline_version_checks,
+                'stale_offline_reloads': self.stale_offline_reloads,
+                'alarm_state_version': self._state_version,
+                'state_version_checks': self.state_version_checks,
+                'stale_state_reloads': self.stale_state_reloads,
+                'suppressed_by_parent': self.suppressed_by_parent,
+                'avg_us_per_reading': seconds / self.readings_evaluated * 1e6 if self.readings_evaluated else None,
+                'rules_evaluated_per_second': self.rules_evaluated / seconds if seconds else None,
+            }
+
+
+alarm_engine = AlarmEngine()
+
+
+# --- Hooks ---
+# Core bulk inserts (app/ingest.py) call alarm_engine.process() themselves.
+
+@event.listens_for(SensorData, 'after_insert')
+def _evaluate_orm_insert(mapper, connection, target):
+    """Evaluate readings added through the ORM."""
+    if target.__dict__.get('timestamp') is None:
+        return
+    reading = {column: target.__dict__.get(column) for column in ['timestamp'] + SENSOR_METRIC_COLUMNS}
+    alarm_engine.process(connection, [reading], Session.object_session(target))
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_rule_change(session, flush_context):
+    changed = (*session.new, *session.dirty, *session.deleted)
+    if any(isinstance(obj, AlarmRule) for obj in changed):
+        if not session.info.get('alarm_rules_changed'):
+            # Once per transaction; committed (or rolled back) together with the rule change
+            alarm_engine.bump_rules_version(session.connection())
+        session.info['alarm_rules_changed'] = True
+    if any(isinstance(obj, Alarm) and obj.triggered_by_rule_id is not None for obj in (*session.new, *session.dirty)):
+        alarm_engine.record_state_change(session.connection(), session)
+    if any(isinstance(obj, Alarm) and obj.alarm_type == DEVICE_OFFLINE_ALARM_TYPE for obj in changed):
+        if not session.info.get('alarm_offline_changed'):
+            alarm_engine.bump_offline_version(session.connection())
+        session.info['alarm_offline_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_after_commit(session):
+    fired = session.info.pop('alarm_cooldowns', None)
+    if fired:
+        alarm_engine.commit_cooldowns(fired)
+    windows = session.info.pop('alarm_windows', None)
+    if windows:
+        alarm_engine.commit_windows(windows)
+    open_rules = session.info.pop('alarm_open_rules', None)
+    if open_rules:
+        alarm_engine.commit_open_rules(open_rules)
+    if session.info.pop('alarm_rules_changed', False):
+        alarm_engine.invalidate()
+    if session.info.pop('alarm_offline_changed', False):
+        alarm_engine.invalidate_offline()
+    session.info.pop('alarm_state_changed', None)
+    state_version = session.info.pop('alarm_state_version', None)
+    if state_version is not None:
+        alarm_engine.commit_state_version(state_version)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_after_rollback(session):
+    session.info.pop('alarm_cooldowns', None)
+    session.info.pop('alarm_windows', None)
+    session.info.pop('alarm_open_rules', None)
+    session.info.pop('alarm_rules_changed', None)
+    session.info.pop('alarm_offline_changed', None)
+    session.info.pop('alarm_state_changed', None)
+    session.info.pop('alarm_state_version', None)
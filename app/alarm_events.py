@@ -0,0 +1,347 @@
+"""
+Server-Sent Events stream of alarm changes for the alarms page.
+
+Every event has an id '<epoch>-<sequence>', where the sequence increases by
+one per event and the epoch identifies this process's run. The last
+ALARM_EVENTS_BUFFER events are kept in memory, so a client reconnecting with
+Last-Event-ID gets exactly the events it missed. Only if they are no longer
+buffered (or the id comes from another process run) does it get a 'reset'
+event and reload its first page.
+
+Events:
+  created     {"alarms": [alarm, ...]}, alarms as listed by /api/alarms
+  status      {"ids": [...], "status": "acknowledged"}
+  occurrence  {"alarms": [{"id", "occurrence_count", "last_seen"}, ...]}
+  reset       {} - the client can no longer be brought up to date event by event
+
+New alarms are found by a background thread that reads the alarms above the
+highest id it has published. Commits of this process that insert alarms wake
+it, and it also polls every ALARM_EVENTS_POLL_INTERVAL seconds, which picks up
+alarms raised by other worker processes. Status and occurrence changes of this
+process are recorded as they are written and published once their transaction
+commits. Those of other workers are found by the same poll: every change sets
+alarms.updated_at, and the alarms changed since the last one seen (less
+CHANGE_WINDOW, for transactions that commit late) are compared with the state
+last published for them. Nothing is recorded until the first client
+subscribes.
+"""
+import json
+import logging
+import threading
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, attributes, joinedload
+
+from app.database import db
+from app.live_updates import format_sse
+from app.models import Alarm
+
+logger = logging.getLogger(__name__)
+
+# Alarms below the highest published id that are still checked for: with concurrent writers
+# an alarm can commit after one with a higher id has already been published
+GAP_WINDOW = 200
+# Alarms changed up to this long before the last change seen are read again: a transaction
+# can commit after a later change has already been published
+CHANGE_WINDOW = timedelta(seconds=30)
+# Larger changes (a bulk status update, an alarm storm) are sent as a 'reset' instead
+MAX_ALARMS_PER_EVENT = 100
+
+
+class AlarmEventStream:
+    """Numbered alarm change events in a bounded replay buffer, streamed to every subscriber."""
+
+    def __init__(self, buffer_size=1000, poll_interval=2.0, heartbeat_interval=15.0):
+        self.buffer_size = buffer_size
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.epoch = uuid.uuid4().hex[:8]
+        self._app = None
+        self._condition = threading.Condition()
+        self._sequence = 0
+        self._buffer = deque(maxlen=buffer_size)  # (sequence, SSE message)
+        self._wake = threading.Event()
+        self._thread = None
+        self.started = False
+        # Highest alarm id published as created, and the published ids of the gap window below it
+        self._high_water = None
+        self._recent_ids = set()
+        # Latest updated_at read, and alarm id -> (status value, occurrence_count, updated_at) as last published
+        self._changes_since = None
+        self._published = {}
+        self.subscribers = 0
+        self.events_published = 0
+        self.replayed = 0
+        self.resets_sent = 0
+        self.changes_polled = 0
+
+    def init_app(self, app):
+        self._app = app
+        self.buffer_size = int(app.config.get('ALARM_EVENTS_BUFFER', self.buffer_size))
+        self.poll_interval = float(app.config.get('ALARM_EVENTS_POLL_INTERVAL', self.poll_interval))
+        self._buffer = deque(maxlen=self.buffer_size)
+
+    # --- Publishing ---
+
+    def publish(self, name, payload):
+        with self._condition:
+            self._sequence += 1
+            message = format_sse(name, json.dumps(payload), f'{self.epoch}-{self._sequence}')
+            self._buffer.append((self._sequence, message))
+            self.events_published += 1
+            self._note_published(name, payload)
+            self._condition.notify_all()
+
+    def _note_published(self, name, payload):
+        """Remember the alarm state an event published (call with the lock held)."""
+        now = datetime.utcnow()
+        if name == 'created':
+            for alarm in payload['alarms']:
+                self._published[alarm['id']] = (alarm['status'], alarm['occurrence_count'], now)
+        elif name == 'status':
+            for alarm_id in payload['ids']:
+                _, count, _ = self._published.get(alarm_id, (None, None, None))
+                self._published[alarm_id] = (payload['status'], count, now)
+        elif name == 'occurrence':
+            for alarm in payload['alarms']:
+                status, _, _ = self._published.get(alarm['id'], (None, None, None))
+                self._published[alarm['id']] = (status, alarm['occurrence_count'], now)
+
+    def wake(self):
+        """Look for new alarms now instead of at the next poll."""
+        self._wake.set()
+
+    def _poll(self):
+        self._poll_created()
+        self._poll_changes()
+
+    def _poll_created(self):
+        table = Alarm.__table__
+        floor = (self._high_water or 0) - GAP_WINDOW
+        if self._high_water is None:
+            # Alarms that existed before the first subscriber are not events
+            self._high_water = db.session.query(db.func.max(table.c.id)).scalar() or 0
+            floor = self._high_water - GAP_WINDOW
+            self._recent_ids = set(db.session.execute(db.select(table.c.id).where(table.c.id > floor)).scalars())
+            return
+        new_ids = set(db.session.execute(db.select(table.c.id).where(table.c.id > floor)).scalars()) - self._recent_ids
+        if not new_ids:
+            return
+        self._recent_ids |= new_ids
+        self._high_water = max(self._high_water, max(new_ids))
+        self._recent_ids = {alarm_id for alarm_id in self._recent_ids if alarm_id > self._high_water - GAP_WINDOW}
+        if len(new_ids) > MAX_ALARMS_PER_EVENT:
+            self.publish('reset', {})
+            return
+        alarms = (Alarm.query.options(joinedload(Alarm.device)).filter(Alarm.id.in_(sorted(new_ids)))
+                  .order_by(Alarm.id).all())
+        self.publish('created', {'alarms': [alarm.to_dict() for alarm in alarms]})
+
+    def _poll_changes(self):
+        """Publish the status and occurrence changes other processes made since the last poll."""
+        table = Alarm.__table__
+        if self._changes_since is None:
+            # Changes made before the first subscriber are not events
+            self._changes_since = (db.session.query(db.func.max(table.c.updated_at)).scalar()
+                                   or datetime.utcnow())
+            publish = False
+        else:
+            publish = True
+        rows = db.session.execute(
+            db.select(table.c.id, table.c.status, table.c.occurrence_count, table.c.last_seen, table.c.updated_at)
+            .where(table.c.updated_at >= self._changes_since - CHANGE_WINDOW)
+        ).all()
+        by_status = {}
+        occurrences = []
+        with self._condition:
+            for alarm_id, status, count, last_seen, updated_at in rows:
+                known = self._published.get(alarm_id)
+                if known is None:
+                    changed_status, changed_count = True, count > 1
+                else:
+                    # Unknown parts (None) were published by the other kind of event only
+                    changed_status = known[0] is not None and known[0] != status.value
+                    changed_count = known[1] is not None and known[1] != count
+                if changed_status:
+                    by_status.setdefault(status, []).append(alarm_id)
+                if changed_count:
+                    occurrences.append((alarm_id, count, last_seen))
+                self._published[alarm_id] = (status.value, count, updated_at)
+                self._changes_since = max(self._changes_since, updated_at)
+            floor = self._changes_since - CHANGE_WINDOW
+            self._published = {alarm_id: state for alarm_id, state in self._published.items() if state[2] >= floor}
+            self.changes_polled += len(rows)
+        if not publish:
+            return
+        if sum(map(len, by_status.values())) > MAX_ALARMS_PER_EVENT or len(occurrences) > MAX_ALARMS_PER_EVENT:
+            self.publish('reset', {})
+            return
+        for status, ids in by_status.items():
+            self.publish('status', {'ids': sorted(ids), 'status': status.value})
+        if occurrences:
+            self.publish('occurrence', occurrence_payload(occurrences))
+
+    def _run(self):
+        while True:
+            try:
+                with self._app.app_context():
+                    self._poll()
+                    db.session.remove()
+            except Exception:
+                logger.exception('Alarm event poll failed')
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _ensure_started(self):
+        with self._condition:
+            if self._thread is None and self._app is not None:
+                self.started = True
+                self._thread = threading.Thread(target=self._run, name='alarm-events', daemon=True)
+                self._thread.start()
+
+    # --- Streaming ---
+
+    def _sequence_of(self, last_event_id):
+        """Sequence number of a Last-Event-ID of this process run, else None."""
+        epoch, _, sequence = (last_event_id or '').partition('-')
+        if epoch != self.epoch or not sequence.isdigit():
+            return None
+        return int(sequence)
+
+    def _missed(self, position):
+        """Buffered messages after `position`, or None if some were already dropped (call with the lock held)."""
+        oldest = self._buffer[0][0] if self._buffer else self._sequence + 1
+        if position < oldest - 1:
+            return None
+        return [message for sequence, message in self._buffer if sequence > position]
+
+    def stream(self, last_event_id=None):
+        """SSE generator for one client: the events it missed (or a reset), then new ones and keepalives."""
+        self._ensure_started()
+        with self._condition:
+            self.subscribers += 1
+            position = self._sequence_of(last_event_id)
+            pending = None if position is None or position > self._sequence else self._missed(position)
+            if pending is None:
+                position = self._sequence
+                if last_event_id:
+                    self.resets_sent += 1
+                first = format_sse('reset' if last_event_id else 'hello', '{}', f'{self.epoch}-{position}')
+            else:
+                self.replayed += len(pending)
+                position = self._sequence
+                first = ''.join(pending)
+        try:
+            if first:
+                yield first
+            while True:
+                with self._condition:
+                    self._condition.wait_for(lambda: self._sequence > position, self.heartbeat_interval)
+                    if self._sequence == position:
+                        messages = None
+                    else:
+                        missed = self._missed(position)
+                        if missed is None:
+                            # Fell behind by more than the buffer holds
+                            self.resets_sent += 1
+                            messages = [format_sse('reset', '{}', f'{self.epoch}-{self._sequence}')]
+                        else:
+                            messages = missed
+                        position = self._sequence
+                yield ''.join(messages) if messages else ': keepalive\n\n'
+        finally:
+            with self._condition:
+                self.subscribers -= 1
+
+    def stats(self):
+        with self._condition:
+            return {
+                'subscribers': self.subscribers,
+                'epoch': self.epoch,
+                'last_event_id': f'{self.epoch}-{self._sequence}',
+                'events_published': self.events_published,
+                'buffered': len(self._buffer),
+                'buffer_size': self.buffer_size,
+                'replayed': self.replayed,
+                'resets_sent': self.resets_sent,
+                'changes_polled': self.changes_polled,
+                'poll_interval_seconds': self.poll_interval,
+            }
+
+
+alarm_events = AlarmEventStream()
+
+
+# --- Changes of Core writes ---
+# ORM status and occurrence changes of Alarm objects are picked up by the hooks below.
+
+def record_event(session, name, payload):
+    """Publish an event once `session` commits."""
+    session.info.setdefault('alarm_events', []).append((name, payload))
+
+
+def record_created(session):
+    """Alarms were inserted with Core statements: look for them right after the commit."""
+    session.info['alarm_events_wake'] = True
+
+
+def record_status_change(session, ids, status):
+    if len(ids) > MAX_ALARMS_PER_EVENT:
+        record_event(session, 'reset', {})
+    elif ids:
+        record_event(session, 'status', {'ids': sorted(ids), 'status': status.value})
+
+
+def occurrence_payload(rows):
+    """Payload of an occurrence event of (id, occurrence_count, last_seen) rows."""
+    return {'alarms': [
+        {'id': alarm_id, 'occurrence_count': count, 'last_seen': last_seen.isoformat() if last_seen else None}
+        for alarm_id, count, last_seen in rows
+    ]}
+
+
+def record_occurrences(session, rows):
+    """Occurrence events of (id, occurrence_count, last_seen) rows."""
+    if len(rows) > MAX_ALARMS_PER_EVENT:
+        record_event(session, 'reset', {})
+    elif rows:
+        record_event(session, 'occurrence', occurrence_payload(rows))
+
+
+# --- Hooks ---
+
+@event.listens_for(Session, 'after_flush')
+def _note_orm_alarm_changes(session, flush_context):
+    if not alarm_events.started:
+        return
+    if any(isinstance(obj, Alarm) for obj in session.new):
+        session.info['alarm_events_wake'] = True
+    by_status = {}
+    occurrences = []
+    for obj in session.dirty:
+        if not isinstance(obj, Alarm) or not session.is_modified(obj):
+            continue
+        if attributes.get_history(obj, 'status').has_changes():
+            by_status.setdefault(obj.status, []).append(obj.id)
+        if attributes.get_history(obj, 'occurrence_count').has_changes():
+            occurrences.append((obj.id, obj.occurrence_count, obj.last_seen))
+    for status, ids in by_status.items():
+        record_status_change(session, ids, status)
+    record_occurrences(session, occurrences)
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_after_commit(session):
+    for name, payload in session.info.pop('alarm_events', ()):
+        alarm_events.publish(name, payload)
+    if session.info.pop('alarm_events_wake', False):
+        alarm_events.wake()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_events(session):
+    session.info.pop('alarm_events', None)
+    session.info.pop('alarm_events_wake', None)
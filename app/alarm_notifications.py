@@ -0,0 +1,438 @@
+"""
+Durable, asynchronous delivery of alarm notifications.
+
+Raising an alarm never waits for a webhook or a mail relay. The transaction
+that inserts alarms also inserts one alarm_notifications row per alarm and
+configured sink (ALARM_NOTIFICATION_SINKS names a JSON file, see
+load_sinks()), and background threads deliver them after the commit. Every
+sink has its own workers, which only claim that sink's rows, so a slow or
+unreachable sink delays nothing but its own queue.
+
+A failed delivery is retried after ALARM_NOTIFICATION_BACKOFF seconds,
+doubling with every further failure (at most MAX_BACKOFF_SECONDS), until
+ALARM_NOTIFICATION_MAX_ATTEMPTS is reached and the row is kept as 'dead'.
+Workers claim rows with a lease, so several processes can share the queue
+and rows of a worker that died are claimed again once its lease expires.
+Delivery is therefore at least once.
+"""
+import enum
+import json
+import logging
+import smtplib
+import threading
+import time
+import urllib.request
+import uuid
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.database import db, executemany_rows
+from app.models import Alarm, AlarmNotification, AlarmSeverity
+
+logger = logging.getLogger(__name__)
+
+# Rows a worker claims and delivers at a time
+CLAIM_BATCH_SIZE = 20
+# Longest wait between two attempts, however many failed
+MAX_BACKOFF_SECONDS = 3600
+# An idle worker looks for due retries (and rows queued by other processes) this often
+IDLE_POLL_SECONDS = 5.0
+QUEUE_INSERT_COLUMNS = ['sink', 'payload', 'status', 'attempts', 'next_attempt_at', 'created_at']
+
+_SEVERITY_RANK = {AlarmSeverity.INFO: 0, AlarmSeverity.WARNING: 1, AlarmSeverity.CRITICAL: 2}
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _naive(timestamp):
+    """Naive UTC datetime, so timestamps read back from the table compare with the inserted ones."""
+    if timestamp is not None and timestamp.tzinfo is not None:
+        return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+class Sink:
+    """A destination for alarm notifications; subclasses implement deliver()."""
+
+    def __init__(self, name, min_severity='info', timeout=5.0, workers=1):
+        self.name = name
+        self.min_severity = AlarmSeverity(min_severity)
+        self.timeout = float(timeout)
+        self.workers = int(workers)
+
+    def accepts(self, severity):
+        return _SEVERITY_RANK[severity] >= _SEVERITY_RANK[self.min_severity]
+
+    def deliver(self, alarm):
+        """Send one alarm (payload dict); raise to have it retried."""
+        raise NotImplementedError
+
+
+class WebhookSink(Sink):
+    """POSTs the alarm as JSON; an error status or connection failure counts as failed."""
+    kind = 'webhook'
+
+    def __init__(self, name, url, headers=None, **options):
+        super().__init__(name, **options)
+        self.url = url
+        self.headers = dict(headers or {})
+
+    def deliver(self, alarm):
+        request = urllib.request.Request(self.url, data=json.dumps(alarm).encode(), method='POST',
+                                         headers={'Content-Type': 'application/json', **self.headers})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class SmtpSink(Sink):
+    """Mails the alarm through an SMTP relay."""
+    kind = 'smtp'
+
+    def __init__(self, name, host, sender, recipients, port=25, starttls=False, username=None, password=None,
+                 **options):
+        super().__init__(name, **options)
+        self.host = host
+        self.port = int(port)
+        self.sender = sender
+        self.recipients = list(recipients)
+        self.starttls = starttls
+        self.username = username
+        self.password = password
+
+    def deliver(self, alarm):
+        message = EmailMessage()
+        message['Subject'] = f"[{str(alarm.get('severity', '')).upper()}] {alarm.get('alarm_type')}"
+        message['From'] = self.sender
+        message['To'] = ', '.join(self.recipients)
+        message.set_content('\n'.join(f'{key}: {value}' for key, value in alarm.items()))
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            smtp.send_message(message)
+
+
+SINK_TYPES = {sink.kind: sink for sink in (WebhookSink, SmtpSink)}
+
+
+def load_sinks(path):
+    """
+    Sinks from a JSON file of the form
+    [{"name": "ops", "type": "webhook", "url": "https://..", "headers": {..}},
+     {"name": "mail", "type": "smtp", "host": "relay.local", "sender": "..", "recipients": [".."]}].
+    Every sink also takes min_severity (default info), timeout (seconds, default 5)
+    and workers (delivery threads, default 1).
+    """
+    with open(path) as f:
+        entries = json.load(f)
+    sinks = []
+    for entry in entries:
+        entry = dict(entry)
+        kind = entry.pop('type', WebhookSink.kind)
+        if kind not in SINK_TYPES:
+            raise ValueError(f'Unknown notification sink type: {kind}')
+        sinks.append(SINK_TYPES[kind](**entry))
+    names = [sink.name for sink in sinks]
+    if len(set(names)) != len(names):
+        raise ValueError('Notification sink names must be unique')
+    return sinks
+
+
+def alarm_payload(alarm, alarm_id):
+    """
+    JSON-ready copy of an alarm row dict (enum members and datetimes converted). It carries the
+    alarm's id as alarm_id, which receivers use to drop repeated deliveries and to link to /api/alarms/<id>.
+    """
+    payload = {'alarm_id': alarm_id}
+    for key, value in alarm.items():
+        if key == 'id':
+            continue
+        if isinstance(value, enum.Enum):
+            value = value.value
+        elif isinstance(value, datetime):
+            value = value.isoformat()
+        payload[key] = value
+    return payload
+
+
+class _SinkCounters:
+    """Delivery counters of one sink in this process."""
+
+    def __init__(self):
+        self.delivered = 0
+        self.failed_attempts = 0
+        self.gave_up = 0
+        self.delivery_seconds = 0.0
+        self.last_error = None
+        self.recent = deque()  # monotonic times of the deliveries of the last minute
+
+
+class AlarmNotifier:
+    """Queues alarm notifications in the database and delivers them on per-sink worker threads."""
+
+    def __init__(self, max_attempts=8, backoff_seconds=5.0):
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.sinks = {}
+        self._app = None
+        self._lock = threading.Lock()
+        self._wake = {}
+        self._counters = {}
+        self._threads = []
+        self._started = False
+        self.queued = 0
+
+    def init_app(self, app):
+        self._app = app
+        self.max_attempts = int(app.config.get('ALARM_NOTIFICATION_MAX_ATTEMPTS', self.max_attempts))
+        self.backoff_seconds = float(app.config.get('ALARM_NOTIFICATION_BACKOFF', self.backoff_seconds))
+        path = app.config.get('ALARM_NOTIFICATION_SINKS')
+        if path:
+            self.set_sinks(load_sinks(path))
+            # Rows left over from an earlier run are delivered once the process serves requests
+            app.before_request(self._ensure_started)
+
+    def set_sinks(self, sinks):
+        with self._lock:
+            if self._started:
+                raise RuntimeError('Notification sinks cannot change once delivery has started')
+            self.sinks = {sink.name: sink for sink in sinks}
+            self._wake = {sink.name: threading.Event() for sink in sinks}
+            self._counters = {sink.name: _SinkCounters() for sink in sinks}
+
+    # --- Queueing ---
+
+    def enqueue(self, connection, session, alarms):
+        """
+        Queue alarm row dicts for every sink that wants their severity, on `connection`
+        (in the caller's transaction). Delivery starts once `session` commits.
+        """
+        if not self.sinks or not alarms:
+            return 0
+        now = _utcnow()
+        rows = []
+        for alarm, alarm_id in zip(alarms, self._alarm_ids(connection, alarms)):
+            payload = json.dumps(alarm_payload(alarm, alarm_id))
+            for sink in self.sinks.values():
+                if sink.accepts(alarm['severity']):
+                    rows.append({'sink': sink.name, 'payload': payload, 'status': AlarmNotification.PENDING,
+                                 'attempts': 0, 'next_attempt_at': now, 'created_at': now})
+        if rows:
+            table = AlarmNotification.__table__
+            executemany_rows(connection, table.insert(), table, QUEUE_INSERT_COLUMNS, rows)
+            session.info['alarm_notifications_queued'] = session.info.get('alarm_notifications_queued', 0) + len(rows)
+        return len(rows)
+
+    @staticmethod
+    def _alarm_ids(connection, alarms):
+        """
+        Ids of alarm row dicts, in order. Rows inserted with executemany() have none; they are
+        read back by rule and timestamp (a rule raises at most one alarm per reading).
+        """
+        missing = [alarm for alarm in alarms if alarm.get('id') is None]
+        found = {}
+        if missing:
+            table = Alarm.__table__
+            timestamps = [alarm['timestamp'] for alarm in missing]
+            rows = connection.execute(
+                db.select(table.c.id, table.c.triggered_by_rule_id, table.c.timestamp)
+                .where(table.c.triggered_by_rule_id.in_(sorted({alarm['triggered_by_rule_id'] for alarm in missing})),
+                       table.c.timestamp.between(min(timestamps), max(timestamps)))
+                .order_by(table.c.id)
+            )
+            # Ascending ids: the alarm just inserted wins over an older one of the same rule and time
+            found = {(rule_id, _naive(timestamp)): alarm_id for alarm_id, rule_id, timestamp in rows}
+        return [alarm.get('id') or found.get((alarm['triggered_by_rule_id'], _naive(alarm['timestamp'])))
+                for alarm in alarms]
+
+    def committed(self, count):
+        """Rows queued by a committed transaction: wake the workers."""
+        with self._lock:
+            self.queued += count
+        self._ensure_started()
+        for wake in self._wake.values():
+            wake.set()
+
+    # --- Delivery ---
+
+    def _ensure_started(self):
+        if self._started:
+            return
+        with self._lock:
+            if self._started or self._app is None or not self.sinks:
+                return
+            for sink in self.sinks.values():
+                for number in range(sink.workers):
+                    thread = threading.Thread(target=self._run, args=(sink,), daemon=True,
+                                              name=f'alarm-notify-{sink.name}-{number}')
+                    thread.start()
+                    self._threads.append(thread)
+            self._started = True
+
+    def _run(self, sink):
+        wake = self._wake[sink.name]
+        while True:
+            wake.clear()  # Before claiming, so a commit during the claim is not missed
+            claimed = None
+            try:
+                with self._app.app_context():
+                    claimed = self._claim(sink)
+                    if claimed:
+                        self._deliver(sink, claimed)
+            except Exception:
+                logger.exception('Alarm notification worker of sink %s failed', sink.name)
+            if not claimed:
+                wake.wait(IDLE_POLL_SECONDS)
+
+    def _claim(self, sink):
+        """Lease up to CLAIM_BATCH_SIZE due rows of `sink`; returns their (id, payload, attempts)."""
+        table = AlarmNotification.__table__
+        now = _utcnow()
+        unclaimed = db.or_(table.c.claimed_until.is_(None), table.c.claimed_until < now)
+        with db.engine.begin() as connection:
+            ids = connection.execute(
+                db.select(table.c.id)
+                .where(table.c.sink == sink.name, table.c.status == AlarmNotification.PENDING,
+                       table.c.next_attempt_at <= now, unclaimed)
+                .order_by(table.c.next_attempt_at, table.c.id)
+                .limit(CLAIM_BATCH_SIZE)
+            ).scalars().all()
+            if not ids:
+                return []
+            # Deliveries run one after the other, so the lease covers the whole batch timing out
+            token = uuid.uuid4().hex
+            lease = now + timedelta(seconds=len(ids) * sink.timeout + 30)
+            # Re-checked here: a worker of another process may have claimed some since the SELECT
+            connection.execute(table.update().where(table.c.id.in_(ids), unclaimed)
+                               .values(claimed_until=lease, claim_token=token))
+            return connection.execute(
+                db.select(table.c.id, table.c.payload, table.c.attempts)
+                .where(table.c.claim_token == token).order_by(table.c.id)
+            ).all()
+
+    def _deliver(self, sink, claimed):
+        counters = self._counters[sink.name]
+        delivered, retries, dead = [], [], []
+        for notification_id, payload, attempts in claimed:
+            attempts += 1
+            started = time.perf_counter()
+            try:
+                sink.deliver(json.loads(payload))
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'[:500]
+                with self._lock:
+                    counters.failed_attempts += 1
+                    counters.last_error = error
+                row = {'notification_id': notification_id, 'attempts': attempts, 'error': error}
+                if attempts >= self.max_attempts:
+                    dead.append(row)
+                else:
+                    backoff = min(self.backoff_seconds * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS)
+                    retries.append(dict(row, due=_utcnow() + timedelta(seconds=backoff)))
+            else:
+                finished = time.perf_counter()
+                delivered.append({'notification_id': notification_id, 'attempts': attempts, 'at': _utcnow()})
+                with self._lock:
+                    counters.delivered += 1
+                    counters.delivery_seconds += finished - started
+                    counters.recent.append(time.monotonic())
+
+        table = AlarmNotification.__table__
+        update = table.update().where(table.c.id == db.bindparam('notification_id'))
+        released = {'claimed_until': None, 'claim_token': None, 'attempts': db.bindparam('attempts')}
+        with db.engine.begin() as connection:
+            if delivered:
+                connection.execute(update.values(
+                    status=AlarmNotification.DELIVERED,
+                    delivered_at=db.bindparam('at', type_=table.c.delivered_at.type), **released), delivered)
+            if retries:
+                connection.execute(update.values(
+                    next_attempt_at=db.bindparam('due', type_=table.c.next_attempt_at.type),
+                    last_error=db.bindparam('error'), **released), retries)
+            if dead:
+                connection.execute(update.values(
+                    status=AlarmNotification.DEAD, last_error=db.bindparam('error'), **released), dead)
+        if dead:
+            with self._lock:
+                counters.gave_up += len(dead)
+            logger.warning('Gave up delivering %d alarm notification(s) to sink %s', len(dead), sink.name)
+
+    # --- Monitoring ---
+
+    def stats(self):
+        """Per sink: backlog in the database, plus throughput and failures of this process."""
+        table = AlarmNotification.__table__
+        backlog = {}
+        if self.sinks:
+            rows = db.session.execute(
+                db.select(table.c.sink, table.c.status, db.func.count(), db.func.min(table.c.created_at))
+                .where(table.c.status.in_([AlarmNotification.PENDING, AlarmNotification.DEAD]))
+                .group_by(table.c.sink, table.c.status)
+            ).all()
+            backlog = {(sink, status): (count, oldest) for sink, status, count, oldest in rows}
+        now = _utcnow()
+        window_start = time.monotonic() - 60
+        sinks = {}
+        with self._lock:
+            for name, sink in self.sinks.items():
+                counters = self._counters[name]
+                while counters.recent and counters.recent[0] < window_start:
+                    counters.recent.popleft()
+                pending, oldest = backlog.get((name, AlarmNotification.PENDING), (0, None))
+                sinks[name] = {
+                    'type': sink.kind,
+                    'min_severity': sink.min_severity.value,
+                    'workers': sink.workers,
+                    'pending': pending,
+                    'oldest_pending_seconds': round((now - oldest).total_seconds(), 1) if oldest else None,
+                    'dead': backlog.get((name, AlarmNotification.DEAD), (0, None))[0],
+                    'delivered': counters.delivered,
+                    'deliveries_per_second': round(len(counters.recent) / 60, 2),
+                    'avg_delivery_ms': round(counters.delivery_seconds / counters.delivered * 1000, 1)
+                        if counters.delivered else None,
+                    'failed_attempts': counters.failed_attempts,
+                    'gave_up': counters.gave_up,
+                    'last_error': counters.last_error,
+                }
+            return {
+                'queued': self.queued,
+                'workers_running': self._started,
+                'max_attempts': self.max_attempts,
+                'backoff_seconds': self.backoff_seconds,
+                'sinks': sinks,
+            }
+
+
+alarm_notifier = AlarmNotifier()
+
+
+# --- Hooks ---
+# Core inserts of the alarm engine call alarm_notifier.enqueue() themselves.
+
+@event.listens_for(Session, 'after_flush')
+def _queue_orm_alarms(session, flush_context):
+    if not alarm_notifier.sinks:
+        return
+    alarms = [{column.key: getattr(obj, column.key) for column in Alarm.__table__.columns}
+              for obj in session.new if isinstance(obj, Alarm)]
+    if alarms:
+        alarm_notifier.enqueue(session.connection(), session, alarms)
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_after_commit(session):
+    queued = session.info.pop('alarm_notifications_queued', 0)
+    if queued:
+        alarm_notifier.committed(queued)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_notifications(session):
+    session.info.pop('alarm_notifications_queued', None)
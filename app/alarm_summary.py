@@ -0,0 +1,224 @@
+"""
+Alarm counts by status and severity, kept in memory for the header badge.
+
+/api/alarms/summary answers from counters instead of counting the alarms
+table: every alarm insert and status change records its (status, severity)
+deltas in the session, and they are added to the counters once the
+transaction commits. A background thread recounts the table every
+ALARM_SUMMARY_RECONCILE_SECONDS as a safety net for writes made by other
+processes, cascades and raw SQL; the drift it corrects is reported in the stats.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, attributes
+
+from app.alarm_events import MAX_ALARMS_PER_EVENT, alarm_events, record_event, record_status_change
+from app.database import db
+from app.models import Alarm, AlarmSeverity, AlarmStatus
+
+logger = logging.getLogger(__name__)
+
+
+class AlarmSummary:
+    """Thread-safe {(status, severity): count} of the alarms table."""
+
+    def __init__(self, reconcile_seconds=60.0):
+        self.reconcile_seconds = reconcile_seconds
+        self._app = None
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._loaded = False
+        self._reconciled_at = None
+        # Bumped by every applied delta, so a recount that raced with a commit is discarded
+        self._generation = 0
+        self._thread = None
+        self.hits = 0
+        self.deltas_applied = 0
+        self.reconciliations = 0
+        self.reconcile_conflicts = 0
+        self.drift_corrected = 0
+
+    def init_app(self, app):
+        self._app = app
+        self.reconcile_seconds = float(app.config.get('ALARM_SUMMARY_RECONCILE_SECONDS', self.reconcile_seconds))
+
+    def get(self):
+        """Counts by status, by severity and of active alarms by severity."""
+        if not self._loaded:
+            # First call of this process: count once in the request, then keep up incrementally
+            self.reconcile()
+            self._ensure_started()
+        with self._lock:
+            self.hits += 1
+            counts = dict(self._counts)
+            reconciled_at = self._reconciled_at
+        by_status = {status.value: 0 for status in AlarmStatus}
+        by_severity = {severity.value: 0 for severity in AlarmSeverity}
+        active_by_severity = dict(by_severity)
+        for (status, severity), count in counts.items():
+            by_status[status.value] += count
+            by_severity[severity.value] += count
+            if status == AlarmStatus.ACTIVE:
+                active_by_severity[severity.value] += count
+        return {
+            'total': sum(by_status.values()),
+            'status': by_status,
+            'severity': by_severity,
+            'active_by_severity': active_by_severity,
+            'reconciled_seconds_ago': round(time.monotonic() - reconciled_at, 1) if reconciled_at else None,
+        }
+
+    def apply(self, deltas):
+        """Add the (status, severity) deltas of a committed transaction."""
+        with self._lock:
+            self._generation += 1
+            if not self._loaded:
+                return  # The first recount will include them
+            for key, delta in deltas.items():
+                self._counts[key] += delta
+                if not self._counts[key]:
+                    del self._counts[key]
+            self.deltas_applied += 1
+
+    def reconcile(self, attempts=3):
+        """Recount the table and replace the counters; returns False if commits kept racing with it."""
+        for _ in range(attempts):
+            with self._lock:
+                generation = self._generation
+            # Own connection: the caller's session may be in the middle of a transaction
+            with db.engine.connect() as connection:
+                rows = connection.execute(db.select(Alarm.status, Alarm.severity, db.func.count())
+                                          .group_by(Alarm.status, Alarm.severity)).all()
+            counts = Counter({(status, severity): count for status, severity, count in rows})
+            with self._lock:
+                if generation != self._generation:
+                    self.reconcile_conflicts += 1
+                    continue
+                if self._loaded:
+                    keys = set(counts) | set(self._counts)
+                    self.drift_corrected += sum(abs(counts[key] - self._counts[key]) for key in keys)
+                self._counts = counts
+                self._loaded = True
+                self._reconciled_at = time.monotonic()
+                self.reconciliations += 1
+                return True
+        return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded': self._loaded,
+                'hits': self.hits,
+                'deltas_applied': self.deltas_applied,
+                'reconciliations': self.reconciliations,
+                'reconcile_conflicts': self.reconcile_conflicts,
+                'drift_corrected': self.drift_corrected,
+                'reconcile_seconds': self.reconcile_seconds,
+            }
+
+    def _run(self):
+        while True:
+            time.sleep(self.reconcile_seconds)
+            try:
+                with self._app.app_context():
+                    self.reconcile()
+            except Exception:
+                logger.exception('Alarm summary reconciliation failed')
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None and self._app is not None:
+                self._thread = threading.Thread(target=self._run, name='alarm-summary', daemon=True)
+                self._thread.start()
+
+
+alarm_summary = AlarmSummary()
+
+
+# --- Deltas of Core writes ---
+# ORM inserts, status changes and deletes of Alarm objects are picked up by the hooks below.
+
+def record_deltas(session, deltas):
+    """Remember (status, severity) deltas until `session` commits."""
+    pending = session.info.setdefault('alarm_count_deltas', Counter())
+    pending.update(deltas)
+
+
+def record_inserted(session, alarms):
+    """Deltas of alarm row dicts inserted with Core statements."""
+    record_deltas(session, Counter((alarm['status'], alarm['severity']) for alarm in alarms))
+
+
+def set_alarm_status(connection, session, clauses, new_status):
+    """
+    Set the status of the alarms matching `clauses` with one UPDATE and record the deltas
+    (and the status event for the alarm event stream).
+    The moved alarms are counted by (status, severity) just before, in the same transaction.
+    Returns the number of alarms updated.
+    """
+    moved = connection.execute(
+        db.select(Alarm.status, Alarm.severity, db.func.count())
+        .where(*clauses, Alarm.status != new_status)
+        .group_by(Alarm.status, Alarm.severity)
+    ).all()
+    if not moved:
+        return 0
+    if alarm_events.started:
+        if sum(count for _, _, count in moved) > MAX_ALARMS_PER_EVENT:
+            record_event(session, 'reset', {})
+        else:
+            ids = connection.execute(db.select(Alarm.id).where(*clauses, Alarm.status != new_status)).scalars().all()
+            record_status_change(session, ids, new_status)
+    result = connection.execute(db.update(Alarm).where(*clauses, Alarm.status != new_status)
+                                .values(status=new_status))
+    deltas = Counter()
+    for status, severity, count in moved:
+        deltas[(status, severity)] -= count
+        deltas[(new_status, severity)] += count
+    record_deltas(session, deltas)
+    return result.rowcount
+
+
+# --- Hooks ---
+
+def _committed_value(obj, name):
+    history = attributes.get_history(obj, name)
+    if history.deleted:
+        return history.deleted[0]
+    return (history.unchanged or history.added or [None])[0]
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_orm_alarm_changes(session, flush_context):
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, Alarm):
+            deltas[(obj.status or AlarmStatus.ACTIVE, obj.severity or AlarmSeverity.WARNING)] += 1
+    for obj in session.dirty:
+        if isinstance(obj, Alarm) and session.is_modified(obj):
+            old = (_committed_value(obj, 'status'), _committed_value(obj, 'severity'))
+            new = (obj.status, obj.severity)
+            if old != new:
+                deltas[old] -= 1
+                deltas[new] += 1
+    for obj in session.deleted:
+        if isinstance(obj, Alarm):
+            deltas[(_committed_value(obj, 'status'), _committed_value(obj, 'severity'))] -= 1
+    if deltas:
+        record_deltas(session, deltas)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_after_commit(session):
+    deltas = session.info.pop('alarm_count_deltas', None)
+    if deltas:
+        alarm_summary.apply(deltas)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_deltas(session):
+    session.info.pop('alarm_count_deltas', None)
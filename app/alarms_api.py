@@ -1,68 +1,150 @@
-from flask import Blueprint, jsonify, request, abort
+import base64
+import binascii
+import json
+from flask import Blueprint, Response, jsonify, request, abort
+from app.auth import login_required
 from app.database import db
-from app.models import Alarm, AlarmRule, Device, AlarmStatus, AlarmSeverity, AlarmCondition, SensorData
+from app.models import Alarm, AlarmRule, Device, AlarmStatus, AlarmSeverity, AlarmCondition, SensorData, SENSOR_METRIC_COLUMNS
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy import desc, asc
+from sqlalchemy.orm import joinedload
+from app.alarm_engine import DEVICE_OFFLINE_ALARM_TYPE, alarm_engine
+from app.alarm_summary import alarm_summary, set_alarm_status
+from app.alarm_notifications import alarm_notifier
+from app.alarm_events import alarm_events
+from app.alarm_backtest import DEFAULT_TIMESTAMP_LIMIT, backtest_rule
+from app.ingest import IngestError, parse_timestamp
+from datetime import datetime, timedelta, timezone
 
 alarms_bp = Blueprint('alarms_bp', __name__)
 
 # --- Alarm Endpoints ---
 
+DEFAULT_ALARM_PAGE_SIZE = 100
+MAX_ALARM_PAGE_SIZE = 500
+_ALARM_SORT_COLUMNS = ('timestamp', 'severity', 'status', 'alarm_type')
+
+def _encode_alarm_cursor(alarm, sort_by):
+    """Opaque position of an alarm in a listing sorted by `sort_by`."""
+    value = getattr(alarm, sort_by)
+    if isinstance(value, datetime):
+        value = value.replace(tzinfo=None).isoformat()
+    elif isinstance(value, (AlarmStatus, AlarmSeverity)):
+        value = value.value
+    return base64.urlsafe_b64encode(json.dumps([value, alarm.id]).encode()).decode()
+
+def _decode_alarm_cursor(cursor, sort_by):
+    """(sort column value, id) from a cursor; raises ValueError if it is malformed."""
+    try:
+        value, alarm_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(value, str) or not isinstance(alarm_id, int):
+        raise ValueError('Invalid cursor')
+    if sort_by == 'timestamp':
+        value = datetime.fromisoformat(value)
+    elif sort_by == 'status':
+        value = AlarmStatus(value)
+    elif sort_by == 'severity':
+        value = AlarmSeverity(value)
+    return value, alarm_id
+
+def alarm_filter_clauses(params):
+    """
+    WHERE clauses for the alarm filters in `params` (query args or a JSON object):
+    status, severity, device_id, rule_id and before (ISO timestamp). Raises ValueError.
+    """
+    clauses = []
+    status_filter = params.get('status')
+    if status_filter:
+        try:
+            clauses.append(Alarm.status == AlarmStatus(str(status_filter).lower()))
+        except ValueError:
+            raise ValueError(f"Invalid status value: {status_filter}")
+
+    severity_filter = params.get('severity')
+    if severity_filter:
+        try:
+            clauses.append(Alarm.severity == AlarmSeverity(str(severity_filter).lower()))
+        except ValueError:
+            raise ValueError(f"Invalid severity value: {severity_filter}")
+
+    for name, column in (('device_id', Alarm.device_id), ('rule_id', Alarm.triggered_by_rule_id)):
+        value = params.get(name)
+        if value:
+            try:
+                clauses.append(column == int(value))
+            except (ValueError, TypeError):
+                raise ValueError(f"Invalid {name} value: {value}")
+
+    before = params.get('before')
+    if before:
+        try:
+            clauses.append(Alarm.timestamp <= datetime.fromisoformat(before))
+        except (ValueError, TypeError):
+            raise ValueError(f"Invalid before value: {before}. Use ISO format (YYYY-MM-DDTHH:MM:SS)")
+    return clauses
+
 @alarms_bp.route('/api/alarms', methods=['GET'])
 def get_alarms():
     """
-    Get a list of alarms, with optional filtering and sorting.
+    Get a page of alarms, with optional filtering and sorting.
     Query Parameters:
     - status (str): Filter by status (active, acknowledged, cleared)
     - severity (str): Filter by severity (info, warning, critical)
     - device_id (int): Filter by device ID
-    - sort_by (str): Field to sort by (timestamp, severity, status). Default: timestamp
+    - sort_by (str): Field to sort by (timestamp, severity, status, alarm_type). Default: timestamp
     - order (str): Sort order (asc, desc). Default: desc
+    - limit (int): Page size. Default: 100, at most 500
+    - cursor (str): X-Next-Cursor header of the previous page, to fetch the next one
+    The response body is the list of alarms; X-Next-Cursor is set when more alarms follow.
     """
-    query = Alarm.query
+    query = Alarm.query.options(joinedload(Alarm.device)) # Device names in the same query
 
     # Filtering
-    status_filter = request.args.get('status')
-    if status_filter:
-        try:
-            status_enum = AlarmStatus(status_filter.lower())
-            query = query.filter(Alarm.status == status_enum)
-        except ValueError:
-            return jsonify({"error": f"Invalid status value: {status_filter}"}), 400
-
-    severity_filter = request.args.get('severity')
-    if severity_filter:
-        try:
-            severity_enum = AlarmSeverity(severity_filter.lower())
-            query = query.filter(Alarm.severity == severity_enum)
-        except ValueError:
-            return jsonify({"error": f"Invalid severity value: {severity_filter}"}), 400
-
-    device_id_filter = request.args.get('device_id')
-    if device_id_filter:
-        try:
-            device_id = int(device_id_filter)
-            query = query.filter(Alarm.device_id == device_id)
-        except ValueError:
-            return jsonify({"error": f"Invalid device_id value: {device_id_filter}"}), 400
+    try:
+        query = query.filter(*alarm_filter_clauses(request.args))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    # Sorting
+    # Sorting: (sort column, id) so pages can continue after the last row of the previous one
     sort_by = request.args.get('sort_by', 'timestamp')
-    order = request.args.get('order', 'desc')
+    order = request.args.get('order', 'desc').lower()
 
-    sort_column = getattr(Alarm, sort_by, None)
-    if sort_column is None:
+    if sort_by not in _ALARM_SORT_COLUMNS:
         return jsonify({"error": f"Invalid sort_by value: {sort_by}"}), 400
-
-    if order.lower() == 'desc':
-        query = query.order_by(desc(sort_column))
-    elif order.lower() == 'asc':
-        query = query.order_by(asc(sort_column))
-    else:
+    if order not in ('asc', 'desc'):
         return jsonify({"error": f"Invalid order value: {order}"}), 400
+    sort_column = getattr(Alarm, sort_by)
+    direction = desc if order == 'desc' else asc
+    query = query.order_by(direction(sort_column), direction(Alarm.id))
 
-    alarms = query.all()
-    return jsonify([alarm.to_dict() for alarm in alarms])
+    try:
+        limit = min(max(int(request.args.get('limit', DEFAULT_ALARM_PAGE_SIZE)), 1), MAX_ALARM_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": f"Invalid limit value: {request.args.get('limit')}"}), 400
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            last_value, last_id = _decode_alarm_cursor(cursor, sort_by)
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+        # The leading bound on the sort column alone lets the index seek to the cursor;
+        # the OR form by itself makes SQLite scan the index from the top of the table
+        if order == 'desc':
+            query = query.filter(sort_column <= last_value,
+                                 db.or_(sort_column < last_value, Alarm.id < last_id))
+        else:
+            query = query.filter(sort_column >= last_value,
+                                 db.or_(sort_column > last_value, Alarm.id > last_id))
+
+    # One extra row tells whether another page follows
+    alarms = query.limit(limit + 1).all()
+    response = jsonify([alarm.to_dict() for alarm in alarms[:limit]])
+    if len(alarms) > limit:
+        response.headers['X-Next-Cursor'] = _encode_alarm_cursor(alarms[limit - 1], sort_by)
+    return response
 
 @alarms_bp.route('/api/alarms/<int:alarm_id>', methods=['GET'])
 def get_alarm_detail(alarm_id):
@@ -115,6 +197,142 @@ def update_alarm_status(alarm_id):
         return jsonify({"error": "Failed to update alarm status", "details": str(e)}), 500
 
 
+# Statuses an alarm may be in to be moved to each target status in bulk
+_BULK_TRANSITIONS = {
+    AlarmStatus.ACKNOWLEDGED: [AlarmStatus.ACTIVE],
+    AlarmStatus.CLEARED: [AlarmStatus.ACTIVE, AlarmStatus.ACKNOWLEDGED],
+}
+
+@alarms_bp.route('/api/alarms/status', methods=['POST'])
+def bulk_update_alarm_status():
+    """
+    Acknowledge or clear many alarms with one UPDATE statement.
+    Body: {"status": "acknowledged" | "cleared"} plus either "ids": [alarm ids] or
+    "filters": {status, severity, device_id, rule_id, before} (same meaning as for GET /api/alarms).
+    Alarms that cannot make the transition (e.g. acknowledging a cleared alarm) are left alone.
+    """
+    data = request.get_json(silent=True)
+    if not data or 'status' not in data:
+        return jsonify({"error": "Missing 'status' in request body"}), 400
+    try:
+        new_status = AlarmStatus(str(data['status']).lower())
+    except ValueError:
+        return jsonify({"error": f"Invalid status value: {data['status']}"}), 400
+    if new_status not in _BULK_TRANSITIONS:
+        return jsonify({"error": f"Cannot bulk set status to {new_status.value}"}), 400
+
+    clauses = [Alarm.status.in_(_BULK_TRANSITIONS[new_status])]
+    if 'ids' in data:
+        ids = data['ids']
+        if not isinstance(ids, list) or not ids or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            return jsonify({"error": "'ids' must be a non-empty list of alarm ids"}), 400
+        clauses.append(Alarm.id.in_(ids))
+    elif isinstance(data.get('filters'), dict) and data['filters']:
+        try:
+            clauses += alarm_filter_clauses(data['filters'])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    else:
+        return jsonify({"error": "Provide 'ids' or non-empty 'filters' to select alarms"}), 400
+
+    try:
+        # Core UPDATE on the session's connection: loaded Alarm objects are not synchronized
+        connection = db.session.connection()
+        updated = set_alarm_status(connection, db.session, clauses, new_status)
+        if updated:
+            # May include Device Offline alarms and rule alarms; tell the other workers to reload both
+            alarm_engine.bump_offline_version(connection)
+            alarm_engine.record_state_change(connection, db.session)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": "Failed to update alarm status", "details": str(e)}), 500
+    if updated:
+        alarm_engine.invalidate_offline() # Cleared Device Offline alarms end their suppression
+    return jsonify({"status": new_status.value, "updated": updated})
+
+
+@alarms_bp.route('/api/alarms/device_offline', methods=['POST'])
+@login_required
+def report_device_offline():
+    """
+    Report a device as offline (e.g. from a gateway watchdog).
+    Body: {"device_id": int, "details": optional str}.
+    Raises a critical 'Device Offline' alarm, or counts the report on the device's one that is
+    still open. Until that alarm is cleared, the device's rules raise no alarms.
+    """
+    data = request.get_json(silent=True) or {}
+    device_id = data.get('device_id')
+    if not isinstance(device_id, int) or isinstance(device_id, bool):
+        return jsonify({"error": "Missing or invalid 'device_id'"}), 400
+    if db.session.get(Device, device_id) is None:
+        return jsonify({"error": f"Device with id {device_id} not found"}), 404
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    alarm = (Alarm.query.filter(Alarm.device_id == device_id, Alarm.alarm_type == DEVICE_OFFLINE_ALARM_TYPE,
+                                Alarm.status != AlarmStatus.CLEARED)
+             .order_by(desc(Alarm.id)).first())
+    if alarm is not None:
+        alarm.occurrence_count = (alarm.occurrence_count or 1) + 1
+        alarm.last_seen = now
+        status_code = 200
+    else:
+        alarm = Alarm(timestamp=now, last_seen=now, device_id=device_id, alarm_type=DEVICE_OFFLINE_ALARM_TYPE,
+                      severity=AlarmSeverity.CRITICAL, status=AlarmStatus.ACTIVE,
+                      details=data.get('details') or 'Device stopped responding')
+        db.session.add(alarm)
+        status_code = 201
+    try:
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": "Failed to record device offline alarm", "details": str(e)}), 500
+    return jsonify(alarm.to_dict()), status_code
+
+
+@alarms_bp.route('/api/alarms/summary', methods=['GET'])
+def get_alarm_summary():
+    """
+    Alarm counts by status and by severity, plus active alarms by severity (for the header badge).
+    Served from in-process counters, so polling it costs no alarm table scan.
+    """
+    return jsonify(alarm_summary.get())
+
+
+@alarms_bp.route('/api/alarms/events', methods=['GET'])
+def alarm_events_stream():
+    """
+    Server-Sent Events stream of alarm changes: 'created', 'status' and 'occurrence' events.
+    A client reconnecting with Last-Event-ID gets the events it missed; if they are no longer
+    buffered it gets a 'reset' event and should reload its first page.
+    """
+    response = Response(alarm_events.stream(request.headers.get('Last-Event-ID')), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # Don't let a reverse proxy buffer the stream
+    return response
+
+
+@alarms_bp.route('/api/alarms/events/stats', methods=['GET'])
+def alarm_events_stats():
+    """Subscribers, published, replayed and reset counters of the alarm event stream."""
+    return jsonify(alarm_events.stats())
+
+
+@alarms_bp.route('/api/alarm_engine/stats', methods=['GET'])
+def get_alarm_engine_stats():
+    """Counters of the rule evaluation engine (rules indexed, evaluations, alarms raised, timing)."""
+    return jsonify(alarm_engine.stats())
+
+
+@alarms_bp.route('/api/alarm_notifications/stats', methods=['GET'])
+def get_alarm_notification_stats():
+    """
+    Per notification sink: pending backlog and age of its oldest row, given-up rows,
+    and this process's deliveries per second, delivery time and failed attempts.
+    """
+    return jsonify(alarm_notifier.stats())
+
+
 # --- Alarm Rule Endpoints ---
 
 @alarms_bp.route('/api/alarm_rules', methods=['GET'])
@@ -140,8 +358,12 @@ def create_alarm_rule():
         threshold = float(data['threshold_value'])
         cooldown = int(data.get('cooldown_period_seconds', 300)) # Default cooldown
         is_active = bool(data.get('is_active', True)) # Default to active
+        duration = int(data.get('duration_seconds') or 0) # Default: fire on the first sample
+        hysteresis = float(data.get('hysteresis') or 0) # Default: no dead band
     except (ValueError, TypeError) as e:
         return jsonify({"error": "Invalid data type or enum value", "details": str(e)}), 400
+    if duration < 0 or hysteresis < 0:
+        return jsonify({"error": "duration_seconds and hysteresis cannot be negative"}), 400
 
     # Check if device exists
     device = Device.query.get(device_id)
@@ -160,7 +382,9 @@ def create_alarm_rule():
         threshold_value=threshold,
         severity=severity,
         is_active=is_active,
-        cooldown_period_seconds=cooldown
+        cooldown_period_seconds=cooldown,
+        duration_seconds=duration,
+        hysteresis=hysteresis
     )
 
     try:
@@ -175,6 +399,67 @@ def create_alarm_rule():
         return jsonify({"error": "Failed to create alarm rule", "details": str(e)}), 500
 
 
+@alarms_bp.route('/api/alarm_rules/backtest', methods=['POST'])
+def backtest_alarm_rule():
+    """
+    Replay a rule over stored sensor data without raising alarms (with the engine's
+    ALARM_COALESCE and ALARM_AUTO_CLEAR settings).
+    Body: either rule_id (a saved rule) or the draft fields sensor_metric, condition,
+    threshold_value and optionally cooldown_period_seconds, duration_seconds and hysteresis
+    (fields given next to rule_id override the saved ones). Optional: start_time / end_time
+    (ISO or Unix seconds, default: the last 90 days) and limit (alarm timestamps to return,
+    default 1000).
+    """
+    data = request.get_json(silent=True) or {}
+    fields = {}
+    if 'rule_id' in data:
+        try:
+            rule = db.session.get(AlarmRule, int(data['rule_id']))
+        except (ValueError, TypeError):
+            return jsonify({"error": f"Invalid rule_id: {data['rule_id']}"}), 400
+        if rule is None:
+            return jsonify({"error": f"Alarm rule {data['rule_id']} not found"}), 404
+        fields = {
+            'sensor_metric': rule.sensor_metric,
+            'condition': rule.condition.value,
+            'threshold_value': rule.threshold_value,
+            'cooldown_period_seconds': rule.cooldown_period_seconds,
+            'duration_seconds': rule.duration_seconds,
+            'hysteresis': rule.hysteresis,
+        }
+    fields.update({key: data[key] for key in ('sensor_metric', 'condition', 'threshold_value', 'cooldown_period_seconds',
+                                               'duration_seconds', 'hysteresis') if key in data})
+
+    required_fields = ['sensor_metric', 'condition', 'threshold_value']
+    if not all(field in fields for field in required_fields):
+        return jsonify({"error": f"Provide rule_id or the draft rule fields: {required_fields}"}), 400
+    if fields['sensor_metric'] not in SENSOR_METRIC_COLUMNS:
+        return jsonify({"error": f"Invalid sensor_metric: {fields['sensor_metric']}"}), 400
+
+    try:
+        condition = AlarmCondition(fields['condition'])
+        threshold = float(fields['threshold_value'])
+        cooldown = int(fields.get('cooldown_period_seconds', 300) or 0) # Same default as new rules
+        duration = int(fields.get('duration_seconds') or 0)
+        hysteresis = float(fields.get('hysteresis') or 0)
+        limit = int(data.get('limit', DEFAULT_TIMESTAMP_LIMIT))
+        end_time = parse_timestamp(data['end_time']) if data.get('end_time') else datetime.utcnow()
+        start_time = (parse_timestamp(data['start_time']) if data.get('start_time')
+                      else end_time - timedelta(days=90))
+    except (ValueError, TypeError, IngestError) as e:
+        return jsonify({"error": "Invalid data type or enum value", "details": str(e)}), 400
+    if start_time > end_time:
+        return jsonify({"error": "start_time must be before end_time"}), 400
+
+    if duration < 0 or hysteresis < 0:
+        return jsonify({"error": "duration_seconds and hysteresis cannot be negative"}), 400
+
+    return jsonify(backtest_rule(fields['sensor_metric'], condition, threshold, cooldown,
+                                 start_time, end_time, max(limit, 0), duration_seconds=duration,
+                                 hysteresis=hysteresis, coalesce=alarm_engine.coalesce,
+                                 auto_clear=alarm_engine.auto_clear))
+
+
 @alarms_bp.route('/api/alarm_rules/<int:rule_id>', methods=['GET'])
 def get_alarm_rule_detail(rule_id):
     """Get details of a specific alarm rule."""
@@ -214,6 +499,13 @@ def update_alarm_rule(rule_id):
             rule.is_active = bool(data['is_active'])
         if 'cooldown_period_seconds' in data:
             rule.cooldown_period_seconds = int(data['cooldown_period_seconds'])
+        if 'duration_seconds' in data:
+            rule.duration_seconds = int(data['duration_seconds'] or 0)
+        if 'hysteresis' in data:
+            rule.hysteresis = float(data['hysteresis'] or 0)
+        if rule.duration_seconds < 0 or rule.hysteresis < 0:
+            db.session.rollback()
+            return jsonify({"error": "duration_seconds and hysteresis cannot be negative"}), 400
 
     except (ValueError, TypeError) as e:
         return jsonify({"error": "Invalid data type or enum value", "details": str(e)}), 400
@@ -3,10 +3,31 @@ import click # Import click for CLI commands
 from dotenv import load_dotenv # Import dotenv
 from flask import Flask, render_template, request, redirect, url_for, flash, session, g, jsonify
 from app.database import db, init_app as init_db_app # Use alias to avoid name clash
-from app.models import User, SensorData, Device # Import the User, SensorData, and Device models
+from app.models import User, SensorData, Device, DeviceCommand, IngestKey, AlarmNotification, AlarmRule, AlarmCondition, InterlockRule, SENSOR_METRIC_COLUMNS # Models and the sensor metric column names
 from app.auth import login_required # Import the decorator
 from app.alarms_api import alarms_bp # Import the alarms blueprint
+from app.ingest_api import ingest_bp # Bulk sensor ingestion API
+from app.scenes_api import scenes_bp # Batched device actions (scenes)
+from app.interlocks_api import interlocks_bp # Interlock rule management
+from app.dashboard_api import (dashboard_api_bp, overview_section, soil_section, tank_section, # Dashboard cards
+                               water_quality_section, plant_env_section)
+from app.timeseries import AGGREGATE_FUNCTIONS, bucket_start, bucket_width_seconds, time_bucket # Time-bucket aggregation helpers
+from app.rollups import covered_buckets, rebuild_rollups, rollup_bucket_seconds, tier_for_width # SensorData rollup tiers
+from app.sensor_cache import latest_reading_cache, init_app as init_sensor_cache # Latest-reading snapshot cache
+from app.live_updates import live_updates # SSE fan-out for dashboard updates
+from app.ingest_buffer import ingest_buffer # Group commit for small ingest batches
+from app.ingest_validation import reading_validator # Plausibility checks for ingested values
+from app.alarm_backtest import backtest_rule # Replay alarm rules over stored readings
+from app.alarm_engine import alarm_engine # Rule evaluation and automatic alarm clearing
+from app.alarm_summary import alarm_summary # Alarm counters for the header badge
+from app.alarm_notifications import alarm_notifier # Queued webhook/e-mail delivery of new alarms
+from app.alarm_events import alarm_events # SSE stream of alarm changes for the alarms page
+from app.device_state import device_state # In-memory device state with write-behind to the devices table
+from app.device_commands import device_commands, invalid_action_error # Queue and workers sending control commands to devices
+from app.interlocks import (check_safety_interlocks, create_default_interlock_rules, interlock_engine, # Safety checks before device commands
+                            interlock_status_cache)
 from datetime import datetime, timedelta  # Add datetime and timedelta import for historical data
+from sqlalchemy.exc import IntegrityError # Concurrent seeding of default rows
 
 # Load environment variables from .env file
 load_dotenv()
@@ -27,6 +48,62 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False # Disable modification trac
 
 # Initialize the database with the app
 init_db_app(app)
+# Seconds a cached latest reading may be served before it is re-read (writes invalidate it sooner)
+app.config['LATEST_READING_CACHE_TTL'] = float(os.environ.get('LATEST_READING_CACHE_TTL', 5))
+init_sensor_cache(app)
+# Seconds between change checks of the live update stream (local writes are pushed immediately)
+app.config['LIVE_UPDATES_POLL_INTERVAL'] = float(os.environ.get('LIVE_UPDATES_POLL_INTERVAL', 2))
+live_updates.init_app(app)
+# API keys accepted by /api/ingest via the X-API-Key header (comma-separated)
+app.config['INGEST_API_KEYS'] = [key.strip() for key in os.environ.get('INGEST_API_KEYS', '').split(',') if key.strip()]
+# Group commit of small ingest batches: flush once this many rows wait, or after this many seconds
+app.config['INGEST_BUFFER_MAX_ROWS'] = int(os.environ.get('INGEST_BUFFER_MAX_ROWS', 1000))
+app.config['INGEST_BUFFER_MAX_DELAY'] = float(os.environ.get('INGEST_BUFFER_MAX_DELAY', 0.2))
+ingest_buffer.init_app(app)
+# Optional JSON file overriding the per-metric ingest validation rules (see app/ingest_validation.py)
+app.config['INGEST_VALIDATION_PROFILE'] = os.environ.get('INGEST_VALIDATION_PROFILE')
+reading_validator.init_app(app)
+# Move alarms to cleared once a reading shows their rule's condition resolved (0 keeps them until cleared by hand)
+app.config['ALARM_AUTO_CLEAR'] = os.environ.get('ALARM_AUTO_CLEAR', '1') != '0'
+# Count repeated triggers of a rule on its open alarm instead of raising new ones (0 raises one alarm per trigger)
+app.config['ALARM_COALESCE'] = os.environ.get('ALARM_COALESCE', '1') != '0'
+# Seconds between checks whether another worker process changed the alarm rules
+app.config['ALARM_RULES_CHECK_INTERVAL'] = float(os.environ.get('ALARM_RULES_CHECK_INTERVAL', 1))
+alarm_engine.init_app(app)
+# Seconds between recounts of the alarm table behind /api/alarms/summary (writes in between are counted incrementally)
+app.config['ALARM_SUMMARY_RECONCILE_SECONDS'] = float(os.environ.get('ALARM_SUMMARY_RECONCILE_SECONDS', 60))
+alarm_summary.init_app(app)
+# JSON file listing the webhook/SMTP sinks new alarms are delivered to (unset: no notifications)
+app.config['ALARM_NOTIFICATION_SINKS'] = os.environ.get('ALARM_NOTIFICATION_SINKS')
+# Delivery attempts per notification before it is given up, and the first retry delay in seconds (doubles per failure)
+app.config['ALARM_NOTIFICATION_MAX_ATTEMPTS'] = int(os.environ.get('ALARM_NOTIFICATION_MAX_ATTEMPTS', 8))
+app.config['ALARM_NOTIFICATION_BACKOFF'] = float(os.environ.get('ALARM_NOTIFICATION_BACKOFF', 5))
+alarm_notifier.init_app(app)
+# Alarm change events kept for replay to reconnecting clients, and seconds between checks for new alarms
+app.config['ALARM_EVENTS_BUFFER'] = int(os.environ.get('ALARM_EVENTS_BUFFER', 1000))
+app.config['ALARM_EVENTS_POLL_INTERVAL'] = float(os.environ.get('ALARM_EVENTS_POLL_INTERVAL', 2))
+alarm_events.init_app(app)
+# Device adapter ('simulator' or 'package.module:Class'), worker threads sending commands, seconds to wait
+# for a controller, and seconds a command may wait in the queue before it is dropped as expired
+app.config['DEVICE_ADAPTER'] = os.environ.get('DEVICE_ADAPTER', 'simulator')
+app.config['DEVICE_COMMAND_WORKERS'] = int(os.environ.get('DEVICE_COMMAND_WORKERS', 4))
+app.config['DEVICE_COMMAND_TIMEOUT'] = float(os.environ.get('DEVICE_COMMAND_TIMEOUT', 10))
+app.config['DEVICE_COMMAND_MAX_AGE'] = float(os.environ.get('DEVICE_COMMAND_MAX_AGE', 60))
+# Seconds the simulator adapter takes to confirm a command
+app.config['DEVICE_SIMULATOR_LATENCY'] = float(os.environ.get('DEVICE_SIMULATOR_LATENCY', 0.2))
+device_commands.init_app(app)
+# Device state sharing between worker processes ('memory': through the devices table, 'file': also through DEVICE_STATE_FILE, by default
+# instance/device_state.json), and seconds between write-behind flushes and between reloads of the devices table
+app.config['DEVICE_STATE_BACKEND'] = os.environ.get('DEVICE_STATE_BACKEND', 'memory')
+app.config['DEVICE_STATE_FILE'] = os.environ.get('DEVICE_STATE_FILE')
+app.config['DEVICE_STATE_FLUSH_INTERVAL'] = float(os.environ.get('DEVICE_STATE_FLUSH_INTERVAL', 1))
+app.config['DEVICE_STATE_RELOAD_INTERVAL'] = float(os.environ.get('DEVICE_STATE_RELOAD_INTERVAL', 60))
+# Seconds between checks whether another worker process flushed statuses or changed devices
+app.config['DEVICE_STATE_CHECK_INTERVAL'] = float(os.environ.get('DEVICE_STATE_CHECK_INTERVAL', 1))
+device_state.init_app(app)
+# Seconds between checks whether another worker process changed the interlock rules
+app.config['INTERLOCK_RULES_CHECK_INTERVAL'] = float(os.environ.get('INTERLOCK_RULES_CHECK_INTERVAL', 1))
+interlock_engine.init_app(app)
 
 # Function to create a default admin user if none exists
 def create_default_user():
@@ -43,6 +120,23 @@ def create_default_user():
 # Create default user if none exists
 create_default_user()
 
+# Function to store the built-in interlock rules (formerly hardcoded) on first start
+def create_default_interlocks():
+    """Store the default interlock rules unless interlock rules were ever stored or changed."""
+    with app.app_context():
+        if not db.inspect(db.engine).has_table(InterlockRule.__tablename__):
+            print("Table 'interlock_rules' is missing; run update_alarm_schema.py. Device commands are refused until then.")
+            return
+        try:
+            added = create_default_interlock_rules()
+        except IntegrityError:
+            db.session.rollback() # Another worker process stored them first
+            return
+        if added:
+            print(f"Stored {added} default interlock rules.")
+
+create_default_interlocks()
+
 # --- Hooks ---
 
 @app.before_request
@@ -71,194 +165,63 @@ def index():
 
 # --- API Endpoints ---
 
+# The dashboard card payloads are built in app/dashboard_api.py so that
+# /api/dashboard_snapshot and these per-card endpoints stay identical.
+
 @app.route('/api/overview_status')
 @login_required
 def api_overview_status():
     """API endpoint to get the latest sensor data for the overview header."""
-    latest_data = SensorData.query.order_by(SensorData.timestamp.desc()).first()
-    if latest_data:
-        return jsonify(latest_data.to_dict())
-    else:
-        # Return empty object or default values if no data exists
-        # Use updated field names for consistency
-        return jsonify({
-            'timestamp': None,
-            'air_temperature': None, # Changed
-            'humidity': None,
-            'uv_intensity': None,
-            'rainfall': None,
-            'atmospheric_pressure': None, # Added
-            'soil_moisture_level': None,
-            'soil_ph': None,            # Changed
-            # Add others as needed for a complete null response if desired
-        })
+    return jsonify(overview_section(latest_reading_cache.get()))
 
 @app.route('/api/soil_status')
 @login_required
 def api_soil_status():
     """API endpoint to get the latest soil condition data."""
-    latest_data = SensorData.query.order_by(SensorData.timestamp.desc()).first()
-    if latest_data:
-        # Safe timestamp handling
-        timestamp = None
-        if latest_data.timestamp:
-            if hasattr(latest_data.timestamp, 'isoformat'):
-                timestamp = latest_data.timestamp.isoformat()
-            else:
-                timestamp = latest_data.timestamp
-                
-        # Return only relevant fields for soil status
-        return jsonify({
-            'timestamp': timestamp,
-            'soil_temperature': latest_data.soil_temperature, # Use specific soil_temperature (FR-DASH-B01)
-            'soil_moisture_level': latest_data.soil_moisture_level, # FR-DASH-B02
-            'ph_level': latest_data.soil_ph, # Use specific soil_ph (FR-DASH-B03)
-            # Use actual fields from model if available
-            'soil_ec': latest_data.soil_ec, # FR-DASH-B04
-            'soil_n': latest_data.soil_n,   # Part of FR-DASH-B05
-            'soil_p': latest_data.soil_p,   # Part of FR-DASH-B05
-            'soil_k': latest_data.soil_k,   # Part of FR-DASH-B05
-            'sap_moisture': latest_data.sap_moisture, # FR-DASH-B06
-        })
-    else:
-        # Return empty object or default values if no data exists
-        return jsonify({
-            'timestamp': None,
-            'soil_temperature': None,
-            'soil_moisture_level': None,
-            # 'ph_level': None, # Remove old name
-            'soil_ph': None, # Keep updated name
-            'soil_ec': None,
-            'soil_n': None,
-            'soil_p': None, # Changed from soil_npk
-            'soil_k': None, # Changed from soil_npk
-            'sap_moisture': None,
-        })
+    return jsonify(soil_section(latest_reading_cache.get()))
 
 @app.route('/api/tank_status')
 @login_required
 def api_tank_status():
     """API endpoint to get the latest water tank status data."""
-    latest_data = SensorData.query.order_by(SensorData.timestamp.desc()).first()
-    if latest_data:
-        # Safe timestamp handling
-        timestamp = None
-        if latest_data.timestamp:
-            if hasattr(latest_data.timestamp, 'isoformat'):
-                timestamp = latest_data.timestamp.isoformat()
-            else:
-                timestamp = latest_data.timestamp
-                
-        # Return only relevant fields for tank status
-        return jsonify({
-            'timestamp': timestamp,
-            'tank_water_volume': latest_data.tank_water_volume, # FR-DASH-E01
-            'pump_pressure': latest_data.water_pressure, # FR-DASH-E03 - Corrected model name is water_pressure
-            # Populate actual data for fields previously placeholders
-            'dirty_tank_volume': latest_data.dirty_water_volume, # FR-DASH-E02 - Use actual data
-            'system_water_treatment_rate': latest_data.treatment_rate, # FR-DASH-E04 - Use actual data (treatment_rate)
-        })
-    else:
-        # Return empty object or default values if no data exists
-        return jsonify({
-            'timestamp': None,
-            'tank_water_volume': None,
-            'pump_pressure': None, # Corresponds to water_pressure
-            'dirty_tank_volume': None,
-            'system_water_treatment_rate': None, # Corresponds to treatment_rate
-        })
+    return jsonify(tank_section(latest_reading_cache.get()))
 
 @app.route('/api/water_quality')
 @login_required
 def api_water_quality():
     """API endpoint to get latest water quality data (Post-Treatment)."""
-    # Placeholder implementation as most sensors are TBD (FR-DASH-C)
-    latest_data = SensorData.query.order_by(SensorData.timestamp.desc()).first()
-    
-    # Safe timestamp handling
-    timestamp = None
-    if latest_data and latest_data.timestamp:
-        if hasattr(latest_data.timestamp, 'isoformat'):
-            timestamp = latest_data.timestamp.isoformat()
-        else:
-            timestamp = latest_data.timestamp
-            
-    # Use specific water quality fields from the updated model
-    water_temp = latest_data.water_temperature if latest_data else None
-    water_ph = latest_data.water_ph if latest_data else None
-
-    return jsonify({
-        'timestamp': timestamp,
-        # Core items from STORY-007 / FR-DASH-C - Populate with actual data
-        'water_temperature': water_temp, # FR-DASH-C01
-        'ph': water_ph,                  # FR-DASH-C02 - Use water_ph
-        'ec': latest_data.water_ec if latest_data else None, # FR-DASH-C03 - Use actual data
-        'tds': latest_data.water_tds if latest_data else None, # FR-DASH-C04 - Use actual data
-        'flow_rate': latest_data.water_flow_rate if latest_data else None, # FR-DASH-C13 - Use actual data
-        # Other placeholders from FR-DASH-C - Populate with actual data
-        'ntu': latest_data.water_ntu if latest_data else None, # Use actual data
-        'ammonia': latest_data.water_nh3 if latest_data else None, # Use actual data (nh3)
-        'nitrate': latest_data.water_no3 if latest_data else None, # Use actual data (no3)
-        # 'phosphate': None, # Not in current model
-        # 'potassium': None, # Not in current model
-        'sulfate': None,
-        # etc.
-    })
+    return jsonify(water_quality_section(latest_reading_cache.get()))
 
 @app.route('/api/plant_env')
 @login_required
 def api_plant_env():
     """API endpoint to get latest plant environmental factors."""
-    # Placeholder implementation as sensors are TBD (FR-DASH-D)
-    latest_data = SensorData.query.order_by(SensorData.timestamp.desc()).first()
-    
-    # Safe timestamp handling
-    timestamp = None
-    if latest_data and latest_data.timestamp:
-        if hasattr(latest_data.timestamp, 'isoformat'):
-            timestamp = latest_data.timestamp.isoformat()
-        else:
-            timestamp = latest_data.timestamp
-            
-    # Use specific fields from the updated model
-    air_temp = latest_data.air_temperature if latest_data else None # FR-DASH-D03
-    soil_moisture = latest_data.soil_moisture_level if latest_data else None # FR-DASH-D04
-    soil_temp = latest_data.soil_temperature if latest_data else None # FR-DASH-D05
+    return jsonify(plant_env_section(latest_reading_cache.get()))
 
+@app.route('/api/cache_stats')
+@login_required
+def api_cache_stats():
+    """API endpoint exposing hit/miss counters of the in-process caches."""
     return jsonify({
-        'timestamp': timestamp,
-        # Items from STORY-008 / FR-DASH-D - Populate with actual data
-        'light_par': latest_data.light_par if latest_data else None, # FR-DASH-D01 - Use actual data
-        'co2_concentration': latest_data.co2_concentration if latest_data else None, # FR-DASH-D02 - Use actual data
-        'air_temperature': air_temp,    # Already corrected
-        'soil_moisture': soil_moisture, # Already correct
-        'soil_temperature': soil_temp,  # Already corrected
+        'latest_reading': latest_reading_cache.stats(),
+        'alarm_summary': alarm_summary.stats(),
+        'device_state': device_state.stats(),
+        'interlock_status': interlock_status_cache.stats(),
     })
 
 @app.route('/api/devices')
 @login_required
 def api_devices():
     """API endpoint to list controllable devices and their status."""
-    # In a real system, fetching status might involve querying hardware/cache.
-    # Here, we just return the status stored in the DB.
-    devices = Device.query.all()
+    # Statuses come from the in-memory device state store (app/device_state.py), not the DB.
+    devices = device_state.all()
     
-    # TASK-057: Include interlock status in the response
+    # TASK-057: Include interlock status (for ON, or OPEN for valves) in the response.
+    # Evaluated for all devices against one reading snapshot and cached until a new reading or device change.
+    interlocks = interlock_status_cache.statuses(devices)
     device_data = []
-    for device in devices:
-        # Get device data including interlock status
-        device_dict = device.to_dict()
-        
-        # Check ON and OPEN actions for interlocks
-        if device.device_type and 'VALVE' in device.device_type.upper():
-            action_to_check = 'OPEN'
-        else:
-            action_to_check = 'ON'
-            
-        # Add interlock information
-        interlock = check_safety_interlocks(device, action_to_check)
-        device_dict['interlock'] = interlock
-        
+    for device_dict in devices:
+        device_dict['interlock'] = interlocks[device_dict['id']]
         device_data.append(device_dict)
     
     return jsonify(device_data)
@@ -279,12 +242,12 @@ def api_control_device(control_id):
         return jsonify({'error': 'Missing required parameter: action'}), 400
     
     # Find the device in the database
-    device = Device.query.filter_by(control_id=control_id).first()
+    device = device_state.by_control_id(control_id)
     if not device:
         return jsonify({'error': f'Device not found with control_id: {control_id}'}), 404
     
     # Check if device is enabled
-    if not device.is_enabled:
+    if not device['is_enabled']:
         return jsonify({'error': 'Device is disabled and cannot be controlled'}), 403
     
     # TASK-056: Check safety interlocks before executing commands
@@ -293,53 +256,44 @@ def api_control_device(control_id):
         return jsonify({
             'error': 'Safety interlock active',
             'message': interlock_status['reason'],
-            'device': device.to_dict(),
+            'device': device,
             'interlock': interlock_status
         }), 403
     
-    # Implement basic safety checks (would be expanded in STORY-013)
-    # For now, just check basic device type compatibility with action
-    valid_actions = {
-        'PUMP': ['ON', 'OFF'],
-        'VALVE': ['OPEN', 'CLOSE'],
-        'LIGHT': ['ON', 'OFF'],
-        'FAN': ['ON', 'OFF'],
-        'HEATER': ['ON', 'OFF'],
-        'GENERIC': ['ON', 'OFF']
-    }
-    
-    device_type = device.device_type.upper()
-    standard_type = next((k for k in valid_actions.keys() if k in device_type), 'GENERIC')
+    # Basic device type compatibility with the action
+    error = invalid_action_error(device, action)
+    if error:
+        return jsonify({'error': error}), 400
     
-    if action.upper() not in valid_actions.get(standard_type, ['ON', 'OFF']):
-        return jsonify({
-            'error': f'Invalid action {action} for device type {device.device_type}. '
-                     f'Valid actions are: {", ".join(valid_actions.get(standard_type, ["ON", "OFF"]))}'
-        }), 400
-    
-    # Here we would connect to the actual hardware interface
-    # For now, we'll simulate success and update the database
-    
-    # Map actions to standard status values
-    action_to_status = {
-        'ON': 'ON',
-        'OFF': 'OFF',
-        'OPEN': 'OPEN',
-        'CLOSE': 'CLOSED',
-        'START': 'RUNNING',
-        'STOP': 'IDLE'
-    }
-    
-    # Update device status in database
-    device.status = action_to_status.get(action.upper(), action.upper())
-    device.last_status_update = db.func.now()
+    # The command is sent to the hardware by the device command workers; the response doesn't wait for it
+    command = DeviceCommand(device_id=device['id'], action=action.upper())
+    db.session.add(command)
     db.session.commit()
-    
+    device_commands.submit(command)
+
+    command_url = url_for('api_device_command', command_id=command.id)
     return jsonify({
         'success': True,
-        'message': f'Device {device.name} ({control_id}) {action} command sent successfully',
-        'device': device.to_dict()
-    })
+        'message': f'Device {device["name"]} ({control_id}) {action} command queued',
+        'command': command.to_dict(),
+        'command_url': command_url,
+        'device': device
+    }), 202, {'Location': command_url}
+
+@app.route('/api/device_commands/<int:command_id>')
+@login_required
+def api_device_command(command_id):
+    """Status, result and timings of a device command."""
+    command = db.session.get(DeviceCommand, command_id)
+    if command is None:
+        return jsonify({'error': f'Device command not found: {command_id}'}), 404
+    return jsonify(command.to_dict())
+
+@app.route('/api/device_commands/stats')
+@login_required
+def api_device_command_stats():
+    """Queue depth, outcome counters and latencies of the device command workers."""
+    return jsonify(device_commands.stats())
 
 # Historical Data API Endpoint (TASK-059)
 @app.route('/api/historical_data')
@@ -356,7 +310,7 @@ def api_historical_data():
         return jsonify({'error': 'No sensors specified'}), 400
         
     valid_fields = [c.name for c in SensorData.__table__.columns 
-                   if c.name not in ['id']]
+                   if c.name not in ['id', 'source_id']]
     
     # Filter out invalid sensor names
     valid_sensors = [s for s in sensors if s in valid_fields]
@@ -386,38 +340,100 @@ def api_historical_data():
         except (ValueError, TypeError):
             return jsonify({'error': f'Invalid end_time format: {end_time}. Use ISO format (YYYY-MM-DDTHH:MM:SS)'}), 400
     
-    # Get the number of data points
-    count = query.count()
-    
     # TASK-060: Handle potentially large datasets with aggregation
-    # For large datasets, automatically apply aggregation
-    aggregation = request.args.get('aggregation', 'auto')
+    # 'auto' averages per time bucket; 'avg', 'min' or 'max' pick the function
+    # reported in 'sensors'; 'none' always returns raw rows
+    aggregation = request.args.get('aggregation', 'auto').lower()
     max_points = int(request.args.get('max_points', 1000))
-    
-    if aggregation == 'auto' and count > max_points:
-        # Calculate time interval for aggregation
-        if start_time and end_time:
-            # Simple downsampling by limiting the query with order_by and limit
-            query = query.order_by(SensorData.timestamp)
-            # Get approximately max_points evenly distributed records
-            step = count // max_points
-            if step < 1:
-                step = 1
-                
-            # Use SQLAlchemy pagination to get evenly distributed samples
-            result = []
-            for i in range(0, count, step):
-                page_items = query.offset(i).limit(1).all()
-                if page_items:
-                    result.extend(page_items)
+    if aggregation not in ('auto', 'none') + AGGREGATE_FUNCTIONS:
+        return jsonify({'error': f'Invalid aggregation: {aggregation}. Use auto, none, avg, min or max'}), 400
+    
+    aggregate_function = None
+    bucket_seconds = None
+    buckets = None
+    source = 'raw'
+    
+    # Ranges wide enough for minute (or coarser) buckets are read from the rollup tables
+    # rather than sensordata; source=raw forces the raw table
+    rollup_tier = None
+    if aggregation != 'none' and start_time and end_time and request.args.get('source') != 'raw':
+        requested_width = bucket_width_seconds(start_datetime, end_datetime, max_points)
+        rollup_tier = tier_for_width(requested_width)
+    
+    if rollup_tier is not None:
+        rollup_bucket_width = rollup_bucket_seconds(rollup_tier, start_datetime, end_datetime, max_points)
+        rollup_metrics = [field for field in valid_sensors if field in SENSOR_METRIC_COLUMNS]
+        # Buckets before the rollup watermark (readings stored before the rollup tables existed)
+        # are aggregated from sensordata; None if the whole range lies before it
+        covered = covered_buckets(rollup_tier, rollup_metrics, start_datetime, end_datetime, rollup_bucket_width)
+        if covered is None:
+            rollup_tier = None
+    
+    if rollup_tier is not None:
+        aggregate_function = 'avg' if aggregation == 'auto' else aggregation
+        bucket_seconds = rollup_bucket_width
+        source = rollup_tier.__tablename__
+        
+        buckets = []
+        sample_counts = {field: 0 for field in rollup_metrics}
+        for bucket_number, metrics in covered:
+            values = {}
+            for field, (field_count, field_sum, field_min, field_max) in metrics.items():
+                sample_counts[field] += field_count
+                values[field] = (field_min, field_sum / field_count if field_count else None, field_max)
+            buckets.append((bucket_number, values))
+        # Readings in range, counted from the best-covered metric
+        count = max(sample_counts.values(), default=0)
+    
+    if rollup_tier is None:
+        # Get the number of data points
+        count = query.count()
+        if aggregation != 'none' and count > max_points:
+            if start_time and end_time:
+                # One GROUP BY over fixed-width time buckets instead of a query per sample
+                aggregate_function = 'avg' if aggregation == 'auto' else aggregation
+                bucket_seconds = bucket_width_seconds(start_datetime, end_datetime, max_points)
+                bucket = time_bucket(SensorData.timestamp, bucket_seconds).label('bucket')
+            
+                aggregate_columns = []
+                for field in valid_sensors:
+                    column = getattr(SensorData, field)
+                    aggregate_columns.extend([db.func.min(column), db.func.avg(column), db.func.max(column)])
+            
+                bucket_query = db.session.query(bucket, *aggregate_columns).filter(
+                    SensorData.timestamp >= start_datetime,
+                    SensorData.timestamp <= end_datetime
+                ).group_by(bucket).order_by(bucket)
+            
+                buckets = []
+                for row in bucket_query.all():
+                    # Each sensor contributes (min, avg, max) after the bucket number
+                    buckets.append((row[0], {field: tuple(row[1 + i * 3:4 + i * 3])
+                                             for i, field in enumerate(valid_sensors)}))
+            else:
+                # If no time range, just limit to the latest max_points
+                query = query.order_by(SensorData.timestamp.desc()).limit(max_points)
+                result = query.all()
+                result.reverse()  # Reverse to get chronological order
         else:
-            # If no time range, just limit to the latest max_points
-            query = query.order_by(SensorData.timestamp.desc()).limit(max_points)
-            result = query.all()
-            result.reverse()  # Reverse to get chronological order
-    else:
-        # No aggregation needed, return all points in time order
-        result = query.order_by(SensorData.timestamp).all()
+            # No aggregation needed, return all points in time order
+            result = query.order_by(SensorData.timestamp).all()
+    
+    aggregates = None
+    if buckets is not None:
+        # Full min/avg/max envelope per bucket, aligned with 'timestamps'
+        result = []
+        aggregates = {field: {'min': [], 'avg': [], 'max': []} for field in valid_sensors}
+        pick = {'min': 0, 'avg': 1, 'max': 2}[aggregate_function]
+        for bucket_number, values in buckets:
+            row = [bucket_start(bucket_number, bucket_seconds)]
+            for field in valid_sensors:
+                field_min, field_avg, field_max = values.get(field, (None, None, None))
+                aggregates[field]['min'].append(field_min)
+                aggregates[field]['avg'].append(field_avg)
+                aggregates[field]['max'].append(field_max)
+                row.append((field_min, field_avg, field_max)[pick])
+            result.append(row)
     
     # Format the result for the frontend
     data = {
@@ -435,11 +451,17 @@ def api_historical_data():
             # Row[0] is timestamp, data starts at index 1
             data['sensors'][field].append(row[i+1])
     
+    if aggregates is not None:
+        data['aggregates'] = aggregates
+    
     # Add metadata
     data['metadata'] = {
         'count': len(result),
         'original_count': count,
         'aggregated': count > len(result),
+        'aggregation': aggregate_function,
+        'bucket_seconds': bucket_seconds,
+        'source': source,
         'sensors_requested': sensors,
         'valid_sensors': valid_sensors,
         'start_time': start_time,
@@ -582,7 +604,11 @@ def alarms():
 
 # Register blueprints
 app.register_blueprint(alarms_bp)
-# Note: Register other blueprints like auth_bp and dashboard_api_bp if they exist and are needed.
+app.register_blueprint(dashboard_api_bp)
+app.register_blueprint(ingest_bp)
+app.register_blueprint(scenes_bp)
+app.register_blueprint(interlocks_bp)
+# Note: Register other blueprints like auth_bp if they exist and are needed.
 # Assuming they might be registered elsewhere or implicitly handled for now.
 
 
@@ -663,58 +689,97 @@ def create_user_command(username, password):
         db.session.commit()
     print(f"User '{username}' created successfully.")
 
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute the 1-minute/1-hour/1-day sensordata rollup tables."""
+    with app.app_context():
+        counts = rebuild_rollups()
+    for table_name, row_count in counts.items():
+        print(f"{table_name}: {row_count} rows")
+    print('Rollup tables rebuilt.')
+
+@app.cli.command('prune-ingest-keys')
+@click.option('--days', default=30, show_default=True, help='Keep idempotency keys received within this many days.')
+def prune_ingest_keys_command(days):
+    """Delete old ingest idempotency keys (replays older than this are no longer detected)."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    with app.app_context():
+        deleted = IngestKey.query.filter(IngestKey.received_at < cutoff).delete(synchronize_session=False)
+        db.session.commit()
+    print(f"Deleted {deleted} ingest keys received before {cutoff.isoformat()}.")
 
-# --- Helper Functions ---
+@app.cli.command('prune-device-commands')
+@click.option('--days', default=30, show_default=True, help='Keep device commands created within this many days.')
+def prune_device_commands_command(days):
+    """Delete old finished device commands."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    with app.app_context():
+        deleted = DeviceCommand.query.filter(
+            DeviceCommand.status.in_([DeviceCommand.SUCCEEDED, DeviceCommand.FAILED, DeviceCommand.EXPIRED]),
+            DeviceCommand.created_at < cutoff,
+        ).delete(synchronize_session=False)
+        db.session.commit()
+    print(f"Deleted {deleted} device commands created before {cutoff.isoformat()}.")
+
+@app.cli.command('prune-alarm-notifications')
+@click.option('--days', default=7, show_default=True, help='Keep delivered and given-up notifications created within this many days.')
+def prune_alarm_notifications_command(days):
+    """Delete old delivered and given-up alarm notifications (pending ones are always kept)."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    with app.app_context():
+        deleted = AlarmNotification.query.filter(
+            AlarmNotification.status.in_([AlarmNotification.DELIVERED, AlarmNotification.DEAD]),
+            AlarmNotification.created_at < cutoff,
+        ).delete(synchronize_session=False)
+        db.session.commit()
+    print(f"Deleted {deleted} alarm notifications created before {cutoff.isoformat()}.")
+
+@app.cli.command('backtest-alarm-rule')
+@click.option('--rule-id', type=int, help='Saved rule to replay (the options below override its fields).')
+@click.option('--metric', help='Sensor metric of a draft rule, e.g. air_temperature.')
+@click.option('--condition', type=click.Choice([c.value for c in AlarmCondition]), help='Condition of a draft rule.')
+@click.option('--threshold', type=float, help='Threshold of a draft rule.')
+@click.option('--cooldown', type=int, help='Cooldown of a draft rule in seconds [default: 300].')
+@click.option('--duration', type=int, help='Seconds the condition must hold before a draft rule fires.')
+@click.option('--hysteresis', type=float, help='Dead band around the threshold of a draft rule.')
+@click.option('--days', default=90, show_default=True, help='Replay the readings of this many past days.')
+@click.option('--show', default=20, show_default=True, help='Print this many of the alarm timestamps.')
+def backtest_alarm_rule_command(rule_id, metric, condition, threshold, cooldown, duration, hysteresis, days, show):
+    """Count the alarms a rule would have raised over past sensor data (nothing is written)."""
+    with app.app_context():
+        fields = {'metric': None, 'condition': None, 'threshold': None, 'cooldown': 300, 'duration': 0,
+                  'hysteresis': 0.0}
+        if rule_id is not None:
+            rule = db.session.get(AlarmRule, rule_id)
+            if rule is None:
+                raise click.ClickException(f'Alarm rule {rule_id} not found')
+            fields = {'metric': rule.sensor_metric, 'condition': rule.condition.value,
+                      'threshold': rule.threshold_value, 'cooldown': rule.cooldown_period_seconds,
+                      'duration': rule.duration_seconds, 'hysteresis': rule.hysteresis}
+        overrides = {'metric': metric, 'condition': condition, 'threshold': threshold, 'cooldown': cooldown,
+                     'duration': duration, 'hysteresis': hysteresis}
+        fields.update({key: value for key, value in overrides.items() if value is not None})
+        if fields['metric'] is None or fields['condition'] is None or fields['threshold'] is None:
+            raise click.ClickException('Give --rule-id or --metric, --condition and --threshold')
+        if fields['metric'] not in SENSOR_METRIC_COLUMNS:
+            raise click.ClickException(f"Unknown sensor metric: {fields['metric']}")
+        end = datetime.utcnow()
+        result = backtest_rule(fields['metric'], fields['condition'], fields['threshold'], fields['cooldown'],
+                               end - timedelta(days=days), end, limit=show, duration_seconds=fields['duration'],
+                               hysteresis=fields['hysteresis'], coalesce=alarm_engine.coalesce,
+                               auto_clear=alarm_engine.auto_clear)
+    print(f"{result['sensor_metric']} {result['condition']} {result['threshold_value']:g} "
+          f"(cooldown {result['cooldown_period_seconds']}s, duration {result['duration_seconds']}s, "
+          f"hysteresis {result['hysteresis']:g}) over {days} days")
+    print(f"Readings scanned: {result['readings_scanned']}, matching: {result['readings_matching']}")
+    print(f"Alarms: {result['alarm_count']} ({result['occurrences_coalesced']} further triggers counted on open "
+          f"alarms, {result['suppressed_by_cooldown']} suppressed by cooldown)")
+    for timestamp, occurrences in zip(result['alarm_timestamps'], result['alarm_occurrence_counts']):
+        print(f"  {timestamp} (x{occurrences})")
+    if result['truncated']:
+        print(f"  ... {result['alarm_count'] - show} more")
+    print(f"Loaded in {result['load_ms']} ms, evaluated in {result['evaluate_ms']} ms.")
 
-# TASK-056: Implement safety interlock logic
-def check_safety_interlocks(device, action):
-    """
-    Check safety conditions before allowing device control.
-    Returns dict with 'blocked' boolean and 'reason' if blocked.
-    """
-    # Get the latest sensor data
-    latest_data = SensorData.query.order_by(SensorData.timestamp.desc()).first()
-    
-    # Default response (safe)
-    result = {
-        'blocked': False,
-        'reason': None,
-        'conditions': {}
-    }
-    
-    # If no sensor data, allow control but note the warning
-    if not latest_data:
-        result['conditions']['warning'] = 'No sensor data available for safety checks'
-        return result
-    
-    # Device-specific interlock checks
-    device_type = device.device_type.upper()
-    
-    # Water pump interlocks
-    if 'PUMP' in device_type and 'WATER' in device_type:
-        # Check if tank has enough water
-        if action.upper() == 'ON' and latest_data.tank_water_volume is not None:
-            # Assume 10% is minimum safe level (you can adjust based on your requirements)
-            if latest_data.tank_water_volume < 10:
-                result['blocked'] = True
-                result['reason'] = 'Insufficient water level in tank'
-                result['conditions']['tank_water_volume'] = latest_data.tank_water_volume
-                return result
-                
-    # Valve interlock example
-    if 'VALVE' in device_type:
-        # Example: Don't allow opening drainage valve if water quality is poor (use water_ph)
-        if action.upper() == 'OPEN' and 'DRAIN' in device_type and latest_data.water_ph is not None:
-            # Example condition: pH too high or too low
-            if latest_data.water_ph < 5 or latest_data.water_ph > 9: # Check against water_ph
-                result['blocked'] = True
-                result['reason'] = f'Water pH level unsafe: {latest_data.water_ph}'
-                result['conditions']['water_ph'] = latest_data.water_ph # Report water_ph
-                return result
-    
-    # Add other device-specific checks as needed...
-    
-    return result
 
 # --- Main Execution ---
 if __name__ == '__main__':
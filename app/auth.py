@@ -1,5 +1,6 @@
 import functools
-from flask import session, redirect, url_for, flash, request
+import hmac
+from flask import session, redirect, url_for, flash, request, current_app, jsonify
 
 def login_required(view):
     """View decorator that redirects anonymous users to the login page."""
@@ -11,3 +12,17 @@ def login_required(view):
             return redirect(url_for('login', next=request.url)) # Pass next URL for redirect after login
         return view(**kwargs)
     return wrapped_view
+
+def api_key_required(view):
+    """View decorator for machine clients (gateways).
+    Accepts a logged-in session or an X-API-Key header listed in app.config['INGEST_API_KEYS'],
+    and answers 401 JSON instead of redirecting to the login page."""
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        if 'user_id' in session:
+            return view(**kwargs)
+        api_key = request.headers.get('X-API-Key')
+        if api_key and any(hmac.compare_digest(api_key, key) for key in current_app.config.get('INGEST_API_KEYS', [])):
+            return view(**kwargs)
+        return jsonify({'error': 'Authentication required. Log in or send a valid X-API-Key header.'}), 401
+    return wrapped_view
@@ -0,0 +1,150 @@
+from flask import Blueprint, Response, jsonify, request, make_response
+from app.auth import login_required
+from app.sensor_cache import latest_reading_cache
+from app.live_updates import live_updates
+
+dashboard_api_bp = Blueprint('dashboard_api_bp', __name__)
+
+# --- Dashboard Sections ---
+# Each builder turns the latest reading snapshot (a SensorData.to_dict() dict, or None)
+# into the payload of one dashboard card. They are shared by the per-card endpoints in
+# app.py and by the combined /api/dashboard_snapshot endpoint below.
+
+def overview_section(latest_data):
+    """Latest sensor data for the overview header."""
+    if latest_data:
+        return latest_data
+    # Return empty object or default values if no data exists
+    return {
+        'timestamp': None,
+        'air_temperature': None,
+        'humidity': None,
+        'uv_intensity': None,
+        'rainfall': None,
+        'atmospheric_pressure': None,
+        'soil_moisture_level': None,
+        'soil_ph': None,
+    }
+
+def soil_section(latest_data):
+    """Latest soil condition data."""
+    if latest_data:
+        return {
+            'timestamp': latest_data['timestamp'],
+            'soil_temperature': latest_data['soil_temperature'], # FR-DASH-B01
+            'soil_moisture_level': latest_data['soil_moisture_level'], # FR-DASH-B02
+            'ph_level': latest_data['soil_ph'], # FR-DASH-B03
+            'soil_ec': latest_data['soil_ec'], # FR-DASH-B04
+            'soil_n': latest_data['soil_n'],   # Part of FR-DASH-B05
+            'soil_p': latest_data['soil_p'],   # Part of FR-DASH-B05
+            'soil_k': latest_data['soil_k'],   # Part of FR-DASH-B05
+            'sap_moisture': latest_data['sap_moisture'], # FR-DASH-B06
+        }
+    return {
+        'timestamp': None,
+        'soil_temperature': None,
+        'soil_moisture_level': None,
+        'soil_ph': None,
+        'soil_ec': None,
+        'soil_n': None,
+        'soil_p': None,
+        'soil_k': None,
+        'sap_moisture': None,
+    }
+
+def tank_section(latest_data):
+    """Latest water tank status data."""
+    if latest_data:
+        return {
+            'timestamp': latest_data['timestamp'],
+            'tank_water_volume': latest_data['tank_water_volume'], # FR-DASH-E01
+            'pump_pressure': latest_data['water_pressure'], # FR-DASH-E03
+            'dirty_tank_volume': latest_data['dirty_water_volume'], # FR-DASH-E02
+            'system_water_treatment_rate': latest_data['treatment_rate'], # FR-DASH-E04
+        }
+    return {
+        'timestamp': None,
+        'tank_water_volume': None,
+        'pump_pressure': None, # Corresponds to water_pressure
+        'dirty_tank_volume': None,
+        'system_water_treatment_rate': None, # Corresponds to treatment_rate
+    }
+
+def water_quality_section(latest_data):
+    """Latest water quality data (Post-Treatment)."""
+    latest_data = latest_data or {}
+    return {
+        'timestamp': latest_data.get('timestamp'),
+        'water_temperature': latest_data.get('water_temperature'), # FR-DASH-C01
+        'ph': latest_data.get('water_ph'),                  # FR-DASH-C02
+        'ec': latest_data.get('water_ec'), # FR-DASH-C03
+        'tds': latest_data.get('water_tds'), # FR-DASH-C04
+        'flow_rate': latest_data.get('water_flow_rate'), # FR-DASH-C13
+        'ntu': latest_data.get('water_ntu'),
+        'ammonia': latest_data.get('water_nh3'),
+        'nitrate': latest_data.get('water_no3'),
+        'sulfate': None, # Not in current model
+    }
+
+def plant_env_section(latest_data):
+    """Latest plant environmental factors."""
+    latest_data = latest_data or {}
+    return {
+        'timestamp': latest_data.get('timestamp'),
+        'light_par': latest_data.get('light_par'), # FR-DASH-D01
+        'co2_concentration': latest_data.get('co2_concentration'), # FR-DASH-D02
+        'air_temperature': latest_data.get('air_temperature'), # FR-DASH-D03
+        'soil_moisture': latest_data.get('soil_moisture_level'), # FR-DASH-D04
+        'soil_temperature': latest_data.get('soil_temperature'), # FR-DASH-D05
+    }
+
+
+# --- Combined Endpoint ---
+
+@dashboard_api_bp.route('/api/dashboard_snapshot')
+@login_required
+def dashboard_snapshot():
+    """
+    All dashboard cards in one payload.
+    The ETag is derived from the latest reading id, so a poll with a matching
+    If-None-Match gets an empty 304 without any serialization work.
+    """
+    latest_data = latest_reading_cache.get()
+    etag = f"reading-{latest_data['id']}" if latest_data else 'reading-none'
+
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = jsonify({
+            'overview': overview_section(latest_data),
+            'soil': soil_section(latest_data),
+            'tank': tank_section(latest_data),
+            'water_quality': water_quality_section(latest_data),
+            'plant_env': plant_env_section(latest_data),
+        })
+    response.set_etag(etag)
+    # Let browsers keep the body but always revalidate with the ETag
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+# --- Live Updates (SSE) ---
+
+@dashboard_api_bp.route('/api/live_updates')
+@login_required
+def live_updates_stream():
+    """
+    Server-Sent Events stream of dashboard changes.
+    Sends a 'snapshot' event with the latest reading and all device statuses,
+    then 'diff' events holding only the reading fields and devices that changed.
+    """
+    response = Response(live_updates.stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # Don't let a reverse proxy buffer the stream
+    return response
+
+@dashboard_api_bp.route('/api/live_updates/stats')
+@login_required
+def live_updates_stats():
+    """Subscriber count and publish counters of the live update stream."""
+    return jsonify(live_updates.stats())
@@ -1,3 +1,4 @@
+from operator import itemgetter
 from flask_sqlalchemy import SQLAlchemy
 
 # Initialize the SQLAlchemy extension
@@ -7,3 +8,36 @@ db = SQLAlchemy()
 def init_app(app):
     """Initialize the database extension with the Flask app."""
     db.init_app(app)
+
+def executemany_rows(connection, statement, table, columns, rows):
+    """
+    Run an INSERT-style statement for many rows through the DB-API executemany().
+
+    Skips SQLAlchemy's per-row parameter handling, which dominates bulk writes:
+    the statement is compiled once and every row dict is turned into a plain
+    tuple. Column types with bind processors (e.g. SQLite DATETIME) are still
+    converted, column by column.
+    """
+    dialect = connection.dialect
+    compiled = statement.compile(dialect=dialect, column_keys=columns)
+    names = list(compiled.positiontup) if compiled.positiontup else list(columns)
+    # dialect_impl(): e.g. SQLite's DATETIME formats values itself, the generic DateTime does not
+    processors = [(index, table.c[name].type.dialect_impl(dialect).bind_processor(dialect))
+                  for index, name in enumerate(names)]
+    processors = [(index, processor) for index, processor in processors if processor is not None]
+
+    getter = itemgetter(*names)
+    if len(names) == 1:
+        params = [(getter(row),) for row in rows]
+    else:
+        params = [getter(row) for row in rows]
+    if processors:
+        params = [list(row) for row in params]
+        for row in params:
+            for index, processor in processors:
+                if row[index] is not None:
+                    row[index] = processor(row[index])
+        params = [tuple(row) for row in params]
+    if not compiled.positiontup:
+        params = [dict(zip(names, row)) for row in params]
+    connection.exec_driver_sql(compiled.string, params)
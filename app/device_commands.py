@@ -0,0 +1,389 @@
+"""
+Asynchronous execution of device control commands.
+
+/api/control_device records a DeviceCommand and answers 202 right away; a pool
+of DEVICE_COMMAND_WORKERS threads sends the commands to the hardware through a
+device adapter. Commands for one device run strictly one after another, in the
+order they were accepted, while different devices are served in parallel
+(round robin), so a slow or hung controller holds up its own device and one
+worker, never a web request. The steps of a scene run (submit_run()) go out
+one at a time in their listed order; if one fails, the rest are cancelled
+and the applied ones are undone.
+
+DEVICE_ADAPTER selects the adapter: 'simulator' (the default, confirms every
+command after DEVICE_SIMULATOR_LATENCY seconds) or the 'module:Class' path of
+a DeviceAdapter subclass for a real transport. A command that waited longer
+than DEVICE_COMMAND_MAX_AGE seconds is marked expired instead of being sent:
+switching a pump long after the operator asked is worse than not switching it.
+The safety interlocks are checked again against the latest reading just before
+a command (a scene step, an undo) is sent, since conditions can change while it
+waits; a command they block fails without reaching the device.
+The queue lives in memory, so commands still queued when a process exits stay
+'queued' in the table and are never sent.
+"""
+import importlib
+import logging
+import queue
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from app.database import db
+from app.device_state import device_state
+from app.interlocks import check_safety_interlocks, latest_sensor_data
+from app.live_updates import live_updates
+from app.models import DeviceCommand
+
+logger = logging.getLogger(__name__)
+
+# Device status after each action
+ACTION_TO_STATUS = {
+    'ON': 'ON',
+    'OFF': 'OFF',
+    'OPEN': 'OPEN',
+    'CLOSE': 'CLOSED',
+    'START': 'RUNNING',
+    'STOP': 'IDLE',
+}
+# Actions each kind of device accepts, by the keyword its device_type contains
+VALID_ACTIONS = {
+    'PUMP': ['ON', 'OFF'],
+    'VALVE': ['OPEN', 'CLOSE'],
+    'LIGHT': ['ON', 'OFF'],
+    'FAN': ['ON', 'OFF'],
+    'HEATER': ['ON', 'OFF'],
+    'GENERIC': ['ON', 'OFF'],
+}
+# Action undoing each action, for rolling back the applied steps of a failed sequence
+INVERSE_ACTIONS = {'ON': 'OFF', 'OFF': 'ON', 'OPEN': 'CLOSE', 'CLOSE': 'OPEN', 'START': 'STOP', 'STOP': 'START'}
+# Commands whose timings are kept for the latency stats
+LATENCY_SAMPLES = 1000
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def invalid_action_error(device, action):
+    """Why `device` (a Device.to_dict() row) cannot take `action`, or None if it can."""
+    device_type = device['device_type'].upper()
+    standard_type = next((k for k in VALID_ACTIONS if k in device_type), 'GENERIC')
+    if action.upper() not in VALID_ACTIONS[standard_type]:
+        return (f'Invalid action {action} for device type {device["device_type"]}. '
+                f'Valid actions are: {", ".join(VALID_ACTIONS[standard_type])}')
+    return None
+
+
+class DeviceCommandError(Exception):
+    """The controller rejected a command or did not confirm it in time."""
+
+
+class DeviceAdapter:
+    """Transport to the device controllers; subclasses implement execute()."""
+    name = 'adapter'
+
+    def init_app(self, app):
+        """Read the adapter's settings from the app config."""
+
+    def execute(self, device, action, timeout):
+        """
+        Send `action` ('ON', 'CLOSE', ...) to `device` (Device.to_dict()) and wait at most
+        `timeout` seconds for the controller to confirm it. Returns the device's new status;
+        raises DeviceCommandError (or any other exception) if the command failed.
+        """
+        raise NotImplementedError
+
+
+class SimulatorAdapter(DeviceAdapter):
+    """Stands in for the hardware: confirms every command after a configurable delay."""
+    name = 'simulator'
+
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+
+    def init_app(self, app):
+        self.latency = float(app.config.get('DEVICE_SIMULATOR_LATENCY', self.latency))
+        self.failure_rate = float(app.config.get('DEVICE_SIMULATOR_FAILURE_RATE', self.failure_rate))
+
+    def delay_for(self, device):
+        return max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+
+    def execute(self, device, action, timeout):
+        delay = self.delay_for(device)
+        if delay > timeout:
+            time.sleep(timeout)
+            raise DeviceCommandError(f"No answer from {device['control_id']} within {timeout:g}s")
+        time.sleep(delay)
+        if self._rng.random() < self.failure_rate:
+            raise DeviceCommandError(f"Simulated failure of {device['control_id']}")
+        return ACTION_TO_STATUS.get(action, action)
+
+
+ADAPTERS = {SimulatorAdapter.name: SimulatorAdapter}
+
+
+def load_adapter(spec):
+    """Adapter named in ADAPTERS, or a DeviceAdapter subclass given as 'package.module:Class'."""
+    if spec in ADAPTERS:
+        return ADAPTERS[spec]()
+    module_name, _, class_name = spec.partition(':')
+    if not class_name:
+        raise ValueError(f'Unknown device adapter: {spec}')
+    adapter_class = getattr(importlib.import_module(module_name), class_name)
+    if not issubclass(adapter_class, DeviceAdapter):
+        raise ValueError(f'{spec} is not a DeviceAdapter')
+    return adapter_class()
+
+
+class _Run:
+    """Progress of a scene run: the step being executed, the steps after it and the applied ones."""
+
+    def __init__(self, run_id, steps, rollback, next_position):
+        self.run_id = run_id
+        self.current = None
+        self.remaining = deque(steps)  # (command id, device id, action)
+        self.applied = []
+        self.rollback = rollback
+        self.next_position = next_position
+
+
+class DeviceCommandQueue:
+    """Per-device FIFO queues of command ids, drained by a pool of worker threads."""
+
+    def __init__(self, workers=4, max_age=60.0, timeout=10.0):
+        self.workers = workers
+        self.max_age = max_age
+        self.timeout = timeout
+        self.adapter = SimulatorAdapter()
+        self._app = None
+        self._lock = threading.Lock()
+        # Devices with commands waiting or running -> ids of the waiting ones, oldest first
+        self._pending = {}
+        # Devices with waiting commands and no worker on them
+        self._ready = queue.Queue()
+        self._threads = []
+        # When each queued command was released to its device's queue
+        self._queued_at = {}
+        # Scene runs by the id of their step that is queued or running
+        self._runs = {}
+        self.running = 0
+        self.submitted = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.expired = 0
+        self.blocked = 0
+        self.cancelled = 0
+        self.compensations = 0
+        self._timings = deque(maxlen=LATENCY_SAMPLES)  # (queued seconds, execution seconds)
+
+    def init_app(self, app):
+        self._app = app
+        self.workers = int(app.config.get('DEVICE_COMMAND_WORKERS', self.workers))
+        self.max_age = float(app.config.get('DEVICE_COMMAND_MAX_AGE', self.max_age))
+        self.timeout = float(app.config.get('DEVICE_COMMAND_TIMEOUT', self.timeout))
+        self.adapter = load_adapter(app.config.get('DEVICE_ADAPTER') or SimulatorAdapter.name)
+        self.adapter.init_app(app)
+
+    def submit(self, command):
+        """Queue a committed DeviceCommand behind the earlier commands of its device."""
+        self._enqueue(command.id, command.device_id)
+
+    def submit_run(self, commands, rollback=True):
+        """
+        Send committed commands (their to_dict() rows) strictly one after another in list order,
+        whatever their devices.
+        With `rollback`, a step that fails or expires cancels the steps after it and the applied
+        ones are undone by their inverse actions, last first. Without it (as for the undo steps
+        themselves), every step is attempted.
+        """
+        steps = [(command['id'], command['device_id'], command['action']) for command in commands]
+        next_position = max(command['position'] or 0 for command in commands) + 1
+        run = _Run(commands[0]['run_id'], steps[1:], rollback, next_position)
+        self._start_step(run, steps[0])
+
+    def _start_step(self, run, step):
+        run.current = step
+        with self._lock:
+            self._runs[step[0]] = run
+        self._enqueue(step[0], step[1])
+
+    def _enqueue(self, command_id, device_id):
+        self._ensure_started()
+        with self._lock:
+            self.submitted += 1
+            self._queued_at[command_id] = _utcnow()
+            waiting = self._pending.get(device_id)
+            if waiting is None:
+                self._pending[device_id] = deque([command_id])
+                self._ready.put(device_id)
+            else:
+                waiting.append(command_id)
+
+    # --- Workers ---
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._threads or self._app is None:
+                return
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'device-commands-{number}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            device_id = self._ready.get()
+            with self._lock:
+                command_id = self._pending[device_id].popleft()
+                self.running += 1
+            outcome = None
+            try:
+                with self._app.app_context():
+                    outcome = self._execute(command_id)
+            except Exception:
+                logger.exception('Device command %s failed', command_id)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    # The device goes to the back of the line, so busy devices don't starve the others
+                    if self._pending[device_id]:
+                        self._ready.put(device_id)
+                    else:
+                        del self._pending[device_id]
+                    run = self._runs.pop(command_id, None)
+            if run is not None:
+                try:
+                    with self._app.app_context():
+                        self._advance(run, outcome)
+                except Exception:
+                    logger.exception('Scene run %s stopped after command %s', run.run_id, command_id)
+
+    def _advance(self, run, outcome):
+        """Start the next step of a run, or cancel and undo it after a failed step."""
+        if outcome == DeviceCommand.SUCCEEDED or not run.rollback:
+            if outcome == DeviceCommand.SUCCEEDED:
+                run.applied.append(run.current)
+            if run.remaining:
+                self._start_step(run, run.remaining.popleft())
+            return
+        cancelled = [command_id for command_id, _, _ in run.remaining]
+        try:
+            if cancelled:
+                db.session.query(DeviceCommand).filter(DeviceCommand.id.in_(cancelled)).update({
+                    DeviceCommand.status: DeviceCommand.CANCELLED,
+                    DeviceCommand.error: f'Not sent: command {run.current[0]} of the run did not succeed',
+                    DeviceCommand.finished_at: _utcnow(),
+                }, synchronize_session=False)
+            undo = [
+                DeviceCommand(device_id=device_id, action=INVERSE_ACTIONS[action], run_id=run.run_id,
+                              position=position, compensates_id=command_id)
+                for position, (command_id, device_id, action)
+                in enumerate(reversed([step for step in run.applied if step[2] in INVERSE_ACTIONS]), run.next_position)
+            ]
+            db.session.add_all(undo)
+            db.session.flush()
+            undo = [command.to_dict() for command in undo]
+            db.session.commit()
+            with self._lock:
+                self.cancelled += len(cancelled)
+                self.compensations += len(undo)
+            if undo:
+                self.submit_run(undo, rollback=False)
+        finally:
+            db.session.remove()
+
+    def _execute(self, command_id):
+        try:
+            command = db.session.get(DeviceCommand, command_id)
+            started = _utcnow()
+            with self._lock:
+                queued_at = self._queued_at.pop(command_id, None)
+            # Steps of a run wait for the steps before them; only their own time in the queue counts
+            waited = (started - (queued_at or command.created_at)).total_seconds()
+            if waited > self.max_age:
+                command.status = DeviceCommand.EXPIRED
+                command.error = f'Not sent: waited {waited:.1f}s in the queue'
+                command.finished_at = started
+                db.session.commit()
+                with self._lock:
+                    self.expired += 1
+                return DeviceCommand.EXPIRED
+            device_id, action = command.device_id, command.action
+            device = device_state.get(device_id)
+            # Conditions may have changed since the command was accepted
+            interlock = check_safety_interlocks(device, action, latest_sensor_data()) if device else None
+            command.status = DeviceCommand.RUNNING
+            command.started_at = started
+            # Committed before the hardware call, which must not keep a transaction open
+            db.session.commit()
+
+            try:
+                if device is None:
+                    raise DeviceCommandError(f'Device {device_id} no longer exists')
+                if interlock['blocked']:
+                    with self._lock:
+                        self.blocked += 1
+                    raise DeviceCommandError(f"Blocked by safety interlock: {interlock['reason']}")
+                result = self.adapter.execute(device, action, self.timeout)
+            except Exception as e:
+                succeeded = False
+                command.status = DeviceCommand.FAILED
+                command.error = f'{type(e).__name__}: {e}'[:500]
+            else:
+                succeeded = True
+                command.status = DeviceCommand.SUCCEEDED
+                command.result = result
+                device_state.set_status(device['id'], result)
+            finished = _utcnow()
+            command.finished_at = finished
+            db.session.commit()
+            live_updates.wake() # Push the new status to live dashboards
+
+            with self._lock:
+                if succeeded:
+                    self.succeeded += 1
+                else:
+                    self.failed += 1
+                self._timings.append((waited, (finished - started).total_seconds()))
+            return DeviceCommand.SUCCEEDED if succeeded else DeviceCommand.FAILED
+        finally:
+            db.session.remove()
+
+    # --- Monitoring ---
+
+    def stats(self):
+        with self._lock:
+            timings = list(self._timings)
+            waiting = sum(len(ids) for ids in self._pending.values())
+            stats = {
+                'adapter': self.adapter.name,
+                'workers': self.workers,
+                'queued': waiting,
+                'devices_busy': len(self._pending),
+                'running': self.running,
+                'submitted': self.submitted,
+                'succeeded': self.succeeded,
+                'failed': self.failed,
+                'expired': self.expired,
+                'blocked': self.blocked,
+                'cancelled': self.cancelled,
+                'compensations': self.compensations,
+                'runs_in_progress': len(self._runs),
+            }
+        totals = sorted(queued + execution for queued, execution in timings)
+        stats.update({
+            'avg_queued_ms': round(sum(queued for queued, _ in timings) / len(timings) * 1000, 1) if timings else None,
+            'avg_execution_ms': round(sum(execution for _, execution in timings) / len(timings) * 1000, 1)
+                if timings else None,
+            'p95_total_ms': round(totals[int(len(totals) * 0.95) - 1 if len(totals) > 1 else 0] * 1000, 1)
+                if totals else None,
+        })
+        return stats
+
+
+device_commands = DeviceCommandQueue()
@@ -0,0 +1,367 @@
+"""
+Authoritative in-process store of device state.
+
+Every process keeps all devices as Device.to_dict() rows in memory, loaded
+from the devices table on first use, so /api/devices, the control endpoints
+and the live update poller read device state without SQL. Status changes
+(set_status()) are applied in memory at once and written behind: a flusher
+thread persists the changed devices with one executemany UPDATE every
+DEVICE_STATE_FLUSH_INTERVAL seconds, and once more when the process exits.
+
+Every flush and every Device row change (name, type, enabled) bumps the
+device_state_version row in its transaction. A read checks it at most every
+DEVICE_STATE_CHECK_INTERVAL seconds and reloads the table if another process
+changed it; the table is also reloaded every DEVICE_STATE_RELOAD_INTERVAL
+seconds regardless.
+
+DEVICE_STATE_BACKEND selects how the worker processes of one host share
+statuses:
+  memory  (default) through the table: other workers see a change once it is
+          flushed and their next version check finds it, i.e. within
+          DEVICE_STATE_FLUSH_INTERVAL + DEVICE_STATE_CHECK_INTERVAL seconds
+  file    statuses are also written to DEVICE_STATE_FILE (a JSON file replaced
+          atomically under an flock); every worker checks its version line
+          before a read and picks up what the others wrote at once
+
+After a crash the state is reloaded from the table; with the file backend,
+statuses in the file that are newer than the table (changes that were not
+flushed yet) win and are flushed again.
+"""
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+try:
+    import fcntl  # Locks the shared state file (POSIX only)
+except ImportError:
+    fcntl = None
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.database import db
+from app.models import Device, DeviceStateVersion
+
+logger = logging.getLogger(__name__)
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class LocalFileBackend:
+    """
+    Device statuses shared by the processes of one host through a JSON file: a version line
+    (changed by every write), then {"<device id>": [status, last_status_update], ...}.
+    """
+
+    def __init__(self, path):
+        if fcntl is None:
+            raise RuntimeError('The file device state backend needs fcntl (POSIX systems only)')
+        self.path = path
+        self._lock_path = path + '.lock'
+        self.version = None  # Version of the file last read by this process
+
+    def read(self, changed_only=True):
+        """Statuses in the file; with `changed_only`, None if the file did not change since the last read."""
+        try:
+            with open(self.path) as f:
+                version = f.readline().strip()
+                if changed_only and version == self.version:
+                    return None
+                statuses = json.loads(f.read() or '{}')
+        except FileNotFoundError:
+            return None
+        self.version = version
+        return statuses
+
+    def write(self, changes):
+        """Merge {device id: (status, last_status_update)} into the file."""
+        with open(self._lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self.path) as f:
+                        f.readline()
+                        statuses = json.loads(f.read() or '{}')
+                except FileNotFoundError:
+                    statuses = {}
+                statuses.update({str(device_id): list(state) for device_id, state in changes.items()})
+                fd, temporary = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.', prefix='.device_state-')
+                with os.fdopen(fd, 'w') as f:
+                    f.write(f'{uuid.uuid4().hex}\n{json.dumps(statuses)}')
+                os.replace(temporary, self.path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class DeviceStateStore:
+    """All devices in memory by id; status changes are queued for a write-behind flush to the devices table."""
+
+    def __init__(self, flush_interval=1.0, reload_interval=60.0, version_check_interval=1.0):
+        self.flush_interval = flush_interval
+        self.reload_interval = reload_interval
+        self.version_check_interval = version_check_interval
+        self.backend = None
+        self._app = None
+        self._lock = threading.Lock()
+        # Serializes flushes and table reloads, so a reload never reads a status a flush is about to write
+        self._persist_lock = threading.Lock()
+        self._devices = None  # id -> Device.to_dict() row
+        self._by_control_id = {}
+        self._dirty = {}  # id -> (status, last_status_update) not flushed yet
+        self._stale = False
+        self._loaded_at = 0.0
+        self._version = None  # device_state_version the devices were loaded at
+        self._checked_at = 0.0  # monotonic time of the last version check
+        self._wake = threading.Event()
+        self._thread = None
+        self.reads = 0
+        self.writes = 0
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.flush_failures = 0
+        self.reloads = 0
+        self.version_checks = 0
+        self.stale_reloads = 0
+
+    def init_app(self, app):
+        self._app = app
+        self.flush_interval = float(app.config.get('DEVICE_STATE_FLUSH_INTERVAL', self.flush_interval))
+        self.reload_interval = float(app.config.get('DEVICE_STATE_RELOAD_INTERVAL', self.reload_interval))
+        self.version_check_interval = float(app.config.get('DEVICE_STATE_CHECK_INTERVAL',
+                                                           self.version_check_interval))
+        backend = app.config.get('DEVICE_STATE_BACKEND', 'memory')
+        if backend == 'file':
+            path = app.config.get('DEVICE_STATE_FILE') or os.path.join(app.instance_path, 'device_state.json')
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.backend = LocalFileBackend(path)
+        elif backend != 'memory':
+            raise ValueError(f'Unknown DEVICE_STATE_BACKEND: {backend}')
+        atexit.register(self._flush_at_exit)
+
+    # --- Reads ---
+
+    def _sync(self):
+        """Load the devices if needed and take in the statuses other processes shared."""
+        self._ensure_started()
+        if self._devices is None or self._stale or self._changed_elsewhere():
+            self.reload()
+        elif self.backend is not None:
+            statuses = self.backend.read()
+            if statuses:
+                with self._lock:
+                    self._apply(statuses)
+
+    def _changed_elsewhere(self):
+        """Whether another process changed devices or flushed statuses; checked at most every version_check_interval seconds."""
+        if time.monotonic() - self._checked_at < self.version_check_interval:
+            return False
+        self._checked_at = time.monotonic()
+        with self._lock:
+            self.version_checks += 1
+        if self.state_version(db.session.connection()) == self._version:
+            return False
+        with self._lock:
+            self.stale_reloads += 1
+        return True
+
+    def all(self):
+        """Copies of every device's to_dict() row, by id."""
+        self._sync()
+        with self._lock:
+            self.reads += 1
+            return [dict(self._devices[device_id]) for device_id in sorted(self._devices)]
+
+    def get(self, device_id):
+        """Copy of one device's to_dict() row, or None."""
+        self._sync()
+        with self._lock:
+            self.reads += 1
+            device = self._devices.get(device_id)
+            return dict(device) if device else None
+
+    def by_control_id(self, control_id):
+        """Copy of the to_dict() row of the device with `control_id`, or None."""
+        self._sync()
+        with self._lock:
+            self.reads += 1
+            device = self._by_control_id.get(control_id)
+            return dict(device) if device else None
+
+    # --- Writes ---
+
+    def set_status(self, device_id, status):
+        """Record a status reported by the device; it reaches the table with the next flush."""
+        self._sync()
+        state = (status, _utcnow().isoformat())
+        with self._lock:
+            self._apply({device_id: state})
+            self._dirty[device_id] = state
+            self.writes += 1
+        if self.backend is not None:
+            self.backend.write({device_id: state})
+
+    def _apply(self, statuses, mark_dirty=False):
+        """Take in {device id: (status, last_status_update)} unless older than what is known (call with the lock held)."""
+        for device_id, (status, updated) in statuses.items():
+            device = self._devices.get(int(device_id))
+            if device is None or (updated or '') < (device['last_status_update'] or ''):
+                continue
+            if (status, updated) != (device['status'], device['last_status_update']):
+                device['status'] = status
+                device['last_status_update'] = updated
+                if mark_dirty:
+                    self._dirty[device['id']] = (status, updated)
+
+    def invalidate(self):
+        """Reload the devices from the table on the next read (after Device rows were changed)."""
+        self._stale = True
+
+    # --- Persistence ---
+
+    @staticmethod
+    def state_version(connection):
+        """Current device_state_version (0 before any change was recorded)."""
+        table = DeviceStateVersion.__table__
+        return connection.execute(db.select(table.c.version).where(table.c.id == 1)).scalar() or 0
+
+    @staticmethod
+    def bump_state_version(connection):
+        """Record a device change in the caller's transaction, for every worker process to see."""
+        table = DeviceStateVersion.__table__
+        result = connection.execute(table.update().where(table.c.id == 1).values(version=table.c.version + 1))
+        if not result.rowcount:
+            connection.execute(table.insert().values(id=1, version=1))
+
+    def reload(self):
+        """Load every device from the table, keeping the status changes that are not flushed yet."""
+        with self._persist_lock:
+            self._stale = False
+            # Read before the rows: a change committed in between only causes one more reload
+            version = self.state_version(db.session.connection())
+            devices = {device.id: device.to_dict() for device in Device.query}
+            with self._lock:
+                for device_id, (status, updated) in self._dirty.items():
+                    if device_id in devices:
+                        devices[device_id].update(status=status, last_status_update=updated)
+                self._devices = devices
+                self._by_control_id = {device['control_id']: device for device in devices.values()}
+                self._loaded_at = self._checked_at = time.monotonic()
+                self._version = version
+                self.reloads += 1
+                # Statuses shared by processes that may have died before flushing them
+                statuses = self.backend.read(changed_only=False) if self.backend is not None else None
+                if statuses:
+                    self._apply(statuses, mark_dirty=True)
+
+    def flush(self):
+        """Write the status changes made since the last flush to the devices table; returns the row count."""
+        with self._persist_lock:
+            with self._lock:
+                pending = dict(self._dirty)
+            if not pending:
+                return 0
+            table = Device.__table__
+            rows = [{'device_id': device_id, 'new_status': status, 'updated': datetime.fromisoformat(updated)}
+                    for device_id, (status, updated) in pending.items()]
+            with db.engine.begin() as connection:
+                connection.execute(
+                    table.update().where(table.c.id == db.bindparam('device_id')).values(
+                        status=db.bindparam('new_status'),
+                        last_status_update=db.bindparam('updated', type_=table.c.last_status_update.type)),
+                    rows)
+                self.bump_state_version(connection)
+                version = self.state_version(connection)
+            with self._lock:
+                # This process already holds what it flushed
+                if self._version == version - 1:
+                    self._version = version
+                # Changes made while the flush ran are flushed next time
+                for device_id, state in pending.items():
+                    if self._dirty.get(device_id) == state:
+                        del self._dirty[device_id]
+                self.flushes += 1
+                self.rows_flushed += len(rows)
+            return len(rows)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                with self._app.app_context():
+                    self.flush()
+                    if time.monotonic() - self._loaded_at >= self.reload_interval:
+                        self.reload()
+                    db.session.remove()
+            except Exception:
+                with self._lock:
+                    self.flush_failures += 1
+                logger.exception('Device state flush failed')
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None and self._app is not None:
+                self._thread = threading.Thread(target=self._run, name='device-state', daemon=True)
+                self._thread.start()
+
+    def _flush_at_exit(self):
+        if self._dirty:
+            try:
+                with self._app.app_context():
+                    self.flush()
+            except Exception:
+                logger.exception('Device state changes could not be flushed at exit')
+
+    # --- Monitoring ---
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': 'file' if self.backend is not None else 'memory',
+                'devices': len(self._devices) if self._devices is not None else None,
+                'reads': self.reads,
+                'writes': self.writes,
+                'unflushed': len(self._dirty),
+                'flushes': self.flushes,
+                'rows_flushed': self.rows_flushed,
+                'flush_failures': self.flush_failures,
+                'reloads': self.reloads,
+                'state_version': self._version,
+                'version_checks': self.version_checks,
+                'stale_reloads': self.stale_reloads,
+                'flush_interval_seconds': self.flush_interval,
+            }
+
+
+device_state = DeviceStateStore()
+
+
+# --- Device row changes ---
+# Status changes go through set_status(); these hooks catch devices added, edited or deleted through the ORM.
+
+@event.listens_for(Session, 'after_flush')
+def _note_device_write(session, flush_context):
+    if any(isinstance(obj, Device) for obj in (*session.new, *session.dirty, *session.deleted)):
+        if not session.info.get('devices_written'):
+            # Once per transaction; committed (or rolled back) together with the device change
+            device_state.bump_state_version(session.connection())
+        session.info['devices_written'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop('devices_written', False):
+        device_state.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_device_write(session):
+    session.info.pop('devices_written', None)
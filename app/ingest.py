@@ -0,0 +1,292 @@
+"""
+Bulk ingestion of sensor readings.
+
+Readings are validated against the SensorData metric columns and written
+with Core `executemany` inserts in chunks (no ORM objects), together with
+the matching rollup updates, inside one transaction per request. Small
+requests can instead be group-committed through app.ingest_buffer.
+"""
+import json
+import math
+from datetime import datetime, timezone
+
+from app.alarm_engine import alarm_engine
+from app.database import db, executemany_rows
+from app.ingest_validation import PENDING
+from app.models import IngestKey, SensorData, SensorDataQuarantine, SENSOR_METRIC_COLUMNS
+from app.rollups import apply_readings
+from app.sensor_cache import latest_reading_cache
+
+# Rows per executemany() call
+INGEST_CHUNK_SIZE = 5000
+# Per-row errors reported back to the client; the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+
+INSERT_COLUMNS = ['timestamp', 'source_id'] + SENSOR_METRIC_COLUMNS
+# Fields a reading may carry: the optional per-reading sequence number is used for deduplication;
+# source_id is not one of them, it is set from the X-Source-Id header
+_EMPTY_ROW = dict.fromkeys(['timestamp'] + SENSOR_METRIC_COLUMNS + ['seq'])
+KEY_INSERT_COLUMNS = ['source_id', 'scope', 'seq', 'received_at']
+QUARANTINE_INSERT_COLUMNS = ['timestamp', 'source_id', 'metric', 'value', 'reason', 'received_at']
+# Largest sequence number the BIGINT ingest_keys.seq column holds
+MAX_SEQ = 2 ** 63 - 1
+_FLOAT_TYPES = {float, type(None)}
+
+
+class IngestError(ValueError):
+    """A reading that cannot be stored."""
+
+
+class IngestResult:
+    """Counters and per-row errors of one ingest request."""
+
+    def __init__(self):
+        self.received = 0
+        self.inserted = 0
+        self.rejected = 0
+        self.duplicates = 0
+        self.quarantined = 0
+        self.errors = []
+
+    def reject(self, index, message):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'index': index, 'error': message})
+
+    def to_dict(self):
+        return {
+            'received': self.received,
+            'inserted': self.inserted,
+            'rejected': self.rejected,
+            'duplicates': self.duplicates,
+            'quarantined': self.quarantined,
+            'errors': self.errors,
+            'errors_truncated': self.rejected > len(self.errors),
+        }
+
+
+def parse_timestamp(value):
+    """ISO 8601 string or Unix seconds -> naive UTC datetime."""
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            raise IngestError(f'Invalid timestamp: {value}. Use ISO format (YYYY-MM-DDTHH:MM:SS) or Unix seconds')
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            parsed = datetime.fromtimestamp(value, timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            raise IngestError(f'Timestamp out of range: {value}')
+    else:
+        raise IngestError('timestamp must be an ISO string or Unix seconds')
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def validate_reading(record, default_timestamp):
+    """Turn one decoded JSON object into a full sensordata row dict, or raise IngestError."""
+    if not isinstance(record, dict):
+        raise IngestError('Reading must be a JSON object')
+    row = _EMPTY_ROW.copy()
+    row.update(record)
+    if len(row) != len(_EMPTY_ROW):
+        unknown = next(key for key in record if key not in _EMPTY_ROW)
+        raise IngestError(f'Unknown field: {unknown}')
+    timestamp = row['timestamp']
+    seq = row['seq']
+    row['timestamp'] = row['seq'] = None
+
+    # Fast path for the common case: only floats/nulls, all finite (inf/nan poison the sum)
+    if not set(map(type, row.values())) <= _FLOAT_TYPES or not math.isfinite(sum(filter(None, row.values()))):
+        for key in SENSOR_METRIC_COLUMNS:
+            value = row[key]
+            if value is None:
+                continue
+            value_type = type(value)
+            if value_type is float:
+                if not math.isfinite(value):
+                    raise IngestError(f'{key} must be a finite number')
+            elif value_type is int:
+                row[key] = float(value)
+            else:
+                raise IngestError(f'{key} must be a number or null')
+
+    if seq is not None:
+        if type(seq) is not int or not 0 <= seq <= MAX_SEQ:
+            raise IngestError('seq must be a non-negative 64-bit integer')
+        row['seq'] = seq
+    row['timestamp'] = default_timestamp if timestamp is None else parse_timestamp(timestamp)
+    return row
+
+
+def iter_json_array(body):
+    """Readings from a JSON array body."""
+    try:
+        payload = json.loads(body)
+    except ValueError as e:
+        raise IngestError(f'Invalid JSON: {e}')
+    if not isinstance(payload, list):
+        raise IngestError('Expected a JSON array of readings')
+    return iter(payload)
+
+
+def iter_ndjson(lines):
+    """Readings from NDJSON lines; undecodable lines are yielded as IngestError instances."""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield IngestError(f'Invalid JSON line: {e}')
+
+
+def write_readings(connection, rows, key_rows=(), quarantine_rows=(), settled=()):
+    """
+    Insert validated rows, their ingest_keys rows and quarantined values,
+    merge the rows into the rollups and raise alarms for them (no commit).
+    `settled` values withheld by the validator are applied afterwards (see settle_pending).
+    """
+    if key_rows:
+        keys_table = IngestKey.__table__
+        executemany_rows(connection, keys_table.insert(), keys_table, KEY_INSERT_COLUMNS, key_rows)
+    if quarantine_rows:
+        quarantine_table = SensorDataQuarantine.__table__
+        executemany_rows(connection, quarantine_table.insert(), quarantine_table, QUARANTINE_INSERT_COLUMNS,
+                         quarantine_rows)
+    if rows:
+        table = SensorData.__table__
+        executemany_rows(connection, table.insert(), table, INSERT_COLUMNS, rows)
+        apply_readings(connection, rows)
+        alarm_engine.process(connection, rows)
+    if settled:
+        settle_pending(connection, settled)
+
+
+def settle_pending(connection, settled):
+    """
+    Decide withheld values (ReadingValidator.validate): spikes stay quarantined with
+    reason 'rate', the others are written back to their readings, merged into the
+    rollups and checked against the alarm rules (no commit).
+    """
+    quarantine = SensorDataQuarantine.__table__
+    table = SensorData.__table__
+    restored = {}
+    for value in settled:
+        pending = quarantine.c
+        match = ((pending.timestamp == value['timestamp']) & (pending.metric == value['metric'])
+                 & (pending.source_id == value['source_id']) & (pending.reason == PENDING))
+        if value['spike']:
+            connection.execute(quarantine.update().where(match).values(reason='rate'))
+            continue
+        connection.execute(quarantine.delete().where(match))
+        connection.execute(table.update()
+                           .where((table.c.timestamp == value['timestamp']) & (table.c.source_id == value['source_id']))
+                           .values({value['metric']: value['value']}))
+        row = restored.setdefault((value['timestamp'], value['source_id']), dict.fromkeys(INSERT_COLUMNS))
+        row.update({'timestamp': value['timestamp'], 'source_id': value['source_id'], value['metric']: value['value']})
+    if restored:
+        rows = list(restored.values())
+        apply_readings(connection, rows)
+        alarm_engine.process(connection, rows)
+
+
+def _validated_rows(records, result):
+    """Valid rows of `records`; rejected readings are recorded on `result`."""
+    default_timestamp = datetime.now(timezone.utc).replace(tzinfo=None)
+    for index, record in enumerate(records):
+        result.received += 1
+        if isinstance(record, IngestError):
+            result.reject(index, str(record))
+            continue
+        try:
+            yield validate_reading(record, default_timestamp)
+        except IngestError as e:
+            result.reject(index, str(e))
+
+
+def ingest_readings(records, buffer=None, keys=None, validator=None):
+    """
+    Validate and insert an iterable of decoded readings in one transaction.
+    Invalid readings are skipped and reported by their position in the input.
+    """
+    result = IngestResult()
+    return store_rows(_validated_rows(records, result), result, buffer, keys, validator)
+
+
+def store_rows(rows, result, buffer=None, keys=None, validator=None):
+    """
+    Insert an iterable of validated rows in chunks and commit, counting them on `result`.
+    With a `buffer` (IngestBuffer), a request that fits into a single chunk is
+    handed to it and committed together with other callers' rows instead.
+    With `keys` (IngestKeyFilter), already-ingested readings are dropped and counted
+    as duplicates, and the keys of the new ones are stored in the same transaction.
+    With a `validator` (ReadingValidator), implausible values are quarantined.
+    """
+    connection = None
+    chunk = []
+    key_rows = []
+    try:
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= INGEST_CHUNK_SIZE:
+                connection = connection or db.session.connection()
+                chunk, chunk_keys, quarantine, settled = _prepare_chunk(chunk, result, keys, validator)
+                write_readings(connection, chunk, chunk_keys, quarantine, settled)
+                result.inserted += len(chunk)
+                key_rows += chunk_keys
+                chunk = []
+        if chunk and connection is None and buffer is not None and len(chunk) <= buffer.max_rows:
+            # Small batch: group-commit it (the buffer invalidates the cache itself)
+            chunk, key_rows, quarantine, settled = _prepare_chunk(chunk, result, keys, validator)
+            if chunk or key_rows or quarantine or settled:
+                result.inserted += buffer.submit(chunk, key_rows, quarantine, settled)
+                if keys is not None:
+                    keys.committed(key_rows)
+            return result
+        if chunk:
+            connection = connection or db.session.connection()
+            chunk, chunk_keys, quarantine, settled = _prepare_chunk(chunk, result, keys, validator)
+            write_readings(connection, chunk, chunk_keys, quarantine, settled)
+            result.inserted += len(chunk)
+            key_rows += chunk_keys
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if keys is not None:
+        keys.committed(key_rows)
+    if result.inserted:
+        latest_reading_cache.invalidate()
+    return result
+
+
+def _prepare_chunk(chunk, result, keys, validator):
+    """
+    Drop replayed readings, then apply the validation profile.
+    Returns (rows, key rows, quarantine rows, settled withheld values).
+    """
+    key_rows = []
+    source_id = None
+    if keys is not None:
+        chunk, key_rows = keys.filter(chunk, result)
+        source_id = keys.source_id
+    for row in chunk:
+        row['source_id'] = source_id
+    quarantine = []
+    settled = []
+    if validator is not None:
+        chunk, quarantine, rejected, settled = validator.validate(chunk, source_id)
+        result.quarantined += sum(1 for row in quarantine if row['reason'] not in ('missing', PENDING))
+        result.quarantined += sum(1 for value in settled if value['spike'])
+        for row, missing in rejected:
+            # Found per chunk, so these are identified by timestamp rather than input position
+            result.reject(None, f"Reading at {row['timestamp'].isoformat()} is missing required {', '.join(missing)}")
+        if rejected and key_rows:
+            # Rejected readings were not stored, so their sequence numbers must stay reusable
+            rejected_seqs = {row.get('seq') for row, missing in rejected}
+            key_rows = [key for key in key_rows
+                        if key['scope'] != IngestKey.SCOPE_READING or key['seq'] not in rejected_seqs]
+    return chunk, key_rows, quarantine, settled
@@ -0,0 +1,101 @@
+from flask import Blueprint, jsonify, request
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from app.auth import api_key_required
+from app.models import SensorDataQuarantine, SENSOR_METRIC_COLUMNS
+from app.ingest import MAX_SEQ, IngestError, ingest_readings, iter_json_array, iter_ndjson, store_rows
+from app.ingest_binary import CONTENT_TYPE as BINARY_CONTENT_TYPE, decode_frame
+from app.ingest_buffer import ingest_buffer
+from app.ingest_validation import reading_validator
+from app.ingest_dedup import IngestKeyFilter, MAX_SOURCE_ID_LENGTH, recent_ingest_keys
+
+ingest_bp = Blueprint('ingest_bp', __name__)
+
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+def _key_filter():
+    """IngestKeyFilter for the request's X-Source-Id / X-Batch-Seq headers, or None."""
+    source_id = request.headers.get('X-Source-Id', '').strip()
+    batch_seq = request.headers.get('X-Batch-Seq', '').strip()
+    if not source_id:
+        if batch_seq:
+            raise IngestError('X-Batch-Seq requires an X-Source-Id header')
+        return None
+    if len(source_id) > MAX_SOURCE_ID_LENGTH:
+        raise IngestError(f'X-Source-Id must be at most {MAX_SOURCE_ID_LENGTH} characters')
+    if batch_seq and not (batch_seq.isdigit() and int(batch_seq) <= MAX_SEQ):
+        raise IngestError('X-Batch-Seq must be a non-negative 64-bit integer')
+    return IngestKeyFilter(source_id, int(batch_seq) if batch_seq else None)
+
+# --- Ingestion Endpoints ---
+
+@ingest_bp.route('/api/ingest', methods=['POST'])
+@api_key_required
+def ingest():
+    """
+    Store a batch of sensor readings.
+    Body is either a JSON array of reading objects (Content-Type: application/json)
+    or one reading object per line (Content-Type: application/x-ndjson, read as a stream),
+    or a binary frame of packed readings (Content-Type: application/x-irrigo-readings,
+    see app/ingest_binary.py).
+    Each reading may contain 'timestamp' (ISO 8601 or Unix seconds, UTC; defaults to now)
+    and any SensorData metric column. Invalid readings are rejected individually.
+    Batches of up to INGEST_BUFFER_MAX_ROWS readings are group-committed with other
+    requests; the response is only sent once they are committed.
+
+    Retries are deduplicated when the gateway sends an X-Source-Id header together
+    with an X-Batch-Seq header (the whole upload) and/or a non-negative integer 'seq'
+    in each reading. Readings that were already stored are counted as 'duplicates'.
+
+    Values outside the validation profile (bounds, rate of change; see
+    app/ingest_validation.py) are stored as null and copied to sensordata_quarantine;
+    they are counted as 'quarantined'. A steep newest value is held back as 'pending'
+    until the source's next reading shows whether it was a spike.
+    """
+    content_type = (request.mimetype or '').lower()
+    try:
+        keys = _key_filter()
+        options = {'buffer': ingest_buffer, 'keys': keys, 'validator': reading_validator}
+        if content_type == BINARY_CONTENT_TYPE:
+            rows, result = decode_frame(request.get_data())
+            result = store_rows(rows, result, **options)
+        elif content_type in NDJSON_CONTENT_TYPES:
+            result = ingest_readings(iter_ndjson(request.stream), **options)
+        elif content_type == 'application/json':
+            result = ingest_readings(iter_json_array(request.get_data()), **options)
+        else:
+            return jsonify({"error": f"Unsupported Content-Type: {content_type or 'none'}. "
+                                     f"Use application/json, application/x-ndjson or {BINARY_CONTENT_TYPE}"}), 415
+    except IngestError as e:
+        return jsonify({"error": str(e)}), 400
+    except IntegrityError:
+        # Another upload with the same keys committed between our duplicate check and our insert
+        return jsonify({"error": "A concurrent upload carried the same sequence numbers. Retry to have them deduplicated."}), 409
+    except SQLAlchemyError as e:
+        return jsonify({"error": "Failed to store readings", "details": str(e)}), 500
+    except (TimeoutError, RuntimeError) as e:
+        # Group commit did not acknowledge the batch (overloaded or shutting down)
+        return jsonify({"error": "Readings were not stored", "details": str(e)}), 503
+
+    status = 200 if result.inserted or not result.rejected else 400
+    return jsonify(result.to_dict()), status
+
+@ingest_bp.route('/api/ingest/stats')
+@api_key_required
+def ingest_stats():
+    """Depth, flush latency and rows per flush of the group-commit buffer, plus dedup and validation counters."""
+    return jsonify(dict(ingest_buffer.stats(), recent_keys=recent_ingest_keys.stats(),
+                        validation=reading_validator.stats()))
+
+@ingest_bp.route('/api/ingest/quarantine')
+@api_key_required
+def ingest_quarantine():
+    """Most recently quarantined values, optionally for one metric (?metric=..., ?limit=100)."""
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    query = SensorDataQuarantine.query
+    metric = request.args.get('metric')
+    if metric:
+        if metric not in SENSOR_METRIC_COLUMNS:
+            return jsonify({"error": f"Unknown metric: {metric}"}), 400
+        query = query.filter(SensorDataQuarantine.metric == metric)
+    entries = query.order_by(SensorDataQuarantine.id.desc()).limit(limit).all()
+    return jsonify([entry.to_dict() for entry in entries])
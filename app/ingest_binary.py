@@ -0,0 +1,111 @@
+"""
+Compact binary frames of sensor readings for bandwidth-constrained gateways.
+
+A frame (Content-Type: application/x-irrigo-readings) is a 12-byte header
+followed by fixed-size little-endian records:
+
+    header  magic b'IRGO' | version u8 | flags u8 (0) | metric count u16 | record count u32
+    record  timestamp f8 (Unix seconds, UTC) | null bitmap u4 | one f4 per metric
+
+Bit i of the null bitmap set means metric i of the version's column order
+is missing; its float slot is ignored. The column order of a version is
+frozen: adding a SensorData column needs a new version, never an edit of an
+existing one. Whole frames are decoded with NumPy, without a per-field loop.
+"""
+import struct
+
+import numpy as np
+
+from app.ingest import IngestError, IngestResult
+from app.models import SENSOR_METRIC_COLUMNS
+
+CONTENT_TYPE = 'application/x-irrigo-readings'
+MAGIC = b'IRGO'
+HEADER = struct.Struct('<4sBBHI')
+
+# Version 1 column order (the SensorData metric columns as of this format's introduction)
+METRICS_V1 = (
+    'air_temperature', 'humidity', 'uv_intensity', 'rainfall', 'atmospheric_pressure',
+    'soil_moisture_level', 'soil_temperature', 'soil_ph', 'soil_ec', 'soil_n', 'soil_p', 'soil_k',
+    'sap_moisture', 'tank_water_volume', 'dirty_water_volume', 'water_pressure', 'treatment_rate',
+    'water_temperature', 'water_ph', 'water_ec', 'water_tds', 'water_flow_rate', 'water_ntu',
+    'water_nh3', 'water_no3', 'light_par', 'co2_concentration',
+)
+
+# version -> metric column order
+FRAME_VERSIONS = {1: METRICS_V1}
+CURRENT_VERSION = 1
+
+# Latest timestamp a DATETIME column can hold (9999-12-31T23:59:59)
+_MAX_TIMESTAMP = 253402300799.0
+
+for _metrics in FRAME_VERSIONS.values():
+    assert len(_metrics) <= 32, 'the null bitmap is 32 bits wide'
+    assert set(_metrics) <= set(SENSOR_METRIC_COLUMNS), 'frame columns must exist on SensorData'
+
+
+def record_dtype(metrics):
+    """NumPy dtype of one record for the given metric column order."""
+    return np.dtype([('timestamp', '<f8'), ('nulls', '<u4'), ('values', '<f4', (len(metrics),))])
+
+
+def encode_frame(readings, version=CURRENT_VERSION):
+    """
+    Build a frame from reading dicts ('timestamp' as Unix seconds plus metric values).
+    Used by gateways written in Python and by the benchmark.
+    """
+    metrics = FRAME_VERSIONS[version]
+    records = np.zeros(len(readings), dtype=record_dtype(metrics))
+    values = np.array([[reading.get(metric) for metric in metrics] for reading in readings],
+                      dtype=np.float64).reshape(len(readings), len(metrics))  # None -> nan
+    nulls = np.isnan(values)
+    records['timestamp'] = [reading['timestamp'] for reading in readings]
+    records['nulls'] = (nulls.astype(np.uint32) << np.arange(len(metrics), dtype=np.uint32)).sum(axis=1)
+    records['values'] = np.where(nulls, 0.0, values)
+    return HEADER.pack(MAGIC, version, 0, len(metrics), len(readings)) + records.tobytes()
+
+
+def decode_frame(body):
+    """
+    Decode a frame into (validated sensordata row dicts, IngestResult).
+    Records with a non-finite or out-of-range timestamp or a non-finite value are rejected
+    by index; a malformed frame raises IngestError.
+    """
+    if len(body) < HEADER.size:
+        raise IngestError('Frame is shorter than its header')
+    magic, version, flags, metric_count, count = HEADER.unpack_from(body)
+    if magic != MAGIC:
+        raise IngestError('Not a readings frame (bad magic)')
+    metrics = FRAME_VERSIONS.get(version)
+    if metrics is None:
+        raise IngestError(f'Unsupported frame version: {version}')
+    if metric_count != len(metrics):
+        raise IngestError(f'Frame version {version} has {len(metrics)} metrics, header says {metric_count}')
+    dtype = record_dtype(metrics)
+    if len(body) != HEADER.size + count * dtype.itemsize:
+        raise IngestError(f'Frame length does not match {count} records of {dtype.itemsize} bytes')
+
+    records = np.frombuffer(body, dtype=dtype, count=count, offset=HEADER.size)
+    timestamps = records['timestamp']
+    nulls = ((records['nulls'][:, None] >> np.arange(len(metrics), dtype=np.uint32)) & 1).astype(bool)
+    values = records['values'].astype(np.float64)
+
+    bad_timestamp = ~np.isfinite(timestamps) | (timestamps < 0) | (timestamps > _MAX_TIMESTAMP)
+    bad_value = (~np.isfinite(values) & ~nulls).any(axis=1)
+    valid = ~(bad_timestamp | bad_value)
+
+    result = IngestResult()
+    result.received = count
+    for index in np.flatnonzero(~valid).tolist():
+        result.reject(index, 'Timestamp out of range' if bad_timestamp[index] else 'Values must be finite numbers')
+
+    # Assemble an object matrix (timestamp column + metrics, None for nulls) and turn it into row dicts
+    table = np.empty((int(valid.sum()), len(metrics) + 1), dtype=object)
+    microseconds = np.round(timestamps[valid] * 1e6).astype(np.int64)
+    table[:, 0] = microseconds.astype('datetime64[us]').tolist()
+    table[:, 1:] = np.where(nulls[valid], None, values[valid])
+    columns = ['timestamp', *metrics]
+    absent = dict.fromkeys(set(SENSOR_METRIC_COLUMNS) - set(metrics))
+    rows = [dict(absent, **dict(zip(columns, row))) if absent else dict(zip(columns, row))
+            for row in table.tolist()]
+    return rows, result
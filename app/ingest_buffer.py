@@ -0,0 +1,209 @@
+"""
+Group-commit buffer for sensor readings.
+
+Small ingest requests (a gateway posting its last few readings) don't each
+pay for a transaction of their own. Their validated rows are queued here and
+a single writer thread commits everything that arrived within a short window
+(INGEST_BUFFER_MAX_DELAY, default 200 ms) or as soon as INGEST_BUFFER_MAX_ROWS
+rows are waiting. Each caller blocks until the transaction holding its rows
+has committed, so a successful response still means the data is durable.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from sqlalchemy.exc import IntegrityError
+
+from app.database import db
+from app.ingest import INGEST_CHUNK_SIZE, settle_pending, write_readings
+from app.sensor_cache import latest_reading_cache
+
+logger = logging.getLogger(__name__)
+
+
+class _Ticket:
+    """Rows of one caller and the outcome of the flush that wrote them."""
+
+    def __init__(self, rows, key_rows, quarantine_rows, settled):
+        self.rows = rows
+        self.key_rows = key_rows
+        self.quarantine_rows = quarantine_rows
+        self.settled = settled
+        self.submitted_at = time.monotonic()
+        self.done = threading.Event()
+        self.error = None
+
+
+class IngestBuffer:
+    """Coalesces concurrent small batches of readings into one commit."""
+
+    def __init__(self, max_rows=1000, max_delay=0.2, ack_timeout=30.0):
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.ack_timeout = ack_timeout
+        self._app = None
+        self._condition = threading.Condition()
+        self._pending = []
+        self._depth = 0
+        self._closing = False
+        self._thread = None
+        # Counters for stats()
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.rows_flushed = 0
+        self.last_flush_rows = 0
+        self._flush_seconds_total = 0.0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self._ack_seconds_total = 0.0
+        self.max_ack_seconds = 0.0
+        self._acks = 0
+
+    def init_app(self, app):
+        self._app = app
+        self.max_rows = int(app.config.get('INGEST_BUFFER_MAX_ROWS', self.max_rows))
+        self.max_delay = float(app.config.get('INGEST_BUFFER_MAX_DELAY', self.max_delay))
+        atexit.register(self.close)
+
+    def submit(self, rows, key_rows=(), quarantine_rows=(), settled=()):
+        """
+        Queue validated sensordata rows (with their ingest_keys and quarantine rows
+        and the withheld values they settled) and block until they are committed.
+        """
+        ticket = _Ticket(rows, key_rows, quarantine_rows, settled)
+        with self._condition:
+            if self._closing:
+                raise RuntimeError('Ingest buffer is shut down')
+            self._ensure_started()
+            self._pending.append(ticket)
+            self._depth += len(rows)
+            self._condition.notify()
+        if not ticket.done.wait(self.ack_timeout):
+            raise TimeoutError(f'Readings were not committed within {self.ack_timeout:g}s')
+        if ticket.error is not None:
+            raise ticket.error
+        return len(rows)
+
+    def close(self, timeout=10.0):
+        """Flush whatever is queued and stop the writer thread."""
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def stats(self):
+        with self._condition:
+            return {
+                'depth_rows': self._depth,
+                'depth_batches': len(self._pending),
+                'flushes': self.flushes,
+                'failed_flushes': self.failed_flushes,
+                'rows_flushed': self.rows_flushed,
+                'last_flush_rows': self.last_flush_rows,
+                'avg_rows_per_flush': self.rows_flushed / self.flushes if self.flushes else 0,
+                'last_flush_ms': self.last_flush_seconds * 1000,
+                'avg_flush_ms': self._flush_seconds_total / self.flushes * 1000 if self.flushes else 0,
+                'max_flush_ms': self.max_flush_seconds * 1000,
+                'avg_ack_ms': self._ack_seconds_total / self._acks * 1000 if self._acks else 0,
+                'max_ack_ms': self.max_ack_seconds * 1000,
+                'max_rows': self.max_rows,
+                'max_delay_ms': self.max_delay * 1000,
+            }
+
+    # --- Writer thread ---
+
+    def _ensure_started(self):
+        # Called with the condition held
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='ingest-buffer', daemon=True)
+            self._thread.start()
+
+    def _take_batch(self):
+        """Wait until a flush is due and take the pending tickets (None once closed and drained)."""
+        with self._condition:
+            while not self._pending:
+                if self._closing:
+                    return None
+                self._condition.wait()
+            # The oldest queued rows set the deadline; a full buffer or shutdown flushes early
+            deadline = self._pending[0].submitted_at + self.max_delay
+            while self._depth < self.max_rows and not self._closing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch, self._pending, self._depth = self._pending, [], 0
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            self._flush(batch)
+
+    def _commit(self, tickets):
+        """Write the tickets' rows in one transaction; returns the error or None."""
+        rows = [row for ticket in tickets for row in ticket.rows]
+        key_rows = [key_row for ticket in tickets for key_row in ticket.key_rows]
+        quarantine_rows = [quarantine_row for ticket in tickets for quarantine_row in ticket.quarantine_rows]
+        settled = [value for ticket in tickets for value in ticket.settled]
+        with self._app.app_context():
+            try:
+                connection = db.session.connection()
+                for offset in range(0, max(len(rows), len(key_rows), len(quarantine_rows)), INGEST_CHUNK_SIZE):
+                    write_readings(connection, rows[offset:offset + INGEST_CHUNK_SIZE],
+                                   key_rows[offset:offset + INGEST_CHUNK_SIZE],
+                                   quarantine_rows[offset:offset + INGEST_CHUNK_SIZE])
+                if settled:
+                    # After all rows, so values withheld earlier in the same batch are already stored
+                    settle_pending(connection, settled)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                return e
+        return None
+
+    def _flush(self, batch):
+        rows = [row for ticket in batch for row in ticket.rows]
+        started = time.monotonic()
+        error = self._commit(batch)
+        if isinstance(error, IntegrityError) and len(batch) > 1:
+            # A replayed key (two uploads racing past the duplicate check) must only fail its own caller
+            for ticket in batch:
+                ticket.error = self._commit([ticket])
+            error = None
+            rows = [row for ticket in batch if ticket.error is None for row in ticket.rows]
+        else:
+            for ticket in batch:
+                ticket.error = error
+        if error is not None:
+            logger.error('Ingest buffer flush of %d rows failed: %s', len(rows), error)
+        elif rows:
+            latest_reading_cache.invalidate()
+
+        finished = time.monotonic()
+        with self._condition:
+            elapsed = finished - started
+            self.flushes += 1
+            self.last_flush_rows = len(rows)
+            self.last_flush_seconds = elapsed
+            self._flush_seconds_total += elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+            if error is None:
+                self.rows_flushed += len(rows)
+            else:
+                self.failed_flushes += 1
+            for ticket in batch:
+                waited = finished - ticket.submitted_at
+                self._acks += 1
+                self._ack_seconds_total += waited
+                self.max_ack_seconds = max(self.max_ack_seconds, waited)
+        for ticket in batch:
+            ticket.done.set()
+
+
+ingest_buffer = IngestBuffer()
@@ -0,0 +1,123 @@
+"""
+Replay-safe deduplication of ingested readings.
+
+Gateways identify themselves with a source id and number either whole
+uploads (batch sequence number) or individual readings ('seq'). Each key is
+stored in ingest_keys in the same transaction as the readings it covers, so
+the unique index on (source_id, scope, seq) makes a replay impossible to
+commit twice. Keys committed by this process are remembered in a bounded
+in-memory cache, which answers most retries without touching the database;
+the remaining keys of a chunk are checked with a single range query.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from app.database import db
+from app.ingest import KEY_INSERT_COLUMNS
+from app.models import IngestKey
+
+MAX_SOURCE_ID_LENGTH = 64
+
+
+class RecentKeys:
+    """Bounded LRU set of committed (source_id, scope, seq) keys."""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._keys = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._keys:
+                self._keys.move_to_end(key)
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def add_all(self, keys):
+        with self._lock:
+            for key in keys:
+                self._keys[key] = None
+                self._keys.move_to_end(key)
+            while len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._keys), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+recent_ingest_keys = RecentKeys()
+
+
+def _stored_seqs(source_id, scope, seqs):
+    """Which of `seqs` are already in ingest_keys (one range query)."""
+    rows = db.session.query(IngestKey.seq).filter(
+        IngestKey.source_id == source_id,
+        IngestKey.scope == scope,
+        IngestKey.seq.between(min(seqs), max(seqs)),
+    ).all()
+    return {row[0] for row in rows} & set(seqs)
+
+
+class IngestKeyFilter:
+    """
+    Drops already-ingested readings of one request, chunk by chunk.
+    `filter()` returns the rows still to be written and the ingest_keys rows to
+    write with them; `committed()` records those keys once their transaction committed.
+    """
+
+    def __init__(self, source_id, batch_seq=None, cache=recent_ingest_keys):
+        self.source_id = source_id
+        self.batch_seq = batch_seq
+        self.cache = cache
+        self._batch_checked = False
+        self._duplicate_batch = False
+        self._claimed = set()  # Reading seqs already kept by this request
+
+    def filter(self, rows, result):
+        received_at = datetime.now(timezone.utc).replace(tzinfo=None)
+        key_rows = []
+
+        if self.batch_seq is not None and not self._batch_checked:
+            self._batch_checked = True
+            key = (self.source_id, IngestKey.SCOPE_BATCH, self.batch_seq)
+            self._duplicate_batch = key in self.cache or bool(
+                _stored_seqs(self.source_id, IngestKey.SCOPE_BATCH, [self.batch_seq]))
+            if not self._duplicate_batch:
+                key_rows.append(dict(zip(KEY_INSERT_COLUMNS, key + (received_at,))))
+        if self._duplicate_batch:
+            result.duplicates += len(rows)
+            return [], []
+
+        # Per-reading sequence numbers: the cache first, then one query for the rest
+        scope = IngestKey.SCOPE_READING
+        seqs = {row['seq'] for row in rows if row.get('seq') is not None} - self._claimed
+        if not seqs and not self._claimed:
+            return rows, key_rows
+        duplicates = {seq for seq in seqs if (self.source_id, scope, seq) in self.cache}
+        if seqs - duplicates:
+            duplicates |= _stored_seqs(self.source_id, scope, seqs - duplicates)
+
+        kept = []
+        for row in rows:
+            seq = row.get('seq')
+            if seq is not None:
+                # Stored before, or repeated within this request (the first occurrence wins)
+                if seq in duplicates or seq in self._claimed:
+                    result.duplicates += 1
+                    continue
+                self._claimed.add(seq)
+            kept.append(row)
+        rows = kept
+        key_rows += [{'source_id': self.source_id, 'scope': scope, 'seq': row['seq'], 'received_at': received_at}
+                     for row in rows if row.get('seq') is not None]
+        return rows, key_rows
+
+    def committed(self, key_rows):
+        self.cache.add_all((row['source_id'], row['scope'], row['seq']) for row in key_rows)
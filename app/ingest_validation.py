@@ -0,0 +1,267 @@
+"""
+Plausibility checks for ingested sensor values.
+
+Every metric has a validation rule: physical bounds, an optional maximum
+rate of change and whether it may be missing. Rules are applied to whole
+ingest chunks as NumPy array operations. Values that break a rule are
+nulled in the stored reading and written to sensordata_quarantine with the
+reason, so glitches never reach charts or alarm rules but can still be
+reviewed. Readings missing a required metric are rejected as a whole.
+
+The rate check flags isolated spikes: a value whose change from the previous
+value *and* change to the next one both exceed the limit. A genuine step
+change therefore passes. The newest value of a source has no next one yet:
+if the jump into it is too steep, it is withheld (stored as NULL, quarantined
+as 'pending') until the source's next sample decides it, then either stays
+quarantined as 'rate' or is written back to its reading (with its rollups and
+alarms). One upload of a series and the same series sent one reading per
+request therefore end up with the same values. A value still pending when
+the process stops stays quarantined as 'pending'.
+Jumps between samples less than a minute apart are measured against the
+full per-minute limit, so noise at high sample rates is not mistaken for spikes.
+The previous values are kept per ingest source (X-Source-Id), so gateways
+are never compared with each other, and are seeded from the source's latest
+stored reading the first time a source is seen.
+"""
+import json
+import threading
+from collections import namedtuple
+from datetime import datetime, timezone
+from operator import itemgetter
+
+import numpy as np
+
+from app.database import db
+from app.models import SensorData, SENSOR_METRIC_COLUMNS
+
+# max_change_per_minute: None disables the rate check for the metric
+MetricRule = namedtuple('MetricRule', 'min_value max_value max_change_per_minute allow_null')
+
+# Physically possible ranges (wider than the demo data bounds in add_demo_sensor_data.py)
+DEFAULT_PROFILE = {
+    'air_temperature': MetricRule(-50, 70, 10, True),
+    'humidity': MetricRule(0, 100, 30, True),
+    'uv_intensity': MetricRule(0, 20, None, True),
+    'rainfall': MetricRule(0, 500, None, True),
+    'atmospheric_pressure': MetricRule(800, 1100, 5, True),
+    'soil_moisture_level': MetricRule(0, 100, 30, True),
+    'soil_temperature': MetricRule(-30, 70, 5, True),
+    'soil_ph': MetricRule(0, 14, 1, True),
+    'soil_ec': MetricRule(0, 20000, None, True),
+    'soil_n': MetricRule(0, 5000, None, True),
+    'soil_p': MetricRule(0, 5000, None, True),
+    'soil_k': MetricRule(0, 5000, None, True),
+    'sap_moisture': MetricRule(0, 100, None, True),
+    'tank_water_volume': MetricRule(0, 100000, None, True),
+    'dirty_water_volume': MetricRule(0, 100000, None, True),
+    'water_pressure': MetricRule(0, 150, None, True),
+    'treatment_rate': MetricRule(0, 10000, None, True),
+    'water_temperature': MetricRule(-5, 90, 5, True),
+    'water_ph': MetricRule(0, 14, 2, True),
+    'water_ec': MetricRule(0, 20000, None, True),
+    'water_tds': MetricRule(0, 20000, None, True),
+    'water_flow_rate': MetricRule(0, 10000, None, True),
+    'water_ntu': MetricRule(0, 4000, None, True),
+    'water_nh3': MetricRule(0, 1000, None, True),
+    'water_no3': MetricRule(0, 1000, None, True),
+    'light_par': MetricRule(0, 3000, None, True),
+    'co2_concentration': MetricRule(0, 10000, None, True),
+}
+
+REASONS = ('below_min', 'above_max', 'rate', 'missing')
+_RATE = REASONS.index('rate')
+# Quarantine reason of a withheld value awaiting the source's next sample
+PENDING = 'pending'
+
+_metric_values = itemgetter(*SENSOR_METRIC_COLUMNS)
+
+
+def load_profile(path):
+    """
+    DEFAULT_PROFILE with overrides from a JSON file of the form
+    {"<metric>": {"min": .., "max": .., "max_change_per_minute": .., "allow_null": ..}}.
+    """
+    profile = dict(DEFAULT_PROFILE)
+    with open(path) as f:
+        overrides = json.load(f)
+    for metric, fields in overrides.items():
+        if metric not in profile:
+            raise ValueError(f'Unknown metric in validation profile: {metric}')
+        rule = profile[metric]
+        profile[metric] = rule._replace(
+            min_value=fields.get('min', rule.min_value),
+            max_value=fields.get('max', rule.max_value),
+            max_change_per_minute=fields.get('max_change_per_minute', rule.max_change_per_minute),
+            allow_null=fields.get('allow_null', rule.allow_null),
+        )
+    return profile
+
+
+def latest_stored_reading(source_id):
+    """Latest sensordata row (mapping) sent by a source (None: readings without X-Source-Id), or None."""
+    table = SensorData.__table__
+    return db.session.execute(
+        db.select(table).where(table.c.source_id == source_id).order_by(table.c.timestamp.desc()).limit(1)
+    ).mappings().first()
+
+
+def _to_datetime(epoch):
+    """Naive UTC datetime of epoch seconds computed from row timestamps."""
+    return np.datetime64(round(epoch * 1e6), 'us').astype(datetime)
+
+
+class ReadingValidator:
+    """Applies a validation profile to chunks of row dicts and counts what it rejected."""
+
+    def __init__(self, profile=None):
+        self._lock = threading.Lock()
+        self.set_profile(profile or DEFAULT_PROFILE)
+
+    def init_app(self, app):
+        path = app.config.get('INGEST_VALIDATION_PROFILE')
+        if path:
+            self.set_profile(load_profile(path))
+
+    def set_profile(self, profile):
+        """Compile a {metric: MetricRule} profile into per-column arrays."""
+        rules = [profile.get(metric, MetricRule(None, None, None, True)) for metric in SENSOR_METRIC_COLUMNS]
+        with self._lock:
+            self.profile = profile
+            self._low = np.array([-np.inf if r.min_value is None else r.min_value for r in rules], dtype=np.float64)
+            self._high = np.array([np.inf if r.max_value is None else r.max_value for r in rules], dtype=np.float64)
+            self._required = np.array([not r.allow_null for r in rules])
+            # Rate limits in units per second, only for the columns that have one
+            self._rate_columns = [(index, rule.max_change_per_minute / 60.0)
+                                  for index, rule in enumerate(rules) if rule.max_change_per_minute is not None]
+            # Per source: (epoch seconds, value, withheld) of the newest value per column, for rate
+            # checks across chunks
+            self._sources = {}
+            self._counters = np.zeros((len(REASONS), len(rules)), dtype=np.int64)
+            self.readings_rejected = 0
+
+    def _seed(self, source_id):
+        """(last time, last value, withheld) arrays for a source, taken from its latest stored reading."""
+        last_time = np.full(len(SENSOR_METRIC_COLUMNS), -np.inf)
+        last_value = np.full(len(SENSOR_METRIC_COLUMNS), np.nan)
+        withheld = np.zeros(len(SENSOR_METRIC_COLUMNS), dtype=bool)
+        if self._rate_columns:
+            latest = latest_stored_reading(source_id)
+            if latest is not None:
+                values = np.array(_metric_values(latest), dtype=np.float64)
+                stored = ~np.isnan(values)
+                timestamp = np.datetime64(latest['timestamp'].replace(tzinfo=None), 'us')
+                last_time[stored] = timestamp.astype(np.int64) / 1e6
+                last_value[stored] = values[stored]
+        return last_time, last_value, withheld
+
+    def validate(self, rows, source_id=None):
+        """
+        Check a chunk of validated sensordata row dicts sent by `source_id`.
+        Returns (rows to store, quarantine row dicts, [(rejected row, missing required metrics)],
+        settled values); offending and withheld values are set to None in the returned rows.
+        Settled values are the source's earlier withheld values this chunk decided: dicts of
+        timestamp, source_id, metric, value and spike (True: stays quarantined, False: stored after all).
+        """
+        if not rows:
+            return rows, [], [], []
+        history = self._sources.get(source_id)
+        if history is None:
+            # Queried outside the lock; the first chunk of a source to take the lock stores its seed
+            history = self._seed(source_id)
+        values = np.array([_metric_values(row) for row in rows], dtype=np.float64)  # None -> nan
+        times = np.array([row['timestamp'] for row in rows], dtype='datetime64[us]').astype(np.int64) / 1e6
+
+        nulls = np.isnan(values)
+        missing = nulls & self._required
+        rejected_rows = missing.any(axis=1)
+        below = values < self._low
+        above = values > self._high
+        spikes = np.zeros_like(nulls)
+        withholding = np.zeros_like(nulls)
+        settled = []
+
+        with self._lock:
+            last_time, last_value, withheld = self._sources.setdefault(source_id, history)
+            order = np.argsort(times, kind='stable')
+            usable = ~(nulls | below | above | rejected_rows[:, None])
+            for column, max_rate in self._rate_columns:
+                indices = order[usable[order, column]]
+                if not len(indices):
+                    continue
+                column_values = values[indices, column]
+                column_times = times[indices]
+                # Jump into each value: from the previous one (history only if it is older)
+                follows_history = last_time[column] < column_times[0]
+                previous_values = np.concatenate(([last_value[column]], column_values[:-1]))
+                previous_times = np.concatenate(([last_time[column]], column_times[:-1]))
+                if not follows_history:
+                    previous_values[0] = np.nan
+                # Samples less than a minute apart may still use the whole per-minute allowance
+                elapsed = np.maximum(column_times - previous_times, 60.0)
+                rate_in = np.abs(column_values - previous_values) / elapsed
+                steep = np.nan_to_num(rate_in, nan=0.0) > max_rate  # No history: nothing to compare with
+
+                if follows_history and withheld[column]:
+                    # The first value is the next sample the withheld one waited for
+                    settled.append({'timestamp': _to_datetime(last_time[column]), 'source_id': source_id,
+                                    'metric': SENSOR_METRIC_COLUMNS[column], 'value': float(last_value[column]),
+                                    'spike': bool(steep[0])})
+                    withheld[column] = False
+                    if steep[0]:
+                        self._counters[_RATE, column] += 1
+                # A spike jumps steeply both into the value and out of it
+                spikes[indices[:-1][steep[:-1] & steep[1:]], column] = True
+                if column_times[-1] >= last_time[column]:
+                    # The newest value: the jump out of it is not known yet, so a steep one into it is withheld
+                    last_time[column] = column_times[-1]
+                    last_value[column] = column_values[-1]
+                    withheld[column] = steep[-1]
+                    withholding[indices[-1], column] = steep[-1]
+
+            by_reason = (below, above, spikes, missing)
+            for reason_index, mask in enumerate(by_reason):
+                self._counters[reason_index] += np.count_nonzero(mask, axis=0)
+            self.readings_rejected += int(np.count_nonzero(rejected_rows))
+
+        received_at = datetime.now(timezone.utc).replace(tzinfo=None)
+        quarantine = []
+        for reason, mask in zip(REASONS + (PENDING,), by_reason + (withholding,)):
+            for row_index, column in np.argwhere(mask).tolist():
+                value = values[row_index, column]
+                quarantine.append({
+                    'timestamp': rows[row_index]['timestamp'],
+                    'source_id': source_id,
+                    'metric': SENSOR_METRIC_COLUMNS[column],
+                    'value': None if np.isnan(value) else float(value),
+                    'reason': reason,
+                    'received_at': received_at,
+                })
+                if reason != 'missing':
+                    rows[row_index][SENSOR_METRIC_COLUMNS[column]] = None
+
+        if rejected_rows.any():
+            kept = [row for row, rejected in zip(rows, rejected_rows.tolist()) if not rejected]
+            rejected = [(rows[row_index], [SENSOR_METRIC_COLUMNS[column] for column in np.flatnonzero(missing[row_index])])
+                        for row_index in np.flatnonzero(rejected_rows).tolist()]
+            return kept, quarantine, rejected, settled
+        return rows, quarantine, [], settled
+
+    def stats(self):
+        """Rejection counters per metric and reason (only non-zero entries)."""
+        with self._lock:
+            counters = self._counters.copy()
+            readings_rejected = self.readings_rejected
+            pending = sum(int(np.count_nonzero(withheld)) for _, _, withheld in self._sources.values())
+        per_metric = {}
+        for reason_index, column in np.argwhere(counters).tolist():
+            per_metric.setdefault(SENSOR_METRIC_COLUMNS[column], {})[REASONS[reason_index]] = int(
+                counters[reason_index, column])
+        return {
+            'values_quarantined': int(counters[:3].sum()),
+            'readings_rejected': readings_rejected,
+            'values_pending': pending,
+            'by_metric': per_metric,
+        }
+
+
+reading_validator = ReadingValidator()
@@ -0,0 +1,310 @@
+"""
+Safety interlocks checked before a device command is accepted (TASK-056).
+
+Interlocks are InterlockRule rows: devices whose type contains the rule's
+keywords may not take its action while the rule's sensor reading meets its
+condition. Active rules are compiled into an index keyed by (device type,
+action); each key is resolved once, on first use, to the few rules that
+apply to it. A check therefore only looks up its key and compares the
+snapshot values of those rules, however many rules exist.
+
+The index is rebuilt only when rules change. Every transaction that adds,
+edits or deletes an InterlockRule through the ORM also bumps the single row
+of interlock_rule_set_version; the process that committed it rebuilds on its
+next check, and every other worker process notices the new version within
+INTERLOCK_RULES_CHECK_INTERVAL seconds (one primary key lookup per interval).
+
+Interlocks are evaluated against a reading snapshot (a SensorData.to_dict()
+dict). Commands load a fresh one (latest_sensor_data()); the interlock status
+shown for every device by /api/devices comes from interlock_status_cache,
+which evaluates all devices against the shared latest-reading snapshot and
+keeps the result until a new reading arrives or the devices or rules change.
+"""
+import operator
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.database import db
+from app.models import AlarmCondition, InterlockRule, InterlockRuleSetVersion, SensorData
+from app.sensor_cache import latest_reading_cache
+
+# Default of check_safety_interlocks(latest_data=...): load the latest reading
+_LOAD = object()
+
+_COMPARE = {
+    AlarmCondition.GREATER_THAN: operator.gt,
+    AlarmCondition.LESS_THAN: operator.lt,
+    AlarmCondition.EQUALS: operator.eq,
+}
+
+# The interlocks that used to be hardcoded here, stored by create_default_interlock_rules()
+DEFAULT_INTERLOCK_RULES = [
+    # Assume 10% is minimum safe level (you can adjust based on your requirements)
+    {'name': 'Water pump: tank almost empty', 'device_type_match': 'WATER PUMP', 'action': 'ON',
+     'sensor_metric': 'tank_water_volume', 'condition': AlarmCondition.LESS_THAN, 'threshold_value': 10,
+     'reason': 'Insufficient water level in tank'},
+    # Don't allow opening drainage valve if water quality is poor (pH too low or too high)
+    {'name': 'Drain valve: pH too low', 'device_type_match': 'DRAIN VALVE', 'action': 'OPEN',
+     'sensor_metric': 'water_ph', 'condition': AlarmCondition.LESS_THAN, 'threshold_value': 5,
+     'reason': 'Water pH level unsafe: {value}'},
+    {'name': 'Drain valve: pH too high', 'device_type_match': 'DRAIN VALVE', 'action': 'OPEN',
+     'sensor_metric': 'water_ph', 'condition': AlarmCondition.GREATER_THAN, 'threshold_value': 9,
+     'reason': 'Water pH level unsafe: {value}'},
+]
+
+
+def latest_sensor_data():
+    """The newest reading as a SensorData.to_dict() snapshot, read from the table (None without data)."""
+    latest = SensorData.query.order_by(SensorData.timestamp.desc()).first()
+    return latest.to_dict() if latest else None
+
+
+class CompiledInterlock:
+    """The fields of an active InterlockRule needed to check it, detached from the session."""
+    __slots__ = ('id', 'name', 'keywords', 'action', 'sensor_metric', 'compare', 'threshold_value', 'reason')
+
+    def __init__(self, row):
+        self.id = row['id']
+        self.name = row['name']
+        self.keywords = tuple(row['device_type_match'].upper().split())
+        self.action = row['action'].upper()
+        self.sensor_metric = row['sensor_metric']
+        self.compare = _COMPARE[row['condition']]
+        self.threshold_value = row['threshold_value']
+        self.reason = row['reason']
+
+    def applies_to(self, device_type):
+        """Whether the rule selects devices of `device_type` (upper case)."""
+        return all(keyword in device_type for keyword in self.keywords)
+
+
+class InterlockIndex:
+    """Active interlock rules by action, resolved per (device type, action) on first use."""
+
+    def __init__(self, rules, version):
+        self.version = version
+        self.rule_count = len(rules)
+        self._by_action = {}
+        for rule in rules:
+            self._by_action.setdefault(rule.action, []).append(rule)
+        self._resolved = {}  # (DEVICE TYPE, ACTION) -> rules applying to it, in id order
+
+    def rules_for(self, device_type, action):
+        key = ((device_type or '').upper(), action.upper())
+        rules = self._resolved.get(key)
+        if rules is None:
+            rules = tuple(rule for rule in self._by_action.get(key[1], ()) if rule.applies_to(key[0]))
+            self._resolved[key] = rules
+        return rules
+
+
+class InterlockEngine:
+    """Compiled index of the active interlock rules, kept in step with the interlock_rules table."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None  # InterlockIndex, built on first use
+        self._checked_at = 0.0  # monotonic time of the last version check
+        self.version_check_interval = 1.0
+        self.index_builds = 0
+        self.version_checks = 0
+        self.stale_index_rebuilds = 0
+        self.checks = 0
+        self.blocked = 0
+
+    def init_app(self, app):
+        self.version_check_interval = float(app.config.get('INTERLOCK_RULES_CHECK_INTERVAL',
+                                                           self.version_check_interval))
+
+    def invalidate(self):
+        """Rebuild the index on next use (after rules changed)."""
+        with self._lock:
+            self._index = None
+
+    @staticmethod
+    def rules_version(connection):
+        """Current interlock_rule_set_version (0 before any rule change was recorded)."""
+        table = InterlockRuleSetVersion.__table__
+        return connection.execute(db.select(table.c.version).where(table.c.id == 1)).scalar() or 0
+
+    @staticmethod
+    def bump_rules_version(connection):
+        """Record a rule change in the caller's transaction, for every worker process to see."""
+        table = InterlockRuleSetVersion.__table__
+        result = connection.execute(table.update().where(table.c.id == 1).values(version=table.c.version + 1))
+        if not result.rowcount:
+            connection.execute(table.insert().values(id=1, version=1))
+
+    def current_index(self):
+        """The rule index, rebuilt if rules changed in this process or, checked at most every
+        version_check_interval seconds, in another one."""
+        index = self._index
+        if index is not None and time.monotonic() - self._checked_at >= self.version_check_interval:
+            self._checked_at = time.monotonic()
+            with self._lock:
+                self.version_checks += 1
+            if self.rules_version(db.session.connection()) != index.version:
+                with self._lock:
+                    self.stale_index_rebuilds += 1
+                index = None
+        if index is None:
+            index = self.load()
+        return index
+
+    def load(self):
+        """Build the index from the active rules."""
+        connection = db.session.connection()
+        # Read before the rules: a change committed in between only causes one more rebuild
+        version = self.rules_version(connection)
+        table = InterlockRule.__table__
+        rows = connection.execute(db.select(table).where(table.c.is_active.is_(True))
+                                  .order_by(table.c.id)).mappings()
+        index = InterlockIndex([CompiledInterlock(row) for row in rows], version)
+        with self._lock:
+            self._index = index
+            self._checked_at = time.monotonic()
+            self.index_builds += 1
+        return index
+
+    def record_check(self, blocked):
+        with self._lock:
+            self.checks += 1
+            if blocked:
+                self.blocked += 1
+
+    def stats(self):
+        index = self._index
+        with self._lock:
+            return {
+                'rules': index.rule_count if index else None,
+                'rules_version': index.version if index else None,
+                'resolved_keys': len(index._resolved) if index else None,
+                'checks': self.checks,
+                'blocked': self.blocked,
+                'index_builds': self.index_builds,
+                'version_checks': self.version_checks,
+                'stale_index_rebuilds': self.stale_index_rebuilds,
+            }
+
+
+interlock_engine = InterlockEngine()
+
+
+def create_default_interlock_rules():
+    """
+    Store DEFAULT_INTERLOCK_RULES if no interlock rule change was ever recorded
+    (a fresh database, or one from before interlocks were stored as rules).
+    Returns the number of rules added.
+    """
+    if interlock_engine.rules_version(db.session.connection()) or InterlockRule.query.first():
+        return 0
+    db.session.add_all(InterlockRule(**rule) for rule in DEFAULT_INTERLOCK_RULES)
+    db.session.commit()
+    return len(DEFAULT_INTERLOCK_RULES)
+
+
+def check_safety_interlocks(device, action, latest_data=_LOAD, index=None):
+    """
+    Check safety conditions before allowing device control of `device` (a Device.to_dict() row).
+    Returns dict with 'blocked' boolean and 'reason' if blocked.
+    Pass `latest_data` (from latest_sensor_data()) to check several commands against one snapshot;
+    otherwise the latest reading is loaded for this check. `index` defaults to the current rule index.
+    """
+    if latest_data is _LOAD:
+        latest_data = latest_sensor_data()
+    
+    # Default response (safe)
+    result = {
+        'blocked': False,
+        'reason': None,
+        'conditions': {}
+    }
+    
+    # If no sensor data, allow control but note the warning
+    if not latest_data:
+        result['conditions']['warning'] = 'No sensor data available for safety checks'
+        return result
+    
+    # Only the rules for this device type and action; the first one whose condition holds blocks
+    rules = (index or interlock_engine.current_index()).rules_for(device['device_type'], action)
+    for rule in rules:
+        value = latest_data.get(rule.sensor_metric)
+        if value is not None and rule.compare(value, rule.threshold_value):
+            interlock_engine.record_check(blocked=True)
+            result['blocked'] = True
+            result['reason'] = rule.reason.replace('{value}', str(value))
+            result['conditions'][rule.sensor_metric] = value
+            result['rule_id'] = rule.id
+            return result
+    
+    interlock_engine.record_check(blocked=False)
+    return result
+
+
+def status_action(device):
+    """Action whose interlock /api/devices reports for a device (TASK-057): OPEN for valves, else ON."""
+    if device['device_type'] and 'VALVE' in device['device_type'].upper():
+        return 'OPEN'
+    return 'ON'
+
+
+class InterlockStatusCache:
+    """Interlock status of every device for its status_action(), kept until the reading, rules or devices change."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key = None
+        self._statuses = {}
+        self.hits = 0
+        self.evaluations = 0
+
+    def statuses(self, devices):
+        """{device id: check_safety_interlocks() result} for `devices` (Device.to_dict() rows)."""
+        reading = latest_reading_cache.get()
+        index = interlock_engine.current_index()
+        # Interlocks depend on the reading, the rules and each device's type, never on its status
+        key = (reading['id'] if reading else None, index,
+               tuple((device['id'], device['device_type']) for device in devices))
+        with self._lock:
+            if key == self._key:
+                self.hits += 1
+                return self._statuses
+        statuses = {device['id']: check_safety_interlocks(device, status_action(device), reading, index)
+                    for device in devices}
+        with self._lock:
+            self._key = key
+            self._statuses = statuses
+            self.evaluations += 1
+        return statuses
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'evaluations': self.evaluations, 'devices': len(self._statuses)}
+
+
+interlock_status_cache = InterlockStatusCache()
+
+
+# --- Hooks ---
+
+@event.listens_for(Session, 'after_flush')
+def _note_interlock_rule_change(session, flush_context):
+    if any(isinstance(obj, InterlockRule) for obj in (*session.new, *session.dirty, *session.deleted)):
+        if not session.info.get('interlock_rules_changed'):
+            # Once per transaction; committed (or rolled back) together with the rule change
+            interlock_engine.bump_rules_version(session.connection())
+        session.info['interlock_rules_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _rebuild_after_commit(session):
+    if session.info.pop('interlock_rules_changed', False):
+        interlock_engine.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_rule_change(session):
+    session.info.pop('interlock_rules_changed', None)
@@ -0,0 +1,123 @@
+from flask import Blueprint, jsonify, request
+from sqlalchemy.exc import IntegrityError
+from app.auth import login_required
+from app.database import db
+from app.models import AlarmCondition, InterlockRule, SENSOR_METRIC_COLUMNS
+from app.device_commands import INVERSE_ACTIONS
+from app.interlocks import interlock_engine
+
+interlocks_bp = Blueprint('interlocks_bp', __name__)
+
+RULE_FIELDS = ['name', 'device_type_match', 'action', 'sensor_metric', 'condition', 'threshold_value', 'reason']
+
+
+def _apply_rule_fields(rule, data):
+    """Set the fields present in `data` on `rule`; raises ValueError/TypeError for invalid values."""
+    if 'name' in data:
+        if not str(data['name']).strip():
+            raise ValueError('name cannot be empty')
+        rule.name = str(data['name']).strip()
+    if 'device_type_match' in data:
+        keywords = str(data['device_type_match']).upper().split()
+        if not keywords:
+            raise ValueError('device_type_match needs at least one keyword')
+        rule.device_type_match = ' '.join(keywords)
+    if 'action' in data:
+        action = str(data['action']).upper()
+        if action not in INVERSE_ACTIONS:
+            raise ValueError(f'Invalid action {action}. Valid actions are: {", ".join(INVERSE_ACTIONS)}')
+        rule.action = action
+    if 'sensor_metric' in data:
+        if data['sensor_metric'] not in SENSOR_METRIC_COLUMNS:
+            raise ValueError(f"Invalid sensor_metric: {data['sensor_metric']}")
+        rule.sensor_metric = data['sensor_metric']
+    if 'condition' in data:
+        rule.condition = AlarmCondition(data['condition'])
+    if 'threshold_value' in data:
+        rule.threshold_value = float(data['threshold_value'])
+    if 'reason' in data:
+        if not str(data['reason']).strip():
+            raise ValueError('reason cannot be empty')
+        rule.reason = str(data['reason']).strip()
+    if 'is_active' in data:
+        rule.is_active = bool(data['is_active'])
+
+
+# --- Interlock Rule Endpoints ---
+
+@interlocks_bp.route('/api/interlock_rules', methods=['GET'])
+@login_required
+def get_interlock_rules():
+    """List the interlock rules."""
+    return jsonify([rule.to_dict() for rule in InterlockRule.query.order_by(InterlockRule.id)])
+
+
+@interlocks_bp.route('/api/interlock_rules', methods=['POST'])
+@login_required
+def create_interlock_rule():
+    """
+    Create an interlock rule.
+    Body: name, device_type_match (keywords that must all occur in the device type, e.g. "WATER PUMP"),
+    action, sensor_metric, condition ('>', '<' or '='), threshold_value, reason ('{value}' is replaced by
+    the reading) and optionally is_active (default true).
+    """
+    data = request.get_json(silent=True)
+    if not data or not all(field in data for field in RULE_FIELDS):
+        return jsonify({'error': f'Missing required fields: {RULE_FIELDS}'}), 400
+    rule = InterlockRule(is_active=True)
+    try:
+        _apply_rule_fields(rule, data)
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': 'Invalid data type or enum value', 'details': str(e)}), 400
+    try:
+        db.session.add(rule)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': f'An interlock rule named {rule.name} already exists'}), 409
+    return jsonify(rule.to_dict()), 201
+
+
+@interlocks_bp.route('/api/interlock_rules/<int:rule_id>', methods=['GET'])
+@login_required
+def get_interlock_rule(rule_id):
+    """Get an interlock rule."""
+    return jsonify(InterlockRule.query.get_or_404(rule_id).to_dict())
+
+
+@interlocks_bp.route('/api/interlock_rules/<int:rule_id>', methods=['PUT'])
+@login_required
+def update_interlock_rule(rule_id):
+    """Change the fields of an interlock rule present in the body."""
+    rule = InterlockRule.query.get_or_404(rule_id)
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'error': 'Request body cannot be empty'}), 400
+    try:
+        _apply_rule_fields(rule, data)
+    except (ValueError, TypeError) as e:
+        db.session.rollback()
+        return jsonify({'error': 'Invalid data type or enum value', 'details': str(e)}), 400
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': f"An interlock rule named {data.get('name')} already exists"}), 409
+    return jsonify(rule.to_dict())
+
+
+@interlocks_bp.route('/api/interlock_rules/<int:rule_id>', methods=['DELETE'])
+@login_required
+def delete_interlock_rule(rule_id):
+    """Delete an interlock rule."""
+    rule = InterlockRule.query.get_or_404(rule_id)
+    db.session.delete(rule)
+    db.session.commit()
+    return jsonify({'message': f'Interlock rule {rule_id} deleted successfully'})
+
+
+@interlocks_bp.route('/api/interlock_rules/stats', methods=['GET'])
+@login_required
+def interlock_rule_stats():
+    """Size of the compiled interlock index and check counters."""
+    return jsonify(interlock_engine.stats())
@@ -0,0 +1,199 @@
+"""
+Server-Sent Events fan-out for live dashboard updates.
+
+A single background thread per process watches the latest reading (through
+the shared latest-reading cache) and the device statuses (through the device
+state store), computes what
+changed, serializes the change once and offers it to every subscriber's
+queue. Clients therefore never cause database queries of their own, however
+many of them are connected.
+"""
+import json
+import logging
+import queue
+import threading
+
+from app.device_state import device_state
+from app.sensor_cache import latest_reading_cache
+
+logger = logging.getLogger(__name__)
+
+
+def format_sse(event, data, event_id=None):
+    """Encode one SSE message."""
+    message = f'event: {event}\n'
+    if event_id is not None:
+        message += f'id: {event_id}\n'
+    return message + f'data: {data}\n\n'
+
+
+class Subscription:
+    """Bounded per-client queue of (version, json) events."""
+
+    def __init__(self, maxsize):
+        self.queue = queue.Queue(maxsize=maxsize)
+        # Set when the client fell behind; it then gets a fresh snapshot instead of the backlog
+        self.resync = False
+
+    def offer(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.resync = True
+
+
+class LiveUpdateBroadcaster:
+    """Watches for reading/device changes and fans compact diffs out to subscribers."""
+
+    def __init__(self, poll_interval=2.0, heartbeat_interval=15.0, queue_size=32):
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.queue_size = queue_size
+        self._app = None
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._wake = threading.Event()
+        self._ready = threading.Event()
+        self._thread = None
+        # Current state and its serialized form, shared by all subscribers
+        self.version = 0
+        self.reading = None
+        self.devices = {}
+        self._snapshot_json = None
+        self.events_published = 0
+
+    def init_app(self, app):
+        self._app = app
+        self.poll_interval = float(app.config.get('LIVE_UPDATES_POLL_INTERVAL', self.poll_interval))
+        # New readings written by this process are pushed without waiting for the next poll
+        latest_reading_cache.add_listener(self.wake)
+
+    # --- Subscribers ---
+
+    def subscribe(self):
+        self._ensure_started()
+        subscription = Subscription(self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def snapshot(self, timeout=5.0):
+        """(version, json) of the full current state, serialized once per version."""
+        self._ready.wait(timeout)
+        with self._lock:
+            if self._snapshot_json is None:
+                self._snapshot_json = json.dumps({'reading': self.reading, 'devices': self.devices})
+            return self.version, self._snapshot_json
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'version': self.version,
+                'events_published': self.events_published,
+                'poll_interval_seconds': self.poll_interval,
+            }
+
+    # --- Change detection ---
+
+    def wake(self):
+        """Check for changes now instead of at the next poll."""
+        self._wake.set()
+
+    def publish(self, reading, devices):
+        """Diff new state against the current one and fan out the change, if any."""
+        reading_diff = {}
+        if reading:
+            previous = self.reading or {}
+            reading_diff = {key: value for key, value in reading.items() if previous.get(key) != value}
+        elif self.reading:
+            reading_diff = None  # Readings were deleted
+
+        device_diff = {device_id: state for device_id, state in devices.items()
+                       if self.devices.get(device_id) != state}
+        # Removed devices are sent as null
+        device_diff.update({device_id: None for device_id in self.devices if device_id not in devices})
+
+        if reading_diff == {} and not device_diff:
+            return False
+
+        payload = {}
+        if reading_diff is None or reading_diff:
+            payload['reading'] = reading_diff
+        if device_diff:
+            payload['devices'] = device_diff
+
+        with self._lock:
+            self.version += 1
+            self.reading = reading
+            self.devices = devices
+            self._snapshot_json = None
+            self.events_published += 1
+            event = (self.version, json.dumps(payload))
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.offer(event)
+        return True
+
+    def _poll(self):
+        reading = latest_reading_cache.get()
+        devices = {
+            str(device['id']): {
+                'status': device['status'],
+                'last_status_update': device['last_status_update'],
+                'is_enabled': device['is_enabled'],
+            }
+            for device in device_state.all()
+        }
+        self.publish(reading, devices)
+
+    def _run(self):
+        while True:
+            try:
+                with self._app.app_context():
+                    self._poll()
+            except Exception:
+                logger.exception('Live update poll failed')
+            self._ready.set()
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='live-updates', daemon=True)
+                self._thread.start()
+
+    # --- Streaming ---
+
+    def stream(self):
+        """SSE generator for one client: a full snapshot, then diffs and keepalives."""
+        subscription = self.subscribe()
+        try:
+            version, data = self.snapshot()
+            yield format_sse('snapshot', data, version)
+            while True:
+                try:
+                    event_version, data = subscription.queue.get(timeout=self.heartbeat_interval)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if subscription.resync:
+                    # Drop the backlog and start over from the current state
+                    subscription.resync = False
+                    while not subscription.queue.empty():
+                        subscription.queue.get_nowait()
+                    version, data = self.snapshot()
+                    yield format_sse('snapshot', data, version)
+                elif event_version > version:
+                    version = event_version
+                    yield format_sse('diff', data, event_version)
+        finally:
+            self.unsubscribe(subscription)
+
+
+live_updates = LiveUpdateBroadcaster()
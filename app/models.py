@@ -2,8 +2,9 @@ from app.database import db
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 from sqlalchemy.orm import relationship
-from sqlalchemy import ForeignKey, Enum # Added ForeignKey and Enum
+from sqlalchemy import ForeignKey, Enum, event # Added ForeignKey and Enum
 import enum # Added enum import
+from app.timeseries import wall_clock_epoch
 
 class User(db.Model):
     """Model for the users table"""
@@ -28,9 +29,12 @@ class User(db.Model):
 class SensorData(db.Model):
     """Model for the sensordata table"""
     __tablename__ = 'sensordata'
+    # Latest reading of one ingest source (seeds the validator's rate-of-change history)
+    __table_args__ = (db.Index('ix_sensordata_source_id_timestamp', 'source_id', 'timestamp'),)
 
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(db.TIMESTAMP(timezone=True), nullable=False, server_default=db.func.now(), index=True)
+    source_id = db.Column(db.String(64), nullable=True) # Ingest source (X-Source-Id) that sent the reading
 
     # Renamed from 'temperature'
     air_temperature = db.Column(db.Float, comment='Unit: °C. Source: Air')
@@ -108,6 +112,114 @@ class SensorData(db.Model):
         return data
 
 
+# Metric columns of SensorData (everything except the key, the timestamp and the source)
+SENSOR_METRIC_COLUMNS = [c.name for c in SensorData.__table__.columns if c.name not in ('id', 'timestamp', 'source_id')]
+
+
+class SensorDataRollupMixin:
+    """Columns shared by the pre-aggregated SensorData rollup tables.
+
+    One row per bucket, identified by its start as whole seconds since
+    1970-01-01 in stored wall-clock time (see app/timeseries.py), with
+    <metric>_count/_sum/_min/_max columns for every SensorData metric.
+    """
+    bucket_epoch = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} @ {self.bucket_epoch}>'
+
+# Generated per-metric aggregate columns (declarative picks them up from the mixin)
+for _metric in SENSOR_METRIC_COLUMNS:
+    setattr(SensorDataRollupMixin, f'{_metric}_count', db.Column(db.Integer, nullable=False, default=0))
+    setattr(SensorDataRollupMixin, f'{_metric}_sum', db.Column(db.Float, nullable=False, default=0.0))
+    setattr(SensorDataRollupMixin, f'{_metric}_min', db.Column(db.Float))
+    setattr(SensorDataRollupMixin, f'{_metric}_max', db.Column(db.Float))
+del _metric
+
+
+class SensorDataRollupMinute(SensorDataRollupMixin, db.Model):
+    """1-minute rollups of sensordata"""
+    __tablename__ = 'sensordata_rollup_1m'
+    bucket_seconds = 60
+
+
+class SensorDataRollupHour(SensorDataRollupMixin, db.Model):
+    """1-hour rollups of sensordata"""
+    __tablename__ = 'sensordata_rollup_1h'
+    bucket_seconds = 3600
+
+
+class SensorDataRollupDay(SensorDataRollupMixin, db.Model):
+    """1-day rollups of sensordata"""
+    __tablename__ = 'sensordata_rollup_1d'
+    bucket_seconds = 86400
+
+
+class SensorDataRollupCoverage(db.Model):
+    """Single-row watermark of the rollup tables: they hold every reading stored at or after it"""
+    __tablename__ = 'sensordata_rollup_coverage'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Start of the first covered minute in seconds since 1970-01-01 wall-clock time; NULL: all readings
+    covered_from = db.Column(db.BigInteger, nullable=True)
+
+
+@event.listens_for(SensorDataRollupCoverage.__table__, 'after_create')
+def _initial_rollup_coverage(table, connection, **kw):
+    """New rollup tables hold none of the readings already stored, only those merged from now on."""
+    newest = None
+    if db.inspect(connection).has_table(SensorData.__tablename__):
+        newest = connection.execute(db.select(db.func.max(SensorData.timestamp))).scalar()
+    width = SensorDataRollupMinute.bucket_seconds
+    covered_from = None if newest is None else (wall_clock_epoch(newest) // width + 1) * width
+    connection.execute(table.insert().values(id=1, covered_from=covered_from))
+
+
+class SensorDataQuarantine(db.Model):
+    """Ingested sensor values rejected by the validation profile (kept for review instead of being dropped)"""
+    __tablename__ = 'sensordata_quarantine'
+
+    id = db.Column(db.Integer, primary_key=True)
+    timestamp = db.Column(db.DateTime, nullable=False, index=True) # Timestamp of the reading the value came from
+    metric = db.Column(db.String(50), nullable=False, index=True) # SensorData column name
+    value = db.Column(db.Float) # NULL for a missing required value
+    reason = db.Column(db.String(20), nullable=False) # 'below_min', 'above_max', 'rate', 'missing' or 'pending'
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    source_id = db.Column(db.String(64), nullable=True) # X-Source-Id of the reading (NULL without one)
+
+    def __repr__(self):
+        return f'<SensorDataQuarantine {self.metric}={self.value} ({self.reason}) @ {self.timestamp}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+            'metric': self.metric,
+            'value': self.value,
+            'reason': self.reason,
+            'received_at': self.received_at.isoformat() if self.received_at else None,
+            'source_id': self.source_id,
+        }
+
+
+class IngestKey(db.Model):
+    """Idempotency key of an ingested batch or reading (source id + sequence number)"""
+    __tablename__ = 'ingest_keys'
+    __table_args__ = (db.UniqueConstraint('source_id', 'scope', 'seq', name='uq_ingest_keys_source_scope_seq'),)
+
+    SCOPE_BATCH = 'batch'
+    SCOPE_READING = 'reading'
+
+    id = db.Column(db.Integer, primary_key=True)
+    source_id = db.Column(db.String(64), nullable=False) # Gateway identifier (X-Source-Id)
+    scope = db.Column(db.String(10), nullable=False) # 'batch' (X-Batch-Seq) or 'reading' (per-reading 'seq')
+    seq = db.Column(db.BigInteger, nullable=False)
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<IngestKey {self.source_id}/{self.scope}/{self.seq}>'
+
+
 class Device(db.Model):
     """Model for controllable devices"""
     __tablename__ = 'devices'
@@ -153,6 +265,95 @@ class Device(db.Model):
         }
 
 
+class DeviceStateVersion(db.Model):
+    """Single-row counter bumped by every transaction that changes device rows or flushes device statuses"""
+    __tablename__ = 'device_state_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Worker processes compare it with the version their in-memory device state was loaded at
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DeviceCommand(db.Model):
+    """A control command for a device, executed asynchronously (see app/device_commands.py)"""
+    __tablename__ = 'device_commands'
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    EXPIRED = 'expired' # Waited too long in the queue; never sent to the device
+    CANCELLED = 'cancelled' # Later step of a scene run whose earlier step failed; never sent
+
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.Integer, ForeignKey('devices.id'), nullable=False, index=True)
+    action = db.Column(db.String(20), nullable=False)
+    status = db.Column(db.String(10), nullable=False, default=QUEUED)
+    # Commands of one scene run share a run id and execute in position order
+    run_id = db.Column(db.String(32), nullable=True, index=True)
+    position = db.Column(db.Integer, nullable=True)
+    # Command of the same run undone by this one after a later step failed
+    compensates_id = db.Column(db.Integer, ForeignKey('device_commands.id'), nullable=True)
+    # Device status reported back by the adapter, or why the command failed
+    result = db.Column(db.String(50), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    device = relationship('Device')
+
+    def __repr__(self):
+        return f'<DeviceCommand {self.id} {self.action} -> device {self.device_id} ({self.status})>'
+
+    def to_dict(self):
+        def milliseconds(start, end):
+            return round((end - start).total_seconds() * 1000, 1) if start and end else None
+
+        return {
+            'id': self.id,
+            'device_id': self.device_id,
+            'action': self.action,
+            'status': self.status,
+            'run_id': self.run_id,
+            'position': self.position,
+            'compensates_id': self.compensates_id,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'queued_ms': milliseconds(self.created_at, self.started_at),
+            'execution_ms': milliseconds(self.started_at, self.finished_at),
+        }
+
+
+class Scene(db.Model):
+    """A named, ordered list of device actions run together (e.g. an irrigation cycle)"""
+    __tablename__ = 'scenes'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+    description = db.Column(db.Text, nullable=True)
+    # [{"control_id": "main_pump", "action": "ON"}, ...] in execution order
+    steps = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Scene {self.name} ({len(self.steps or [])} steps)>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'description': self.description,
+            'steps': self.steps,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+
 # Enum for Alarm Status
 class AlarmStatus(enum.Enum):
     ACTIVE = 'active'
@@ -175,6 +376,15 @@ class AlarmCondition(enum.Enum):
 class Alarm(db.Model):
     """Model for generated alarms"""
     __tablename__ = 'alarms'
+    # Keyset pagination of /api/alarms: (timestamp, id) order, alone or after one equality filter
+    __table_args__ = (
+        db.Index('ix_alarms_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_alarms_status_timestamp_id', 'status', 'timestamp', 'id'),
+        db.Index('ix_alarms_severity_timestamp_id', 'severity', 'timestamp', 'id'),
+        db.Index('ix_alarms_device_timestamp_id', 'device_id', 'timestamp', 'id'),
+        # Per-rule lookups of the alarm engine (last alarm per rule, automatic clearing)
+        db.Index('ix_alarms_rule_timestamp', 'triggered_by_rule_id', 'timestamp'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(db.TIMESTAMP(timezone=True), nullable=False, server_default=db.func.now(), index=True)
@@ -185,6 +395,11 @@ class Alarm(db.Model):
     details = db.Column(db.Text, nullable=True, comment="More details about the alarm, e.g., 'Temperature 35°C exceeded threshold 30°C'")
     # Optional: Link to the rule that triggered this alarm
     triggered_by_rule_id = db.Column(db.Integer, ForeignKey('alarm_rules.id'), nullable=True)
+    # Repeated triggers while the alarm is open are counted here instead of inserting new alarms
+    occurrence_count = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    last_seen = db.Column(db.TIMESTAMP(timezone=True), nullable=True)
+    # Time of the last change (status, occurrences); read by the alarm event stream of every worker
+    updated_at = db.Column(db.DateTime, nullable=True, onupdate=datetime.utcnow, index=True)
 
     device = relationship("Device") # Relationship to Device model
     triggered_by_rule = relationship("AlarmRule") # Relationship to AlarmRule model
@@ -205,6 +420,8 @@ class Alarm(db.Model):
             'status': self.status.value, # Return enum value
             'details': self.details,
             'triggered_by_rule_id': self.triggered_by_rule_id,
+            'occurrence_count': self.occurrence_count or 1,
+            'last_seen': self.last_seen.isoformat() if isinstance(self.last_seen, datetime) else (self.last_seen or timestamp_str),
         }
 
 
@@ -225,6 +442,10 @@ class AlarmRule(db.Model):
     is_active = db.Column(db.Boolean, default=True, nullable=False)
     # Optional: Cooldown period in seconds to avoid spamming alarms
     cooldown_period_seconds = db.Column(db.Integer, default=300) # 5 minutes default
+    # Optional: Condition must hold this long before the alarm is raised (0 = on the first sample)
+    duration_seconds = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Optional: Dead band around the threshold; the value must pass threshold +/- hysteresis to trigger and to clear
+    hysteresis = db.Column(db.Float, nullable=False, default=0, server_default='0')
 
     # user = relationship("User") # Relationship to User model
     device = relationship("Device") # Relationship to Device model
@@ -246,4 +467,121 @@ class AlarmRule(db.Model):
             'severity': self.severity.value, # Return enum value
             'is_active': self.is_active,
             'cooldown_period_seconds': self.cooldown_period_seconds,
+            'duration_seconds': self.duration_seconds,
+            'hysteresis': self.hysteresis,
+        }
+
+
+class AlarmNotification(db.Model):
+    """One alarm to deliver to one notification sink (durable queue, see app/alarm_notifications.py)"""
+    __tablename__ = 'alarm_notifications'
+    # Workers of a sink look for its due pending rows
+    __table_args__ = (db.Index('ix_alarm_notifications_sink_status_due', 'sink', 'status', 'next_attempt_at'),)
+
+    PENDING = 'pending'
+    DELIVERED = 'delivered'
+    DEAD = 'dead' # Gave up after the maximum number of attempts
+
+    id = db.Column(db.Integer, primary_key=True)
+    sink = db.Column(db.String(100), nullable=False) # Sink name from the ALARM_NOTIFICATION_SINKS file
+    payload = db.Column(db.Text, nullable=False) # JSON of the alarm
+    status = db.Column(db.String(10), nullable=False, default=PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False)
+    # Lease of the worker currently delivering the row; expired leases are claimed again
+    claimed_until = db.Column(db.DateTime, nullable=True)
+    claim_token = db.Column(db.String(32), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    delivered_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<AlarmNotification {self.id} -> {self.sink} ({self.status})>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'sink': self.sink,
+            'status': self.status,
+            'attempts': self.attempts,
+            'next_attempt_at': self.next_attempt_at.isoformat() if self.next_attempt_at else None,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'delivered_at': self.delivered_at.isoformat() if self.delivered_at else None,
+        }
+
+
+class AlarmRuleSetVersion(db.Model):
+    """Single-row counter bumped by every transaction that changes alarm rules"""
+    __tablename__ = 'alarm_rule_set_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Worker processes compare it with the version their compiled rule index was built from
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class AlarmStateVersion(db.Model):
+    """Single-row counter bumped by every transaction that raises, coalesces or clears rule alarms"""
+    __tablename__ = 'alarm_state_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Worker processes compare it with the version their cooldowns and open rules were seeded at
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class AlarmOfflineSetVersion(db.Model):
+    """Single-row counter bumped by every transaction that changes Device Offline alarms"""
+    __tablename__ = 'alarm_offline_set_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Worker processes compare it with the version their set of offline devices was loaded at
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class InterlockRule(db.Model):
+    """Safety interlock: refuses an action of matching devices while a sensor reading meets a condition"""
+    __tablename__ = 'interlock_rules'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+    # Device selector: space-separated keywords that must all occur in the device_type (case-insensitive),
+    # e.g. 'WATER PUMP' matches 'water_pump' and 'Main Water Pump'
+    device_type_match = db.Column(db.String(100), nullable=False)
+    # Action refused while the condition holds (e.g. 'ON', 'OPEN')
+    action = db.Column(db.String(20), nullable=False)
+    # Sensor reading checked (must match a column name in SensorData)
+    sensor_metric = db.Column(db.String(100), nullable=False)
+    condition = db.Column(Enum(AlarmCondition), nullable=False)
+    threshold_value = db.Column(db.Float, nullable=False)
+    # Reason reported when the rule blocks a command; '{value}' is replaced by the reading
+    reason = db.Column(db.String(200), nullable=False)
+    is_active = db.Column(db.Boolean, default=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<InterlockRule {self.id} ({self.name}): {self.device_type_match} {self.action}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'device_type_match': self.device_type_match,
+            'action': self.action,
+            'sensor_metric': self.sensor_metric,
+            'condition': self.condition.value,
+            'threshold_value': self.threshold_value,
+            'reason': self.reason,
+            'is_active': self.is_active,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
         }
+
+
+class InterlockRuleSetVersion(db.Model):
+    """Single-row counter bumped by every transaction that changes interlock rules"""
+    __tablename__ = 'interlock_rule_set_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Worker processes compare it with the version their compiled interlock index was built from
+    version = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,313 @@
+"""
+Multi-resolution rollups of SensorData.
+
+Readings are folded into 1-minute, 1-hour and 1-day tables holding
+count/sum/min/max per metric, one row per bucket. New readings are merged in
+with an upsert, so the tables stay current without rescanning sensordata;
+`flask rebuild-rollups` recomputes them from scratch (e.g. after importing
+data with raw SQL).
+
+A watermark (SensorDataRollupCoverage) records from when on the tables hold
+every reading: readings stored before the rollup tables were created are only
+covered once rebuild_rollups() has run, which clears it in its transaction.
+Readings merged by apply_readings() never fall before it, so writes need no
+bookkeeping. /api/historical_data aggregates the part of a range before the
+watermark from sensordata (covered_buckets) and the rest from the rollups.
+"""
+import math
+
+from operator import itemgetter
+
+from sqlalchemy import event
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+from app.database import db, executemany_rows
+from app.models import (SensorData, SensorDataRollupCoverage, SensorDataRollupMinute, SensorDataRollupHour,
+                        SensorDataRollupDay, SENSOR_METRIC_COLUMNS)
+from app.timeseries import bucket_start, bucket_width_seconds, epoch_bucket, time_bucket, wall_clock_epoch
+
+# Finest tier first; each tier's width divides the next one's
+ROLLUP_TIERS = (SensorDataRollupMinute, SensorDataRollupHour, SensorDataRollupDay)
+
+# (metric, count column, sum column, min column, max column)
+METRIC_AGGREGATE_COLUMNS = [(metric, f'{metric}_count', f'{metric}_sum', f'{metric}_min', f'{metric}_max')
+                            for metric in SENSOR_METRIC_COLUMNS]
+_metric_values = itemgetter(*SENSOR_METRIC_COLUMNS)
+ROLLUP_COLUMNS = ['bucket_epoch'] + [name for columns in METRIC_AGGREGATE_COLUMNS for name in columns[1:]]
+
+
+def tier_for_width(bucket_seconds):
+    """Coarsest rollup tier whose buckets still fit inside `bucket_seconds`, or None for raw data."""
+    tier = None
+    for model in ROLLUP_TIERS:
+        if model.bucket_seconds <= bucket_seconds:
+            tier = model
+    return tier
+
+
+def _fold_bucket(bucket, readings):
+    """One rollup row (dict over ROLLUP_COLUMNS) for the readings of one bucket."""
+    row = {'bucket_epoch': bucket}
+    # Transpose the readings into one value tuple per metric
+    for (metric, count, total, low, high), values in zip(METRIC_AGGREGATE_COLUMNS,
+                                                        zip(*map(_metric_values, readings))):
+        if None in values:
+            values = [value for value in values if value is not None]
+        if values:
+            row[count] = len(values)
+            row[total] = sum(values)
+            row[low] = min(values)
+            row[high] = max(values)
+        else:
+            row[count] = 0
+            row[total] = 0.0
+            row[low] = None
+            row[high] = None
+    return row
+
+
+def _combine(target, row):
+    """Add the aggregates of `row` into `target` (both rollup row dicts)."""
+    for metric, count, total, low, high in METRIC_AGGREGATE_COLUMNS:
+        if not row[count]:
+            continue
+        if not target[count]:
+            target[low] = row[low]
+            target[high] = row[high]
+        else:
+            target[low] = min(target[low], row[low])
+            target[high] = max(target[high], row[high])
+        target[count] += row[count]
+        target[total] += row[total]
+
+
+def aggregate_readings(readings):
+    """Fold reading dicts into {tier model: {bucket_epoch: rollup row dict}}."""
+    finest = ROLLUP_TIERS[0]
+    width = finest.bucket_seconds
+
+    # Fold readings into the finest tier first...
+    readings_by_bucket = {}
+    for reading in readings:
+        timestamp = reading.get('timestamp')
+        if timestamp is None:
+            continue
+        readings_by_bucket.setdefault(wall_clock_epoch(timestamp) // width * width, []).append(reading)
+    partials = {finest: {bucket: _fold_bucket(bucket, bucket_readings)
+                         for bucket, bucket_readings in readings_by_bucket.items()}}
+
+    # ...then combine those partials upwards instead of touching every reading again
+    for finer, coarser in zip(ROLLUP_TIERS, ROLLUP_TIERS[1:]):
+        target = partials[coarser] = {}
+        for bucket, row in partials[finer].items():
+            coarse_bucket = bucket // coarser.bucket_seconds * coarser.bucket_seconds
+            if coarse_bucket in target:
+                _combine(target[coarse_bucket], row)
+            else:
+                target[coarse_bucket] = dict(row, bucket_epoch=coarse_bucket)
+    return partials
+
+
+# Dialects with an INSERT that can add into an existing row (see _merge_statement)
+UPSERT_DIALECTS = ('mysql', 'postgresql', 'sqlite')
+
+
+def _merge_statement(connection, model):
+    """INSERT that adds into an existing bucket row instead of failing on it."""
+    table = model.__table__
+    dialect = connection.dialect.name
+    if dialect == 'mysql':
+        stmt = mysql.insert(table)
+        new, least, greatest = stmt.inserted, db.func.least, db.func.greatest
+    elif dialect in ('sqlite', 'postgresql'):
+        stmt = (sqlite if dialect == 'sqlite' else postgresql).insert(table)
+        new = stmt.excluded
+        # SQLite's scalar min()/max() take several arguments like LEAST/GREATEST
+        least = db.func.min if dialect == 'sqlite' else db.func.least
+        greatest = db.func.max if dialect == 'sqlite' else db.func.greatest
+    else:
+        raise NotImplementedError(f'Rollup upserts are not implemented for {dialect}')
+
+    updates = {}
+    for metric, count, total, low, high in METRIC_AGGREGATE_COLUMNS:
+        updates[count] = table.c[count] + new[count]
+        updates[total] = table.c[total] + new[total]
+        # NULL (no samples yet) on either side must not win the comparison
+        updates[low] = least(db.func.coalesce(table.c[low], new[low]), db.func.coalesce(new[low], table.c[low]))
+        updates[high] = greatest(db.func.coalesce(table.c[high], new[high]), db.func.coalesce(new[high], table.c[high]))
+
+    if dialect == 'mysql':
+        return stmt.on_duplicate_key_update(updates)
+    return stmt.on_conflict_do_update(index_elements=['bucket_epoch'], set_=updates)
+
+
+def _merge_rows(connection, model, rows):
+    """Select-then-update fallback of the upsert for other dialects."""
+    table = model.__table__
+    existing = {row['bucket_epoch']: dict(row) for row in connection.execute(
+        db.select(table).where(table.c.bucket_epoch.in_([row['bucket_epoch'] for row in rows]))).mappings()}
+    inserts = []
+    for row in rows:
+        stored = existing.get(row['bucket_epoch'])
+        if stored is None:
+            inserts.append(row)
+            continue
+        _combine(stored, row)
+        connection.execute(table.update().where(table.c.bucket_epoch == row['bucket_epoch']),
+                           {column: stored[column] for column in ROLLUP_COLUMNS[1:]})
+    if inserts:
+        executemany_rows(connection, table.insert(), table, ROLLUP_COLUMNS, inserts)
+
+
+def apply_readings(connection, readings):
+    """Merge a batch of new readings into every rollup tier on the given connection."""
+    for model, buckets in aggregate_readings(readings).items():
+        if not buckets:
+            continue
+        if connection.dialect.name in UPSERT_DIALECTS:
+            executemany_rows(connection, _merge_statement(connection, model), model.__table__,
+                             ROLLUP_COLUMNS, list(buckets.values()))
+        else:
+            _merge_rows(connection, model, list(buckets.values()))
+
+
+def rebuild_rollups():
+    """Recompute all rollup tiers from sensordata. Returns {table name: row count}."""
+    finest = ROLLUP_TIERS[0]
+    for model in ROLLUP_TIERS:
+        db.session.query(model).delete(synchronize_session=False)
+
+    # Finest tier straight from the raw readings
+    bucket = time_bucket(SensorData.timestamp, finest.bucket_seconds) * finest.bucket_seconds
+    aggregates = [bucket]
+    for metric, count, total, low, high in METRIC_AGGREGATE_COLUMNS:
+        column = getattr(SensorData, metric)
+        aggregates += [db.func.count(column), db.func.coalesce(db.func.sum(column), 0.0),
+                       db.func.min(column), db.func.max(column)]
+    select = db.select(*aggregates).group_by(bucket)
+    db.session.execute(finest.__table__.insert().from_select(ROLLUP_COLUMNS, select))
+
+    # Coarser tiers from the tier below
+    for finer, coarser in zip(ROLLUP_TIERS, ROLLUP_TIERS[1:]):
+        source = finer.__table__.c
+        bucket = epoch_bucket(source.bucket_epoch, coarser.bucket_seconds) * coarser.bucket_seconds
+        aggregates = [bucket]
+        for metric, count, total, low, high in METRIC_AGGREGATE_COLUMNS:
+            aggregates += [db.func.sum(source[count]), db.func.sum(source[total]),
+                           db.func.min(source[low]), db.func.max(source[high])]
+        select = db.select(*aggregates).group_by(bucket)
+        db.session.execute(coarser.__table__.insert().from_select(ROLLUP_COLUMNS, select))
+
+    # Every stored reading is covered now
+    coverage = SensorDataRollupCoverage.__table__
+    if not db.session.execute(coverage.update().where(coverage.c.id == 1).values(covered_from=None)).rowcount:
+        db.session.execute(coverage.insert().values(id=1, covered_from=None))
+    db.session.commit()
+    return {model.__tablename__: db.session.query(model).count() for model in ROLLUP_TIERS}
+
+
+def query_buckets(model, metrics, start, end, bucket_seconds):
+    """
+    Re-aggregate a rollup tier into buckets of `bucket_seconds` (a multiple of the tier width).
+    Returns a list of (bucket number, {metric: (count, sum, min, max)}) in time order.
+    """
+    start_epoch = wall_clock_epoch(start) // model.bucket_seconds * model.bucket_seconds
+    end_epoch = wall_clock_epoch(end)
+    bucket = epoch_bucket(model.bucket_epoch, bucket_seconds).label('bucket')
+    table = model.__table__.c
+    aggregates = []
+    for metric in metrics:
+        aggregates += [db.func.sum(table[f'{metric}_count']), db.func.sum(table[f'{metric}_sum']),
+                       db.func.min(table[f'{metric}_min']), db.func.max(table[f'{metric}_max'])]
+    query = db.session.query(bucket, *aggregates).filter(
+        model.bucket_epoch >= start_epoch,
+        model.bucket_epoch <= end_epoch
+    ).group_by(bucket).order_by(bucket)
+    return _bucket_rows(query, metrics)
+
+
+def raw_buckets(metrics, start, end, bucket_seconds):
+    """query_buckets() counterpart over the sensordata readings in [start, end)."""
+    bucket = time_bucket(SensorData.timestamp, bucket_seconds).label('bucket')
+    aggregates = []
+    for metric in metrics:
+        column = getattr(SensorData, metric)
+        aggregates += [db.func.count(column), db.func.coalesce(db.func.sum(column), 0.0),
+                       db.func.min(column), db.func.max(column)]
+    query = db.session.query(bucket, *aggregates).filter(
+        SensorData.timestamp >= start,
+        SensorData.timestamp < end
+    ).group_by(bucket).order_by(bucket)
+    return _bucket_rows(query, metrics)
+
+
+def _bucket_rows(query, metrics):
+    result = []
+    for row in query.all():
+        # Each metric contributes (count, sum, min, max) after the bucket number
+        result.append((row[0], {metric: tuple(row[1 + i * 4:5 + i * 4]) for i, metric in enumerate(metrics)}))
+    return result
+
+
+def merge_buckets(*results):
+    """Combine query_buckets()-style results whose buckets may overlap, in time order."""
+    merged = {}
+    for result in results:
+        for bucket, metrics in result:
+            stored = merged.setdefault(bucket, {})
+            for metric, (count, total, low, high) in metrics.items():
+                if metric not in stored:
+                    stored[metric] = (count, total, low, high)
+                    continue
+                stored_count, stored_total, stored_low, stored_high = stored[metric]
+                lows = [value for value in (stored_low, low) if value is not None]
+                highs = [value for value in (stored_high, high) if value is not None]
+                stored[metric] = (stored_count + count, stored_total + total,
+                                  min(lows, default=None), max(highs, default=None))
+    return sorted(merged.items())
+
+
+def rollup_covered_from():
+    """Epoch seconds from which the rollups hold every reading (None: all of them, inf: none)."""
+    coverage = SensorDataRollupCoverage.__table__
+    row = db.session.execute(db.select(coverage.c.covered_from).where(coverage.c.id == 1)).first()
+    return math.inf if row is None else row.covered_from
+
+
+def covered_buckets(model, metrics, start, end, bucket_seconds):
+    """
+    query_buckets() for [start, end], with the tier buckets before the rollup watermark
+    aggregated from sensordata instead. None when the watermark lies past `end`, i.e.
+    sensordata has to answer the whole range.
+    """
+    width = model.bucket_seconds
+    first = wall_clock_epoch(start) // width * width
+    end_epoch = wall_clock_epoch(end)
+    covered_from = rollup_covered_from()
+    if covered_from is None or covered_from <= first:
+        return query_buckets(model, metrics, start, end, bucket_seconds)
+    if covered_from > end_epoch:
+        return None
+    # First whole tier bucket at or after the watermark
+    split = -(-covered_from // width) * width
+    if split > end_epoch:
+        return None
+    split_start = bucket_start(split // width, width)
+    return merge_buckets(raw_buckets(metrics, bucket_start(first // width, width), split_start, bucket_seconds),
+                         query_buckets(model, metrics, split_start, end, bucket_seconds))
+
+
+def rollup_bucket_seconds(model, start, end, max_points):
+    """Bucket width for [start, end] in at most max_points buckets, in whole tier buckets."""
+    return bucket_width_seconds(start, end, max_points, model.bucket_seconds)
+
+
+@event.listens_for(SensorData, 'after_insert')
+def _rollup_orm_insert(mapper, connection, target):
+    """Keep rollups current for readings added through the ORM."""
+    reading = {column: target.__dict__.get(column) for column in ['timestamp'] + SENSOR_METRIC_COLUMNS}
+    if reading['timestamp'] is None:
+        # Filled in by the server-side default; read it back
+        reading['timestamp'] = connection.execute(
+            db.select(SensorData.timestamp).where(SensorData.id == target.id)).scalar()
+    apply_readings(connection, [reading])
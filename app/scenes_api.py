@@ -0,0 +1,243 @@
+"""
+Scenes: ordered lists of device actions applied in one request.
+
+A scene run is checked as a whole before anything is recorded: every step
+needs a known, enabled device and an action that device accepts, and the
+safety interlocks of all steps are evaluated once, against one sensor
+snapshot. If any step fails these checks nothing is queued. Otherwise all of
+the run's commands are recorded in one transaction and the device command
+workers execute them one after another (see DeviceCommandQueue.submit_run):
+if a step fails, the steps after it are cancelled and the applied ones are
+undone by their inverse actions.
+"""
+import uuid
+from flask import Blueprint, jsonify, request, url_for
+from sqlalchemy.exc import IntegrityError
+from app.auth import login_required
+from app.database import db
+from app.models import DeviceCommand, Scene
+from app.device_state import device_state
+from app.device_commands import device_commands, invalid_action_error
+from app.interlocks import check_safety_interlocks, latest_sensor_data
+
+scenes_bp = Blueprint('scenes_bp', __name__)
+
+# Steps one scene may have
+MAX_SCENE_STEPS = 20
+
+
+def parse_steps(steps):
+    """(control_id, ACTION) tuples of a steps list, raising ValueError if it is malformed."""
+    if not isinstance(steps, list) or not steps:
+        raise ValueError('steps must be a non-empty list of {"control_id", "action"} objects')
+    if len(steps) > MAX_SCENE_STEPS:
+        raise ValueError(f'A scene can have at most {MAX_SCENE_STEPS} steps')
+    parsed = []
+    for position, step in enumerate(steps):
+        if not isinstance(step, dict) or not step.get('control_id') or not step.get('action'):
+            raise ValueError(f'Step {position} needs a control_id and an action')
+        parsed.append((str(step['control_id']), str(step['action']).upper()))
+    return parsed
+
+
+def _devices_of(parsed):
+    """Devices (to_dict() rows) of the steps by control_id, from the device state store."""
+    devices = {control_id: device_state.by_control_id(control_id) for control_id, _ in parsed}
+    return {control_id: device for control_id, device in devices.items() if device}
+
+
+def step_problems(parsed, devices, latest_data=None, check_interlocks=False):
+    """
+    Why steps cannot run: one dict per rejected step. With `check_interlocks`, the
+    interlocks are evaluated against `latest_data` and disabled devices are rejected too.
+    Problems with 'blocked' set are safety refusals rather than invalid requests.
+    """
+    problems = []
+    for position, (control_id, action) in enumerate(parsed):
+        problem = {'position': position, 'control_id': control_id, 'action': action}
+        device = devices.get(control_id)
+        if device is None:
+            problems.append(dict(problem, error=f'Device not found with control_id: {control_id}'))
+            continue
+        error = invalid_action_error(device, action)
+        if error:
+            problems.append(dict(problem, error=error))
+            continue
+        if not check_interlocks:
+            continue
+        if not device['is_enabled']:
+            problems.append(dict(problem, blocked=True, error='Device is disabled and cannot be controlled'))
+            continue
+        interlock = check_safety_interlocks(device, action, latest_data)
+        if interlock['blocked']:
+            problems.append(dict(problem, blocked=True, error=interlock['reason'], interlock=interlock))
+    return problems
+
+
+def run_steps(parsed, scene=None):
+    """Check and queue the steps of one run; the response of the run endpoints."""
+    devices = _devices_of(parsed)
+    problems = step_problems(parsed, devices, latest_sensor_data(), check_interlocks=True)
+    if problems:
+        blocked = any(problem.get('blocked') for problem in problems)
+        return jsonify({
+            'error': 'Safety interlock active' if blocked else 'Invalid scene steps',
+            'message': 'No step of the scene was applied',
+            'problems': problems,
+        }), 403 if blocked else 400
+
+    run_id = uuid.uuid4().hex
+    commands = [DeviceCommand(device_id=devices[control_id]['id'], action=action, run_id=run_id, position=position)
+                for position, (control_id, action) in enumerate(parsed)]
+    db.session.add_all(commands)
+    db.session.flush()
+    commands = [command.to_dict() for command in commands]
+    db.session.commit()
+    device_commands.submit_run(commands)
+
+    run_url = url_for('scenes_bp.get_scene_run', run_id=run_id)
+    return jsonify({
+        'success': True,
+        'run_id': run_id,
+        'scene': scene.to_dict() if scene else None,
+        'commands': commands,
+        'run_url': run_url,
+    }), 202, {'Location': run_url}
+
+
+def _scene_fields(data, scene=None):
+    """Validated (name, description, steps) of a scene body; raises ValueError."""
+    name = data.get('name', scene.name if scene else None)
+    if not name or not str(name).strip():
+        raise ValueError('Missing required field: name')
+    parsed = parse_steps(data['steps']) if 'steps' in data or scene is None else None
+    return str(name).strip(), data.get('description', scene.description if scene else None), parsed
+
+
+# --- Scene Endpoints ---
+
+@scenes_bp.route('/api/scenes', methods=['GET'])
+@login_required
+def get_scenes():
+    """List the stored scenes."""
+    return jsonify([scene.to_dict() for scene in Scene.query.order_by(Scene.name)])
+
+
+@scenes_bp.route('/api/scenes', methods=['POST'])
+@login_required
+def create_scene():
+    """
+    Store a scene for reuse.
+    Body: name, optional description, and steps: [{"control_id", "action"}, ...] in execution order.
+    Devices and actions are checked now; interlocks only when the scene runs.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        name, description, parsed = _scene_fields(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    problems = step_problems(parsed, _devices_of(parsed))
+    if problems:
+        return jsonify({'error': 'Invalid scene steps', 'problems': problems}), 400
+
+    scene = Scene(name=name, description=description,
+                  steps=[{'control_id': control_id, 'action': action} for control_id, action in parsed])
+    try:
+        db.session.add(scene)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': f'A scene named {name} already exists'}), 409
+    return jsonify(scene.to_dict()), 201
+
+
+@scenes_bp.route('/api/scenes/<int:scene_id>', methods=['GET'])
+@login_required
+def get_scene(scene_id):
+    """Get a stored scene."""
+    return jsonify(Scene.query.get_or_404(scene_id).to_dict())
+
+
+@scenes_bp.route('/api/scenes/<int:scene_id>', methods=['PUT'])
+@login_required
+def update_scene(scene_id):
+    """Change the name, description and/or steps of a stored scene."""
+    scene = Scene.query.get_or_404(scene_id)
+    data = request.get_json(silent=True) or {}
+    try:
+        name, description, parsed = _scene_fields(data, scene)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if parsed is not None:
+        problems = step_problems(parsed, _devices_of(parsed))
+        if problems:
+            return jsonify({'error': 'Invalid scene steps', 'problems': problems}), 400
+        scene.steps = [{'control_id': control_id, 'action': action} for control_id, action in parsed]
+    scene.name = name
+    scene.description = description
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': f'A scene named {name} already exists'}), 409
+    return jsonify(scene.to_dict())
+
+
+@scenes_bp.route('/api/scenes/<int:scene_id>', methods=['DELETE'])
+@login_required
+def delete_scene(scene_id):
+    """Delete a stored scene (its past runs stay in device_commands)."""
+    scene = Scene.query.get_or_404(scene_id)
+    db.session.delete(scene)
+    db.session.commit()
+    return jsonify({'message': f'Scene {scene_id} deleted successfully'})
+
+
+@scenes_bp.route('/api/scenes/<int:scene_id>/run', methods=['POST'])
+@login_required
+def run_scene(scene_id):
+    """Run a stored scene; 202 with the run's commands, or 400/403 and nothing applied."""
+    scene = Scene.query.get_or_404(scene_id)
+    try:
+        parsed = parse_steps(scene.steps)
+    except ValueError as e:
+        return jsonify({'error': f'Stored scene is invalid: {e}'}), 400
+    return run_steps(parsed, scene)
+
+
+@scenes_bp.route('/api/scenes/run', methods=['POST'])
+@login_required
+def run_adhoc_scene():
+    """Run the steps of the body ({"steps": [{"control_id", "action"}, ...]}) without storing them."""
+    data = request.get_json(silent=True) or {}
+    try:
+        parsed = parse_steps(data.get('steps'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return run_steps(parsed)
+
+
+@scenes_bp.route('/api/scene_runs/<run_id>', methods=['GET'])
+@login_required
+def get_scene_run(run_id):
+    """
+    Progress of a scene run: its commands in execution order (undo steps last) and a status:
+    'running' while a command is queued or running, 'succeeded' if every step did, else 'failed'.
+    'rolled_back' tells whether the applied steps of a failed run were all undone.
+    """
+    commands = DeviceCommand.query.filter_by(run_id=run_id).order_by(DeviceCommand.position).all()
+    if not commands:
+        return jsonify({'error': f'Scene run {run_id} not found'}), 404
+    undo = [command for command in commands if command.compensates_id is not None]
+    if any(command.status in (DeviceCommand.QUEUED, DeviceCommand.RUNNING) for command in commands):
+        status = 'running'
+    elif all(command.status == DeviceCommand.SUCCEEDED for command in commands):
+        status = 'succeeded'
+    else:
+        status = 'failed'
+    return jsonify({
+        'run_id': run_id,
+        'status': status,
+        'rolled_back': status == 'failed' and all(command.status == DeviceCommand.SUCCEEDED for command in undo),
+        'commands': [command.to_dict() for command in commands],
+    })
@@ -0,0 +1,106 @@
+"""
+In-process cache of the latest SensorData reading.
+
+The dashboard status endpoints all want the newest row. Instead of each of
+them running ORDER BY timestamp DESC LIMIT 1 on every poll, they read one
+shared snapshot that is dropped whenever a reading is committed and, as a
+safety net for writes made by other processes, after a short TTL.
+"""
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.models import SensorData
+
+
+class LatestReadingCache:
+    """Thread-safe holder for the latest reading as a `SensorData.to_dict()` snapshot."""
+
+    def __init__(self, ttl_seconds=5.0):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._loaded = False
+        self._loaded_at = 0.0
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Call `callback()` after every invalidation (e.g. to wake push streams)."""
+        self._listeners.append(callback)
+
+    def get(self):
+        """Return the latest reading as a dict (or None when there is no data)."""
+        with self._lock:
+            if self._loaded and time.monotonic() - self._loaded_at < self.ttl_seconds:
+                self.hits += 1
+                return self._snapshot
+            self.misses += 1
+            generation = self._generation
+
+        latest = SensorData.query.order_by(SensorData.timestamp.desc()).first()
+        snapshot = latest.to_dict() if latest else None
+
+        with self._lock:
+            # Don't store a row read before an invalidation that raced with the query
+            if generation == self._generation:
+                self._snapshot = snapshot
+                self._loaded = True
+                self._loaded_at = time.monotonic()
+        return snapshot
+
+    def invalidate(self):
+        """Drop the cached snapshot; the next get() reloads it."""
+        with self._lock:
+            self._generation += 1
+            self._loaded = False
+            self._snapshot = None
+            self.invalidations += 1
+        for callback in self._listeners:
+            callback()
+
+    def stats(self):
+        """Hit/miss counters for monitoring."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else None,
+                'invalidations': self.invalidations,
+                'ttl_seconds': self.ttl_seconds,
+                'cached': self._loaded,
+            }
+
+
+latest_reading_cache = LatestReadingCache()
+
+
+def init_app(app):
+    """Apply cache settings from the Flask config."""
+    latest_reading_cache.ttl_seconds = float(app.config.get('LATEST_READING_CACHE_TTL', 5.0))
+
+
+# --- Invalidation on ORM writes ---
+# Core bulk inserts bypass these hooks and call latest_reading_cache.invalidate() themselves.
+
+@event.listens_for(Session, 'after_flush')
+def _note_sensordata_write(session, flush_context):
+    if any(isinstance(obj, SensorData) for obj in session.new):
+        session.info['sensordata_written'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop('sensordata_written', False):
+        latest_reading_cache.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_write(session):
+    session.info.pop('sensordata_written', None)
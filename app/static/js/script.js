@@ -25,4 +25,25 @@ document.addEventListener('DOMContentLoaded', function() {
             link.classList.add('active');
         }
     });
+
+    // Alarm badge in the navigation: "N aktif / M kritik", refreshed from the cached counters
+    const alarmBadge = document.getElementById('alarmSummaryBadge');
+    if (alarmBadge) {
+        const refreshAlarmBadge = () => {
+            fetch(alarmBadge.dataset.summaryUrl)
+                .then(response => response.ok ? response.json() : null)
+                .then(summary => {
+                    if (!summary) return;
+                    const active = summary.status.active;
+                    const critical = summary.active_by_severity.critical;
+                    alarmBadge.textContent = critical ? `${active} aktif / ${critical} kritik` : `${active} aktif`;
+                    alarmBadge.classList.toggle('bg-danger', critical > 0);
+                    alarmBadge.classList.toggle('bg-warning', critical === 0);
+                    alarmBadge.classList.toggle('d-none', active === 0);
+                })
+                .catch(() => {});
+        };
+        refreshAlarmBadge();
+        setInterval(refreshAlarmBadge, 30000);
+    }
 });
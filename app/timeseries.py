@@ -0,0 +1,117 @@
+"""
+Time-bucketing helpers shared by the historical data API.
+
+SQLite and MySQL have no common function for "seconds since epoch" or for
+integer division, so these small SQL constructs compile to the right
+expression for each dialect. Epoch values are computed from the stored
+wall-clock time (no timezone conversion), which keeps buckets identical no
+matter which database backs the app.
+"""
+import math
+from datetime import datetime, timedelta
+
+from sqlalchemy import Integer, literal_column
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+# Aggregate functions supported by /api/historical_data
+AGGREGATE_FUNCTIONS = ('avg', 'min', 'max')
+
+# Naive "epoch" used to turn bucket numbers back into wall-clock timestamps
+EPOCH = datetime(1970, 1, 1)
+
+
+class epoch_seconds(FunctionElement):
+    """Whole seconds between 1970-01-01 00:00:00 and a timestamp column."""
+    type = Integer()
+    inherit_cache = True
+
+
+@compiles(epoch_seconds)
+def _epoch_seconds_default(element, compiler, **kw):
+    return "CAST(EXTRACT(EPOCH FROM %s) AS BIGINT)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(epoch_seconds, 'sqlite')
+def _epoch_seconds_sqlite(element, compiler, **kw):
+    return "CAST(strftime('%%s', %s) AS INTEGER)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(epoch_seconds, 'mysql')
+def _epoch_seconds_mysql(element, compiler, **kw):
+    return "TIMESTAMPDIFF(SECOND, '1970-01-01 00:00:00', %s)" % compiler.process(element.clauses, **kw)
+
+
+class floor_div(FunctionElement):
+    """Integer division of a non-negative integer expression: floor(x / n)."""
+    type = Integer()
+    inherit_cache = True
+
+
+@compiles(floor_div)
+def _floor_div_default(element, compiler, **kw):
+    x, n = list(element.clauses)
+    return "FLOOR(%s / %s)" % (compiler.process(x, **kw), compiler.process(n, **kw))
+
+
+@compiles(floor_div, 'sqlite')
+def _floor_div_sqlite(element, compiler, **kw):
+    # Integer operands already divide with truncation in SQLite
+    x, n = list(element.clauses)
+    return "(%s / %s)" % (compiler.process(x, **kw), compiler.process(n, **kw))
+
+
+@compiles(floor_div, 'mysql')
+def _floor_div_mysql(element, compiler, **kw):
+    x, n = list(element.clauses)
+    return "(%s DIV %s)" % (compiler.process(x, **kw), compiler.process(n, **kw))
+
+
+def epoch_bucket(expression, width):
+    """Bucket number of an epoch-seconds expression for buckets of `width` seconds."""
+    # Width is inlined rather than bound so GROUP BY matches the SELECT expression on MySQL
+    return floor_div(expression, literal_column(str(int(width))))
+
+
+def time_bucket(column, width):
+    """Bucket number of a timestamp column for buckets of `width` seconds."""
+    return epoch_bucket(epoch_seconds(column), width)
+
+
+def wall_clock_epoch(value):
+    """Python counterpart of epoch_seconds() for a datetime or ISO string."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return math.floor((value.replace(tzinfo=None) - EPOCH).total_seconds())
+
+
+def bucket_count(start, end, width):
+    """Number of epoch-aligned buckets of `width` seconds that [start, end] touches."""
+    return wall_clock_epoch(end) // width - wall_clock_epoch(start) // width + 1
+
+
+def bucket_width_seconds(start, end, max_points, step=1):
+    """
+    Bucket width (a multiple of `step` seconds) whose epoch-aligned buckets cover
+    [start, end] in at most max_points buckets.
+    """
+    first, last = wall_clock_epoch(start), wall_clock_epoch(end)
+    span = last - first
+    if span <= 0 or max_points <= 0:
+        return step
+    width = max(1, int(math.ceil(span / max_points)))
+    width = int(math.ceil(width / step)) * step
+    if bucket_count(start, end, width) > max_points:
+        # Alignment can add a partial bucket at each end; ceil(span / width) + 1 buckets
+        # at most are touched, so span / (max_points - 1) always fits
+        if max_points == 1:
+            width = last + 1
+        else:
+            width = int(math.ceil(span / (max_points - 1)))
+        width = int(math.ceil(width / step)) * step
+    return width
+
+
+def bucket_start(bucket_number, width):
+    """Wall-clock start of a bucket as a naive datetime."""
+    return EPOCH + timedelta(seconds=int(bucket_number) * width)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark the alarm rule evaluation engine with thousands of rules.
+
+Creates random threshold rules spread over the SensorData metrics, then
+evaluates a stream of readings one at a time through the indexed engine and,
+for comparison, through a naive loop over every rule of the reading's metrics.
+Reports per-reading latency and rules evaluated per second.
+
+Usage: python benchmark_alarm_engine.py [--rules 1000,5000,20000] [--readings 5000]
+Runs against a throw-away SQLite database; nothing touches the configured DATABASE_URL.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Point the app at a temporary database before it is imported
+DB_FILE = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_FILE
+
+from flask import Flask
+from app.database import db, init_app as init_db_app
+from app.models import AlarmCondition, AlarmRule, AlarmSeverity, Device, SENSOR_METRIC_COLUMNS
+
+_COMPARE = {
+    AlarmCondition.GREATER_THAN: lambda value, threshold: value > threshold,
+    AlarmCondition.LESS_THAN: lambda value, threshold: value < threshold,
+    AlarmCondition.EQUALS: lambda value, threshold: value == threshold,
+}
+
+
+def create_schema():
+    """Create tables so importing the app (which seeds the admin user) works."""
+    setup_app = Flask(__name__)
+    setup_app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
+    init_db_app(setup_app)
+    with setup_app.app_context():
+        db.create_all()
+
+
+def create_rules(count):
+    """Replace all rules with `count` random ones (thresholds in 0..100, readings around 50)."""
+    AlarmRule.query.delete()
+    device = Device.query.first()
+    if device is None:
+        device = Device(control_id='benchmark-device', name='Benchmark Device', device_type='pump')
+        db.session.add(device)
+        db.session.flush()
+    conditions = [AlarmCondition.GREATER_THAN, AlarmCondition.LESS_THAN, AlarmCondition.EQUALS]
+    db.session.execute(AlarmRule.__table__.insert(), [{
+        'name': f'rule {i}',
+        'device_id': device.id,
+        'sensor_metric': random.choice(SENSOR_METRIC_COLUMNS),
+        'condition': random.choice(conditions),
+        'threshold_value': random.uniform(0, 100),
+        'severity': AlarmSeverity.WARNING,
+        'is_active': True,
+        'cooldown_period_seconds': 300,
+    } for i in range(count)])
+    db.session.commit()
+
+
+def make_readings(count):
+    start = datetime(2025, 1, 1)
+    return [dict({metric: random.gauss(50, 15) for metric in SENSOR_METRIC_COLUMNS},
+                 timestamp=start + timedelta(seconds=i)) for i in range(count)]
+
+
+def naive_evaluate(rules_by_metric, reading):
+    """Compare the reading against every rule of its metrics (what the index avoids)."""
+    fired = []
+    for metric, rules in rules_by_metric.items():
+        value = reading.get(metric)
+        if value is None:
+            continue
+        fired += [rule for rule in rules if _COMPARE[rule.condition](value, rule.threshold_value)]
+    return fired
+
+
+def measure(evaluate, readings):
+    latencies = []
+    for reading in readings:
+        started = time.perf_counter()
+        evaluate(reading)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rules', default='1000,5000,20000')
+    parser.add_argument('--readings', type=int, default=5000)
+    args = parser.parse_args()
+
+    create_schema()
+    from app.app import app
+    from app.alarm_engine import alarm_engine
+
+    readings = make_readings(args.readings)
+    print(f"{args.readings} readings with {len(SENSOR_METRIC_COLUMNS)} metrics each")
+    print(f"{'rules':>7} {'engine':>8} {'p50 us':>9} {'p99 us':>9} {'rules/s':>14} {'alarms':>8}")
+    with app.app_context():
+        for count in [int(n) for n in args.rules.split(',')]:
+            create_rules(count)
+            alarm_engine.invalidate()
+            index = alarm_engine.load(db.session.connection())
+            rules_by_metric = {}
+            for metric, metric_rules in index.items():
+                rules_by_metric[metric] = metric_rules.above + metric_rules.below + [
+                    rule for rules in metric_rules.equals.values() for rule in rules]
+
+            # Alarms raised during the run put their rules into cooldown, as in production
+            cooldowns = {}
+            for name, evaluate in (
+                ('indexed', lambda reading: alarm_engine.evaluate([reading], cooldowns, index)),
+                ('naive', lambda reading: naive_evaluate(rules_by_metric, reading)),
+            ):
+                before = alarm_engine.stats()
+                latencies = measure(evaluate, readings)
+                total = sum(latencies)
+                alarms = alarm_engine.stats()['alarms_raised'] - before['alarms_raised'] if name == 'indexed' else '-'
+                print(f"{count:>7} {name:>8} {statistics.median(latencies) * 1e6:>9.1f} "
+                      f"{latencies[int(len(latencies) * 0.99)] * 1e6:>9.1f} "
+                      f"{count * len(readings) / total:>14.0f} {alarms:>8}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark /api/alarms listing over a large alarms table.
+
+Fills the alarms table with random alarms spread over a year and many devices,
+then compares, for one page of alarms:
+  - lazy device loading (one query per device not yet in the session, as
+    Alarm.to_dict() did before)
+    against the endpoint's single joined query, and
+  - OFFSET paging against keyset (cursor) paging at increasing depths,
+with and without a status/severity/device filter.
+
+Usage: python benchmark_alarm_listing.py [--alarms 1000000] [--devices 50] [--page-size 100]
+Runs against a throw-away SQLite database; nothing touches the configured DATABASE_URL.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Point the app at a temporary database before it is imported
+DB_FILE = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_FILE
+
+from flask import Flask
+from sqlalchemy import desc, event
+from app.database import db, executemany_rows, init_app as init_db_app
+from app.models import Alarm, AlarmSeverity, AlarmStatus, Device
+
+INSERT_CHUNK = 50000
+
+
+def create_schema():
+    """Create tables so importing the app (which seeds the admin user) works."""
+    setup_app = Flask(__name__)
+    setup_app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
+    init_db_app(setup_app)
+    with setup_app.app_context():
+        db.create_all()
+
+
+def fill_alarms(count, devices):
+    db.session.execute(Device.__table__.insert(), [{
+        'control_id': f'benchmark-{i}', 'name': f'Benchmark Device {i}', 'device_type': 'pump',
+    } for i in range(devices)])
+    db.session.commit()
+    device_ids = [device_id for (device_id,) in db.session.query(Device.id)]
+
+    start = datetime(2025, 1, 1)
+    step = 365 * 24 * 3600 / count
+    statuses = [AlarmStatus.ACTIVE, AlarmStatus.ACKNOWLEDGED] + [AlarmStatus.CLEARED] * 8
+    severities = list(AlarmSeverity)
+    table = Alarm.__table__
+    columns = ['timestamp', 'device_id', 'alarm_type', 'severity', 'status', 'details']
+    connection = db.session.connection()
+    for offset in range(0, count, INSERT_CHUNK):
+        executemany_rows(connection, table.insert(), table, columns, [{
+            'timestamp': start + timedelta(seconds=int(i * step)),
+            'device_id': random.choice(device_ids),
+            'alarm_type': 'Sensor Threshold Exceeded',
+            'severity': random.choice(severities),
+            'status': random.choice(statuses),
+            'details': f'benchmark alarm {i}',
+        } for i in range(offset, min(offset + INSERT_CHUNK, count))])
+    db.session.commit()
+    return device_ids
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def timed(fn, repeat=5):
+    """(median seconds, result of the last call)"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--alarms', type=int, default=1000000)
+    parser.add_argument('--devices', type=int, default=50)
+    parser.add_argument('--page-size', type=int, default=100)
+    args = parser.parse_args()
+
+    create_schema()
+    from flask import jsonify
+    from sqlalchemy.orm import joinedload
+    from app.app import app
+    from app.alarms_api import alarm_filter_clauses
+
+    client = app.test_client()
+    with app.app_context():
+        started = time.perf_counter()
+        device_ids = fill_alarms(args.alarms, args.devices)
+        print(f"Inserted {args.alarms} alarms in {time.perf_counter() - started:.1f}s")
+        counter = QueryCounter(db.engine)
+
+        # N+1: one page, device names loaded lazily per alarm (fresh session each run)
+        def lazy_page():
+            db.session.remove()
+            alarms = Alarm.query.order_by(desc(Alarm.timestamp)).limit(args.page_size).all()
+            return [alarm.to_dict() for alarm in alarms]
+
+        before = counter.count
+        seconds, _ = timed(lazy_page)
+        lazy_queries = (counter.count - before) / 5
+        print(f"\nPage of {args.page_size}, lazy device loading: {seconds * 1000:8.1f} ms, "
+              f"{lazy_queries:.0f} queries")
+        db.session.remove()
+
+    def endpoint(query):
+        response = client.get('/api/alarms?' + query)
+        assert response.status_code == 200, response.get_json()
+        return response
+
+    before = counter.count
+    seconds, _ = timed(lambda: endpoint(f'limit={args.page_size}'))
+    print(f"Page of {args.page_size}, /api/alarms:           {seconds * 1000:8.1f} ms, "
+          f"{(counter.count - before) / 5:.0f} queries")
+
+    filters = {
+        'no filter': '',
+        'status=active': 'status=active',
+        'severity=critical': 'severity=critical',
+        'one device': f'device_id={device_ids[0]}',
+    }
+    depths = [1, 100, 1000]
+    print(f"\n{'filter':>18} {'page':>6} {'offset ms':>10} {'cursor ms':>10}")
+    for name, query in filters.items():
+        # Walk the cursor to the deepest page once, remembering the cursor of each depth
+        cursors = {1: None}
+        cursor = None
+        for page in range(1, max(depths)):
+            url = f'limit={args.page_size}&{query}' + (f'&cursor={cursor}' if cursor else '')
+            cursor = endpoint(url).headers.get('X-Next-Cursor')
+            if cursor is None:
+                break
+            cursors[page + 1] = cursor
+        for depth in depths:
+            if depth not in cursors:
+                continue
+            # Same request through OFFSET paging (filters parsed the same way, device names joined)
+            with app.test_request_context('/api/alarms?' + query):
+                from flask import request
+                clauses = alarm_filter_clauses(request.args)
+
+                def offset_page():
+                    alarms = (Alarm.query.options(joinedload(Alarm.device)).filter(*clauses)
+                              .order_by(desc(Alarm.timestamp), desc(Alarm.id))
+                              .offset((depth - 1) * args.page_size).limit(args.page_size).all())
+                    return jsonify([alarm.to_dict() for alarm in alarms])
+
+                offset_seconds, _ = timed(offset_page)
+                db.session.remove()
+            url = f'limit={args.page_size}&{query}' + (f'&cursor={cursors[depth]}' if cursors[depth] else '')
+            cursor_seconds, _ = timed(lambda: endpoint(url))
+            print(f"{name:>18} {depth:>6} {offset_seconds * 1000:>10.1f} {cursor_seconds * 1000:>10.1f}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark alarm notification delivery against local webhook stand-ins.
+
+Starts three local HTTP servers standing in for webhook sinks: a fast one, a
+slow one (answers after --slow-delay seconds) and a flaky one (answers 500 to
+half of the requests). Readings that trigger --rules alarms each are then
+ingested one batch at a time, first without notification sinks and then with
+the three sinks configured, and the script prints:
+  - the ingest latency with and without notifications queued in the same transaction,
+  - how long the fast and flaky sinks take to empty their queue (delivered or
+    given up), and how far behind the slow sink is at that point, and
+  - the notifier stats (deliveries per second, retries, backlog per sink).
+
+Usage: python benchmark_alarm_notifications.py [--readings 50] [--rules 5] [--slow-delay 2]
+Runs against a throw-away SQLite database; nothing touches the configured DATABASE_URL.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Point the app at a temporary database before it is imported; one alarm per trigger and quick retries
+DB_FILE = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_FILE
+os.environ['ALARM_COALESCE'] = '0'
+os.environ.setdefault('ALARM_NOTIFICATION_BACKOFF', '0.2')
+
+from flask import Flask
+from app.database import db, init_app as init_db_app
+from app.models import AlarmCondition, AlarmRule, AlarmSeverity, Device
+
+
+def create_schema():
+    """Create tables so importing the app (which seeds the admin user) works."""
+    setup_app = Flask(__name__)
+    setup_app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
+    init_db_app(setup_app)
+    with setup_app.app_context():
+        db.create_all()
+
+
+class StandInSink:
+    """Local webhook receiver; remembers the (rule, timestamp) of every alarm it accepted."""
+
+    def __init__(self, delay=0.0, failure_rate=0.0, seed=3):
+        self.delay = delay
+        self.failure_rate = failure_rate
+        self.received = 0
+        self.accepted = set()
+        self.rejected = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                alarm = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                time.sleep(sink.delay)
+                with sink._lock:
+                    sink.received += 1
+                    failed = sink._rng.random() < sink.failure_rate
+                    if failed:
+                        sink.rejected += 1
+                    else:
+                        sink.accepted.add((alarm['triggered_by_rule_id'], alarm['timestamp']))
+                self.send_response(500 if failed else 200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server.server_address[1]}/alarms'
+
+
+def ingest_phase(ingest_readings, start, count):
+    """Per-batch ingest latencies (seconds) of `count` readings that trigger every rule."""
+    samples = []
+    for i in range(count):
+        reading = {'timestamp': (start + timedelta(seconds=i * 10)).isoformat(), 'air_temperature': 45.0}
+        started = time.perf_counter()
+        ingest_readings([reading])
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def describe(samples):
+    ordered = sorted(samples)
+    p95 = ordered[int(len(ordered) * 0.95) - 1]
+    return f"median {statistics.median(ordered) * 1000:6.2f} ms, p95 {p95 * 1000:6.2f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--readings', type=int, default=50)
+    parser.add_argument('--rules', type=int, default=5)
+    parser.add_argument('--slow-delay', type=float, default=2.0, help='seconds the slow sink takes to answer')
+    parser.add_argument('--wait', type=float, default=120, help='seconds to wait for the fast and flaky sinks')
+    args = parser.parse_args()
+
+    create_schema()
+    from app.app import app
+    from app.alarm_notifications import WebhookSink, alarm_notifier
+    from app.ingest import ingest_readings
+
+    stand_ins = {
+        'fast': StandInSink(),
+        'slow': StandInSink(delay=args.slow_delay),
+        'flaky': StandInSink(failure_rate=0.5),
+    }
+    expected = args.readings * args.rules
+    with app.app_context():
+        device = Device(control_id='benchmark-fan', name='Benchmark Fan', device_type='fan')
+        db.session.add(device)
+        db.session.flush()
+        for i in range(args.rules):
+            db.session.add(AlarmRule(
+                name=f'Hot {i}', device_id=device.id, sensor_metric='air_temperature',
+                condition=AlarmCondition.GREATER_THAN, threshold_value=30 + i,
+                severity=AlarmSeverity.WARNING, cooldown_period_seconds=0, is_active=True,
+            ))
+        db.session.commit()
+
+        baseline = ingest_phase(ingest_readings, datetime(2025, 1, 1), args.readings)
+        alarm_notifier.set_sinks([WebhookSink(name, stand_in.url, timeout=args.slow_delay + 3)
+                                  for name, stand_in in stand_ins.items()])
+        started = time.perf_counter()
+        with_sinks = ingest_phase(ingest_readings, datetime(2025, 1, 2), args.readings)
+        print(f"{args.readings} readings x {args.rules} rules, one batch per reading")
+        print(f"  ingest without sinks: {describe(baseline)}")
+        print(f"  ingest with 3 sinks:  {describe(with_sinks)}  ({expected * 3} notifications queued)")
+
+        finished = {}
+        deadline = time.perf_counter() + args.wait
+        while time.perf_counter() < deadline and len(finished) < 2:
+            backlog = alarm_notifier.stats()['sinks']
+            for name in ('fast', 'flaky'):
+                if name not in finished and not backlog[name]['pending']:
+                    finished[name] = time.perf_counter() - started
+            time.sleep(0.1)
+        print()
+        for name, stand_in in stand_ins.items():
+            done = f"queue empty after {finished[name]:.1f}s" if name in finished else "still pending"
+            print(f"  {name:>5}: {len(stand_in.accepted):>5}/{expected} accepted, {stand_in.received:>5} requests, "
+                  f"{stand_in.rejected:>4} answered 500  ({done})")
+
+        stats = alarm_notifier.stats()
+        print(f"\n{'sink':>6} {'pending':>8} {'oldest s':>9} {'dead':>5} {'delivered':>10} "
+              f"{'per s':>6} {'avg ms':>7} {'failed':>7}")
+        for name, sink in stats['sinks'].items():
+            print(f"{name:>6} {sink['pending']:>8} {sink['oldest_pending_seconds'] or 0:>9} {sink['dead']:>5} "
+                  f"{sink['delivered']:>10} {sink['deliveries_per_second']:>6} {sink['avg_delivery_ms'] or 0:>7} "
+                  f"{sink['failed_attempts']:>7}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
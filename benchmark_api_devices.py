@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark /api/devices and check the number of SQL statements it runs.
+
+Creates --devices devices (water pumps, drain valves and fans) and a reading,
+then measures GET /api/devices against the former per-device evaluation, in
+which every device's interlock check loaded the latest reading itself. For
+each, the script prints the latency and the statements per request. It then
+checks that:
+  - a warm request runs at most MAX_STATEMENTS statements (the session's user
+    lookup): device state and interlocks come from memory. The interlock rule
+    and device state version checks, made at most once per
+    INTERLOCK_RULES_CHECK_INTERVAL and DEVICE_STATE_CHECK_INTERVAL, are
+    counted separately,
+  - a new reading that trips the interlocks shows up in the next response, and
+  - adding a device shows up with its interlock status.
+Exits with status 1 if one of these checks fails.
+
+Usage: python benchmark_api_devices.py [--devices 200] [--requests 200]
+Runs against a throw-away SQLite database; nothing touches the configured DATABASE_URL.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Point the app at a temporary database before it is imported
+DB_FILE = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_FILE
+
+from flask import Flask
+from sqlalchemy import event
+from app.database import db, init_app as init_db_app
+from app.models import Device, SensorData
+
+# Statements a warm GET /api/devices may run: load_logged_in_user()'s user lookup
+MAX_STATEMENTS = 1
+DEVICE_TYPES = ['water_pump', 'drain_valve', 'fan']
+
+
+def create_schema():
+    """Create tables so importing the app (which seeds the admin user) works."""
+    setup_app = Flask(__name__)
+    setup_app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
+    init_db_app(setup_app)
+    with setup_app.app_context():
+        db.create_all()
+
+
+class StatementCounter:
+    """Counts the statements sent to the database, apart from interlock rule and device state version checks."""
+
+    def __init__(self, engine):
+        self.count = 0
+        self.version_checks = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        if 'interlock_rule_set_version' in statement or 'device_state_version' in statement:
+            self.version_checks += 1
+        else:
+            self.count += 1
+
+
+def measure(counter, call, requests):
+    """(latencies in seconds, statements per call) of `requests` calls."""
+    latencies, statements = [], []
+    for _ in range(requests):
+        before = counter.count
+        started = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - started)
+        statements.append(counter.count - before)
+    return latencies, statements
+
+
+def describe(latencies, statements):
+    return (f"median {statistics.median(latencies) * 1000:7.2f} ms, "
+            f"statements per request {min(statements)}-{max(statements)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--devices', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    create_schema()
+    from app.app import app
+    from app.interlocks import check_safety_interlocks, interlock_status_cache, status_action
+
+    with app.app_context():
+        db.session.add_all(Device(control_id=f'bench-{i}', name=f'Bench {i}',
+                                  device_type=DEVICE_TYPES[i % len(DEVICE_TYPES)])
+                           for i in range(args.devices))
+        db.session.add(SensorData(timestamp=datetime(2025, 1, 1), tank_water_volume=500.0, water_ph=7.0))
+        db.session.commit()
+        counter = StatementCounter(db.engine)
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+
+    def per_device():
+        # The former endpoint: every device's check loaded the latest reading
+        with app.test_request_context():
+            app.preprocess_request()
+            devices = [device.to_dict() for device in Device.query.all()]
+            for device in devices:
+                device['interlock'] = check_safety_interlocks(device, status_action(device))
+            db.session.remove()
+
+    def snapshot():
+        response = client.get('/api/devices')
+        assert response.status_code == 200
+        return response.get_json()
+
+    print(f"GET /api/devices with {args.devices} devices, {args.requests} requests")
+    print(f"  per-device interlocks: {describe(*measure(counter, per_device, args.requests))}")
+    snapshot() # Warm up the device state store and the caches
+    version_checks = counter.version_checks
+    latencies, statements = measure(counter, snapshot, args.requests)
+    print(f"  snapshot + cache:      {describe(latencies, statements)}, "
+          f"plus {counter.version_checks - version_checks} version checks in all")
+
+    failures = []
+    if max(statements) > MAX_STATEMENTS:
+        failures.append(f'a warm request ran {max(statements)} statements (at most {MAX_STATEMENTS} expected)')
+
+    with app.app_context():
+        db.session.add(SensorData(timestamp=datetime(2025, 1, 1) + timedelta(minutes=1),
+                                  tank_water_volume=5.0, water_ph=7.0))
+        db.session.commit()
+    pumps = [device for device in snapshot() if device['device_type'] == 'water_pump']
+    if not all(device['interlock']['blocked'] for device in pumps):
+        failures.append('a new reading with a low tank did not block the water pumps')
+
+    with app.app_context():
+        db.session.add(Device(control_id='bench-new', name='Bench new', device_type='water_pump'))
+        db.session.commit()
+    added = [device for device in snapshot() if device['control_id'] == 'bench-new']
+    if not added or not added[0]['interlock']['blocked']:
+        failures.append('a new device was not listed with its interlock status')
+
+    print(f"\nInterlock status cache: {interlock_status_cache.stats()}")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if not failures:
+        print("All checks passed")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark device control through the command queue against the simulator adapter.
+
+Every device gets --commands alternating ON/OFF commands. Each device is
+driven by one client thread, and --clients of them run at once like
+concurrent web requests. One device is "hung": its controller takes
+--hung-latency seconds to answer, while all others take --latency. The
+same load runs twice:
+  - inline: the request calls the adapter itself and waits for the device,
+    as a hardware call in api_control_device would, and
+  - queued: POST /api/control_device answers 202 and the command workers
+    talk to the devices.
+For each run the script prints the request latency, the time until every
+command was executed, and the end-to-end command latency. It also checks
+that every device executed its commands in the order they were sent.
+
+Usage: python benchmark_device_commands.py [--devices 20] [--commands 10] [--latency 0.2] [--workers 8]
+Runs against a throw-away SQLite database; nothing touches the configured DATABASE_URL.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+# Point the app at a temporary database before it is imported
+DB_FILE = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_FILE
+
+from flask import Flask
+from app.database import db, init_app as init_db_app
+from app.models import Device, DeviceCommand
+
+HUNG_CONTROL_ID = 'bench-fan-hung'
+
+
+def create_schema():
+    """Create tables so importing the app (which seeds the admin user) works."""
+    setup_app = Flask(__name__)
+    setup_app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
+    init_db_app(setup_app)
+    with setup_app.app_context():
+        db.create_all()
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[max(int(len(ordered) * fraction) - 1, 0)]
+
+
+def describe(samples):
+    return (f"median {statistics.median(samples) * 1000:8.1f} ms, p95 {percentile(samples, 0.95) * 1000:8.1f} ms, "
+            f"max {max(samples) * 1000:8.1f} ms")
+
+
+def run_clients(control_ids, clients, send):
+    """Send every device's commands from `clients` threads (one device per thread at a time)."""
+    latencies = []
+    lock = threading.Lock()
+    remaining = list(control_ids)
+
+    def client():
+        while True:
+            with lock:
+                if not remaining:
+                    return
+                control_id = remaining.pop(0)
+            for action in ACTIONS:
+                started = time.perf_counter()
+                send(control_id, action)
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+
+ACTIONS = []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--devices', type=int, default=20)
+    parser.add_argument('--commands', type=int, default=10, help='commands per device')
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds a controller takes to answer')
+    parser.add_argument('--hung-latency', type=float, default=3.0, help='seconds the hung controller takes')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent requests, like web server threads')
+    parser.add_argument('--workers', type=int, default=8, help='device command worker threads')
+    args = parser.parse_args()
+    ACTIONS.extend(['ON', 'OFF'] * (args.commands // 2) + ['ON'] * (args.commands % 2))
+
+    create_schema()
+    from app.app import app
+    from app.device_commands import SimulatorAdapter, device_commands
+
+    executed = defaultdict(list)  # control_id -> actions in the order the simulator received them
+
+    class BenchmarkSimulator(SimulatorAdapter):
+        def delay_for(self, device):
+            return args.hung_latency if device['control_id'] == HUNG_CONTROL_ID else args.latency
+
+        def execute(self, device, action, timeout):
+            executed[device['control_id']].append(action)
+            return super().execute(device, action, timeout)
+
+    adapter = BenchmarkSimulator()
+    device_commands.adapter = adapter
+    device_commands.workers = args.workers
+    device_commands.timeout = args.hung_latency + 5
+    device_commands.max_age = 3600
+
+    with app.app_context():
+        control_ids = [HUNG_CONTROL_ID] + [f'bench-fan-{i}' for i in range(args.devices - 1)]
+        db.session.add_all(Device(control_id=control_id, name=control_id, device_type='fan')
+                           for control_id in control_ids)
+        db.session.commit()
+    total = len(control_ids) * len(ACTIONS)
+    print(f"{len(control_ids)} devices x {len(ACTIONS)} commands, controller latency {args.latency}s "
+          f"(one hung device: {args.hung_latency}s), {args.clients} concurrent clients")
+
+    # Inline: the request waits for the device, as a hardware call inside the endpoint would
+    def send_inline(control_id, action):
+        adapter.execute({'control_id': control_id}, action, device_commands.timeout)
+        with app.app_context():
+            Device.query.filter_by(control_id=control_id).update({Device.status: action})
+            db.session.commit()
+
+    started = time.perf_counter()
+    inline = run_clients(control_ids, args.clients, send_inline)
+    inline_seconds = time.perf_counter() - started
+    print(f"\ninline:  request {describe(inline)}")
+    print(f"         all {total} commands executed after {inline_seconds:.1f}s")
+
+    # Queued: 202 from the endpoint, execution by the command workers
+    executed.clear()
+    thread_clients = threading.local()
+
+    def send_queued(control_id, action):
+        if not hasattr(thread_clients, 'client'):
+            thread_clients.client = app.test_client()
+            with thread_clients.client.session_transaction() as session:
+                session['user_id'] = 1
+        response = thread_clients.client.post(f'/api/control_device/{control_id}', json={'action': action})
+        assert response.status_code == 202, response.get_json()
+
+    started = time.perf_counter()
+    queued = run_clients(control_ids, args.clients, send_queued)
+    accepted_seconds = time.perf_counter() - started
+    others_done = None
+    while True:
+        with app.app_context():
+            pending = dict(db.session.query(Device.control_id, db.func.count(DeviceCommand.id))
+                           .join(DeviceCommand, DeviceCommand.device_id == Device.id)
+                           .filter(DeviceCommand.status.in_([DeviceCommand.QUEUED, DeviceCommand.RUNNING]))
+                           .group_by(Device.control_id).all())
+        if others_done is None and set(pending) <= {HUNG_CONTROL_ID}:
+            others_done = time.perf_counter() - started
+        if not pending:
+            break
+        time.sleep(0.05)
+    queued_seconds = time.perf_counter() - started
+
+    with app.app_context():
+        commands = [command.to_dict() for command in DeviceCommand.query]
+    end_to_end = [(command['queued_ms'] + command['execution_ms']) / 1000 for command in commands]
+    print(f"\nqueued:  request {describe(queued)}")
+    print(f"         all {total} commands accepted after {accepted_seconds:.1f}s, "
+          f"executed after {queued_seconds:.1f}s ({others_done:.1f}s without the hung device)")
+    print(f"         command end to end {describe(end_to_end)}")
+
+    in_order = all(executed[control_id] == ACTIONS for control_id in control_ids)
+    print(f"\nEvery device executed its commands in order: {in_order}")
+    print(f"Stats: {device_commands.stats()}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark device state reads and status writes through the device state store.
+
+Creates --devices devices and compares, per operation:
+  - reading every device's state: a SELECT of the devices table (as /api/devices
+    did) against the in-memory store, and
+  - recording --writes status changes: an UPDATE and commit per change (as every
+    executed command did) against set_status() with write-behind flushes.
+Both store backends ('memory' and the shared 'file') are measured. The script
+also checks that the table holds the final statuses after the last flush.
+
+Usage: python benchmark_device_state.py [--devices 50] [--reads 2000] [--writes 2000]
+Runs against a throw-away SQLite database; nothing touches the configured DATABASE_URL.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# Point the app at a temporary database before it is imported
+TEMP_DIR = tempfile.mkdtemp()
+DB_FILE = os.path.join(TEMP_DIR, 'benchmark.sqlite')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_FILE
+
+from flask import Flask
+from app.database import db, init_app as init_db_app
+from app.models import Device
+
+
+def create_schema():
+    """Create tables so importing the app (which seeds the admin user) works."""
+    setup_app = Flask(__name__)
+    setup_app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
+    init_db_app(setup_app)
+    with setup_app.app_context():
+        db.create_all()
+
+
+def timed(operation, count):
+    """Per-call latencies (seconds) of `count` calls of operation(i)."""
+    samples = []
+    for i in range(count):
+        started = time.perf_counter()
+        operation(i)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def describe(samples):
+    ordered = sorted(samples)
+    p95 = ordered[int(len(ordered) * 0.95) - 1]
+    return f"median {statistics.median(ordered) * 1e6:8.1f} us, p95 {p95 * 1e6:8.1f} us"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--devices', type=int, default=50)
+    parser.add_argument('--reads', type=int, default=2000)
+    parser.add_argument('--writes', type=int, default=2000)
+    args = parser.parse_args()
+
+    create_schema()
+    from app.app import app
+    from app.device_state import DeviceStateStore, LocalFileBackend
+
+    with app.app_context():
+        db.session.add_all(Device(control_id=f'bench-{i}', name=f'Bench {i}', device_type='fan')
+                           for i in range(args.devices))
+        db.session.commit()
+        ids = [device_id for device_id, in db.session.query(Device.id).order_by(Device.id)]
+        statuses = ['ON', 'OFF']
+
+        def sql_read(i):
+            [device.to_dict() for device in Device.query.all()]
+            db.session.remove()
+
+        def sql_write(i):
+            db.session.query(Device).filter(Device.id == ids[i % len(ids)]).update(
+                {Device.status: statuses[i % 2], Device.last_status_update: db.func.now()}, synchronize_session=False)
+            db.session.commit()
+
+        print(f"{args.devices} devices, {args.reads} reads, {args.writes} status writes")
+        print(f"\n  SQL         read all  {describe(timed(sql_read, args.reads))}")
+        print(f"              write     {describe(timed(sql_write, args.writes))}")
+
+        for name in ('memory', 'file'):
+            store = DeviceStateStore(flush_interval=3600) # Flushed by hand below
+            if name == 'file':
+                store.backend = LocalFileBackend(os.path.join(TEMP_DIR, 'device_state.json'))
+            store.reload()
+            reads = timed(lambda i: store.all(), args.reads)
+            writes = timed(lambda i: store.set_status(ids[i % len(ids)], statuses[(i + 1) % 2]), args.writes)
+            started = time.perf_counter()
+            flushed = store.flush()
+            flush_ms = (time.perf_counter() - started) * 1000
+            print(f"\n  store/{name:<6} read all  {describe(reads)}")
+            print(f"              write     {describe(writes)}")
+            print(f"              flush     {flushed} rows in {flush_ms:.1f} ms "
+                  f"(one UPDATE per device instead of {args.writes} commits)")
+            db.session.remove()
+            expected = {device['id']: device['status'] for device in store.all()}
+            stored = dict(db.session.query(Device.id, Device.status))
+            print(f"              table matches the store after the flush: {stored == expected}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark the JSON and binary frame formats of /api/ingest.
+
+For each format the script reports the payload size, the decode + validation
+throughput alone, and the end-to-end throughput of POSTing the batch to
+/api/ingest (decode, insert, rollup updates and commit).
+
+Usage: python benchmark_ingest.py [--rows 50000] [--metrics 27] [--repeat 3]
+Runs against a throw-away SQLite database; nothing touches the configured DATABASE_URL.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Point the app at a temporary database before it is imported
+DB_FILE = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_FILE
+os.environ['INGEST_API_KEYS'] = 'benchmark'
+
+from flask import Flask
+from app.database import db, init_app as init_db_app
+from app.models import SENSOR_METRIC_COLUMNS
+
+
+def create_schema():
+    """Create tables so importing the app (which seeds the admin user) works."""
+    setup_app = Flask(__name__)
+    setup_app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
+    init_db_app(setup_app)
+    with setup_app.app_context():
+        db.create_all()
+
+
+def make_readings(count, metric_count, start):
+    """Plausible readings: small noise around the middle of each metric's validation bounds."""
+    from app.ingest_validation import DEFAULT_PROFILE
+    metrics = SENSOR_METRIC_COLUMNS[:metric_count]
+    middle = {metric: (DEFAULT_PROFILE[metric].min_value + DEFAULT_PROFILE[metric].max_value) / 2 for metric in metrics}
+    return [dict({metric: round(middle[metric] + random.uniform(-0.1, 0.1), 2) for metric in metrics},
+                 timestamp=start + i)
+            for i in range(count)]
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--metrics', type=int, default=len(SENSOR_METRIC_COLUMNS))
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    create_schema()
+    from app.app import app
+    from app.ingest import validate_reading
+    from app.ingest_binary import CONTENT_TYPE, decode_frame, encode_frame
+
+    readings = make_readings(args.rows, args.metrics, start=1735689600)
+    payloads = {
+        'json': ('application/json', json.dumps(readings).encode()),
+        'binary': (CONTENT_TYPE, encode_frame(readings)),
+    }
+    decoders = {
+        'json': lambda body: [validate_reading(record, None) for record in json.loads(body)],
+        'binary': lambda body: decode_frame(body)[0],
+    }
+
+    client = app.test_client()
+    print(f"{args.rows} readings, {args.metrics} metrics each")
+    print(f"{'format':>8} {'bytes/row':>10} {'decode rows/s':>14} {'ingest rows/s':>14}")
+    for name, (content_type, body) in payloads.items():
+        decode_seconds = best_of(args.repeat, lambda: decoders[name](body))
+
+        def post():
+            response = client.post('/api/ingest', data=body,
+                                   headers={'X-API-Key': 'benchmark', 'Content-Type': content_type})
+            assert response.status_code == 200, response.get_json()
+        ingest_seconds = best_of(args.repeat, post)
+
+        print(f"{name:>8} {len(body) / args.rows:>10.1f} {args.rows / decode_seconds:>14.0f} "
+              f"{args.rows / ingest_seconds:>14.0f}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
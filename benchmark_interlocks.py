@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark interlock decisions of the compiled rule index as the rule count grows.
+
+Stores --rules-steps rule counts in turn (the default rules plus generated
+ones spread over --device-types device types and all actions) and times
+check_safety_interlocks() for a water pump against one reading snapshot:
+  - through the index, which only touches the rules for (device type, action), and
+  - by testing every active rule's selector and condition, as a list of
+    hardcoded checks grows into.
+It also checks that the default rules (formerly hardcoded) still block a water
+pump on a low tank and a drain valve on an unsafe pH, and nothing else.
+
+Usage: python benchmark_interlocks.py [--rules-steps 10,100,1000,10000] [--checks 5000]
+Runs against a throw-away SQLite database; nothing touches the configured DATABASE_URL.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# Point the app at a temporary database before it is imported
+DB_FILE = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_FILE
+
+from flask import Flask
+from app.database import db, init_app as init_db_app
+from app.models import AlarmCondition, InterlockRule
+
+ACTIONS = ['ON', 'OFF', 'OPEN', 'CLOSE']
+
+
+def create_schema():
+    """Create tables so importing the app (which seeds the admin user) works."""
+    setup_app = Flask(__name__)
+    setup_app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
+    init_db_app(setup_app)
+    with setup_app.app_context():
+        db.create_all()
+
+
+def median_us(call, count):
+    samples = []
+    for _ in range(count):
+        started = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rules-steps', default='10,100,1000,10000')
+    parser.add_argument('--device-types', type=int, default=200)
+    parser.add_argument('--checks', type=int, default=5000)
+    args = parser.parse_args()
+
+    create_schema()
+    from app.app import app
+    from app.interlocks import CompiledInterlock, check_safety_interlocks, interlock_engine
+
+    pump = {'device_type': 'water_pump'}
+    valve = {'device_type': 'drain_valve'}
+    fan = {'device_type': 'fan'}
+    failures = []
+    with app.app_context():
+        def blocked(device, action, **reading):
+            return check_safety_interlocks(device, action, dict({'tank_water_volume': 50, 'water_ph': 7}, **reading))
+
+        expectations = [
+            (blocked(pump, 'ON', tank_water_volume=5), True), (blocked(pump, 'ON'), False),
+            (blocked(pump, 'OFF', tank_water_volume=5), False), (blocked(fan, 'ON', tank_water_volume=5), False),
+            (blocked(valve, 'OPEN', water_ph=4), True), (blocked(valve, 'OPEN', water_ph=9.5), True),
+            (blocked(valve, 'OPEN'), False), (blocked({'device_type': 'valve'}, 'OPEN', water_ph=4), False),
+        ]
+        if [result['blocked'] for result, _ in expectations] != [expected for _, expected in expectations]:
+            failures.append('the default rules do not block exactly what the hardcoded interlocks did')
+        print(f"Default rules: {interlock_engine.stats()['rules']}, "
+              f"blocking '{expectations[0][0]['reason']}' and '{expectations[4][0]['reason']}'")
+
+        table = InterlockRule.__table__
+        snapshot = {'tank_water_volume': 50.0, 'water_ph': 7.0, 'air_temperature': 25.0}
+        print(f"\n{'rules':>7} {'index us':>9} {'scan-all us':>12} {'rules for pump/ON':>18}")
+        stored = interlock_engine.current_index().rule_count
+        for target in [int(step) for step in args.rules_steps.split(',')]:
+            generated = [{
+                'name': f'bench {i}', 'device_type_match': f'KIND{i % args.device_types} PUMP',
+                'action': ACTIONS[i % len(ACTIONS)], 'sensor_metric': 'air_temperature',
+                'condition': AlarmCondition.GREATER_THAN, 'threshold_value': 100.0 + i,
+                'reason': 'Too hot: {value}', 'is_active': True,
+            } for i in range(stored, target)]
+            if generated:
+                # Core insert for speed; record the change like the ORM hook does
+                db.session.execute(table.insert(), generated)
+                interlock_engine.bump_rules_version(db.session.connection())
+                db.session.commit()
+                interlock_engine.invalidate()
+            index = interlock_engine.current_index()
+            stored = index.rule_count
+            check_safety_interlocks(pump, 'ON', snapshot) # Resolve the key once
+
+            rules = [CompiledInterlock(row) for row in
+                     db.session.execute(db.select(table).where(table.c.is_active.is_(True))).mappings()]
+
+            def scan_all():
+                device_type = pump['device_type'].upper()
+                for rule in rules:
+                    if rule.action == 'ON' and rule.applies_to(device_type):
+                        value = snapshot.get(rule.sensor_metric)
+                        if value is not None and rule.compare(value, rule.threshold_value):
+                            return rule
+
+            indexed = median_us(lambda: check_safety_interlocks(pump, 'ON', snapshot), args.checks)
+            scanned = median_us(scan_all, max(args.checks // 10, 50))
+            print(f"{stored:>7} {indexed:>9.2f} {scanned:>12.2f} {len(index.rules_for('water_pump', 'ON')):>18}")
+
+    print(f"\nStats: {interlock_engine.stats()}")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark the live update (SSE) fan-out of a single worker process.
+
+Each simulated client is a thread consuming the same generator that
+/api/live_updates serves (one thread per open stream, as with the threaded
+development server). For every subscriber count the script commits new
+readings and measures how long it takes until every client received the diff.
+
+Usage: python benchmark_live_updates.py [--subscribers 100,500,1000,2000] [--events 20]
+Runs against a throw-away SQLite database; nothing touches the configured DATABASE_URL.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Point the app at a temporary database before it is imported
+DB_FILE = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_FILE
+
+from flask import Flask
+from app.database import db, init_app as init_db_app
+from app.models import SensorData
+
+
+def create_schema():
+    """Create tables so importing the app (which seeds the admin user) works."""
+    setup_app = Flask(__name__)
+    setup_app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
+    init_db_app(setup_app)
+    with setup_app.app_context():
+        db.create_all()
+
+
+def run(subscriber_count, event_count, live_updates, app):
+    received = {}  # event id -> list of receive times
+    received_lock = threading.Lock()
+    stop = threading.Event()
+
+    def client():
+        stream = live_updates.stream()
+        try:
+            for message in stream:
+                if stop.is_set():
+                    break
+                if message.startswith('event: diff'):
+                    event_id = int(message.split('\n')[1][4:])
+                    with received_lock:
+                        received.setdefault(event_id, []).append(time.perf_counter())
+        finally:
+            stream.close()
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(subscriber_count)]
+    for thread in threads:
+        thread.start()
+    while live_updates.stats()['subscribers'] < subscriber_count:
+        time.sleep(0.01)
+
+    latencies = []
+    base_time = datetime.now() + timedelta(days=subscriber_count)
+    for i in range(event_count):
+        event_id = live_updates.stats()['version'] + 1
+        with app.app_context():
+            db.session.add(SensorData(timestamp=base_time + timedelta(seconds=i), air_temperature=20.0 + i))
+            started = time.perf_counter()
+            db.session.commit()
+        deadline = started + 10
+        while time.perf_counter() < deadline:
+            with received_lock:
+                times = received.get(event_id, [])
+                if len(times) >= subscriber_count:
+                    latencies.append(max(times) - started)
+                    break
+            time.sleep(0.001)
+        else:
+            print(f"  event {event_id}: only {len(received.get(event_id, []))}/{subscriber_count} clients within 10s")
+
+    # Clients notice the flag on their next keepalive
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=5)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--subscribers', default='100,500,1000,2000')
+    parser.add_argument('--events', type=int, default=20)
+    args = parser.parse_args()
+
+    create_schema()
+    from app.app import app
+    from app.live_updates import live_updates
+    live_updates.heartbeat_interval = 1.0
+
+    print(f"{'clients':>8} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'deliveries/s':>13}")
+    for count in [int(n) for n in args.subscribers.split(',')]:
+        latencies = run(count, args.events, live_updates, app)
+        if not latencies:
+            print(f"{count:>8} {'-':>9} {'-':>9} {'-':>9} {'-':>13}")
+            continue
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"{count:>8} {statistics.median(latencies) * 1000:>9.1f} {p99 * 1000:>9.1f} "
+              f"{latencies[-1] * 1000:>9.1f} {count / statistics.median(latencies):>13.0f}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
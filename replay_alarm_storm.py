@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Replay a sensor failure through the alarm engine and measure the alarm storm.
+
+A failing air temperature probe first flaps around the rule thresholds, then
+sticks far above all of them. Every reading is ingested as its own batch, as a
+gateway would send it, with alarm rules spread over a few devices. The same
+replay runs three times:
+  - one alarm per trigger (ALARM_COALESCE=0, the behaviour before coalescing),
+  - with repeated triggers coalesced into the open alarm of each rule, and
+  - coalesced, with the devices reported offline when the failure starts.
+For each run it prints the alarm rows inserted, the alarms left open (the
+size of the active list), the INSERT/UPDATE statements on the alarms table
+and the replay time.
+
+Usage: python replay_alarm_storm.py [--rules 30] [--devices 3] [--minutes 120] [--interval 10]
+Runs against a throw-away SQLite database; nothing touches the configured DATABASE_URL.
+The behaviour it measures is asserted by tests/test_alarm_storm.py.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Point the app at a temporary database before it is imported
+DB_FILE = os.path.join(tempfile.mkdtemp(), 'replay.sqlite')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_FILE
+
+from flask import Flask
+from sqlalchemy import event
+from app.database import db, init_app as init_db_app
+from app.models import Alarm, AlarmCondition, AlarmRule, AlarmSeverity, AlarmStatus, Device
+
+
+def create_schema():
+    """Create tables so importing the app (which seeds the admin user) works."""
+    setup_app = Flask(__name__)
+    setup_app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
+    init_db_app(setup_app)
+    with setup_app.app_context():
+        db.create_all()
+
+
+def failure_timeline(start, minutes, interval, seed=7):
+    """Readings of a probe that is healthy, flaps around 30-40 °C, then sticks at ~85 °C."""
+    rng = random.Random(seed)
+    count = minutes * 60 // interval
+    readings = []
+    for i in range(count):
+        phase = i / count
+        if phase < 0.2:
+            value = 24 + rng.uniform(-1, 1)
+        elif phase < 0.5:
+            value = 35 + rng.uniform(-6, 6)
+        else:
+            value = 85 + rng.uniform(-2, 2)
+        readings.append({'timestamp': (start + timedelta(seconds=i * interval)).isoformat(),
+                         'air_temperature': round(value, 2)})
+    return readings, int(count * 0.2)
+
+
+class StatementCounter:
+    """INSERT/UPDATE statements on the alarms table."""
+
+    def __init__(self, engine):
+        self.inserts = 0
+        self.updates = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('INSERT INTO alarms'):
+            self.inserts += 1
+        elif statement.startswith('UPDATE alarms'):
+            self.updates += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rules', type=int, default=30)
+    parser.add_argument('--devices', type=int, default=3)
+    parser.add_argument('--minutes', type=int, default=120)
+    parser.add_argument('--interval', type=int, default=10, help='seconds between readings')
+    args = parser.parse_args()
+
+    create_schema()
+    from app.app import app
+    from app.alarm_engine import alarm_engine
+    from app.ingest import ingest_readings
+
+    client = app.test_client()
+    scenarios = [
+        ('one alarm per trigger', False, False),
+        ('coalesced', True, False),
+        ('coalesced + offline parent', True, True),
+    ]
+    print(f"{args.rules} rules on {args.devices} devices, one reading every {args.interval}s "
+          f"for {args.minutes} minutes")
+    print(f"\n{'scenario':>28} {'alarm rows':>11} {'open':>6} {'inserts':>8} {'updates':>8} {'seconds':>8}")
+    with app.app_context():
+        counter = StatementCounter(db.engine)
+        for run, (name, coalesce, report_offline) in enumerate(scenarios):
+            # Fresh devices and rules per run; the previous run's rules are switched off
+            for rule in AlarmRule.query.filter_by(is_active=True):
+                rule.is_active = False
+            devices = [Device(control_id=f'replay-{run}-{i}', name=f'Replay Device {run}-{i}', device_type='fan')
+                       for i in range(args.devices)]
+            db.session.add_all(devices)
+            db.session.flush()
+            for i in range(args.rules):
+                db.session.add(AlarmRule(
+                    name=f'Hot {i}', device_id=devices[i % args.devices].id, sensor_metric='air_temperature',
+                    condition=AlarmCondition.GREATER_THAN, threshold_value=30 + i * 0.5,
+                    severity=AlarmSeverity.WARNING if i % 3 else AlarmSeverity.CRITICAL,
+                    cooldown_period_seconds=0, is_active=True,
+                ))
+            db.session.commit()
+            device_ids = [device.id for device in devices]
+            alarm_engine.coalesce = coalesce
+
+            # Each run replays its own day so cooldowns and windows of earlier runs don't interfere
+            readings, failure_start = failure_timeline(datetime(2025, 1, 1) + timedelta(days=run),
+                                                       args.minutes, args.interval)
+            before_rows = Alarm.query.count()
+            inserts, updates = counter.inserts, counter.updates
+            started = time.perf_counter()
+            for position, reading in enumerate(readings):
+                if report_offline and position == failure_start:
+                    for device_id in device_ids:
+                        client.post('/api/alarms/device_offline', json={'device_id': device_id})
+                ingest_readings([reading])
+            seconds = time.perf_counter() - started
+
+            rule_alarms = Alarm.query.filter(Alarm.device_id.in_(device_ids))
+            rows = rule_alarms.count()
+            still_open = rule_alarms.filter(Alarm.status != AlarmStatus.CLEARED).count()
+            assert before_rows + rows == Alarm.query.count()
+            print(f"{name:>28} {rows:>11} {still_open:>6} {counter.inserts - inserts:>8} "
+                  f"{counter.updates - updates:>8} {seconds:>8.1f}")
+
+        stats = alarm_engine.stats()
+        print(f"\nOccurrences coalesced: {stats['occurrences_coalesced']}, "
+              f"suppressed by an offline parent: {stats['suppressed_by_parent']}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+import os
+import tempfile
+
+# Point the app at a temporary database before it is imported
+DB_FILE = os.path.join(tempfile.mkdtemp(), 'test.sqlite')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_FILE
+# Periodic refreshes (reading TTL, version checks of other workers) stay out of the statement counts
+for setting in ('LATEST_READING_CACHE_TTL', 'DEVICE_STATE_CHECK_INTERVAL', 'INTERLOCK_RULES_CHECK_INTERVAL'):
+    os.environ[setting] = '3600'
+
+import pytest
+from flask import Flask
+
+from app.database import db, init_app as init_db_app
+from app.models import Device, SensorData, SensorDataQuarantine
+from app.rollups import ROLLUP_TIERS
+
+
+def create_schema():
+    """Create tables so importing the app (which seeds the admin user) works."""
+    setup_app = Flask(__name__)
+    setup_app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
+    init_db_app(setup_app)
+    with setup_app.app_context():
+        db.create_all()
+
+
+create_schema()
+
+from app.app import app as flask_app
+from app.device_state import device_state
+from app.ingest_validation import reading_validator
+from app.sensor_cache import latest_reading_cache
+
+
+@pytest.fixture
+def app():
+    """The app with no devices, readings, rollups or quarantined values."""
+    with flask_app.app_context():
+        db.session.execute(db.delete(Device))
+        db.session.execute(db.delete(SensorData))
+        db.session.execute(db.delete(SensorDataQuarantine))
+        for model in ROLLUP_TIERS:
+            db.session.execute(db.delete(model))
+        db.session.commit()
+    # Core deletes bypass the ORM hooks that drop the in-memory state
+    device_state.invalidate()
+    latest_reading_cache.invalidate()
+    # Forget the previous values of every ingest source
+    reading_validator.set_profile(reading_validator.profile)
+    yield flask_app
+
+
+@pytest.fixture
+def client(app):
+    """Test client logged in as the seeded admin user."""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    return client
@@ -0,0 +1,80 @@
+"""The failing-probe replay of replay_alarm_storm.py, scaled down to assertions."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.alarm_engine import alarm_engine
+from app.database import db
+from app.ingest import ingest_readings
+from app.models import Alarm, AlarmCondition, AlarmNotification, AlarmRule, AlarmSeverity, AlarmStatus, Device
+
+RULES = 3
+# Healthy, stuck far above every threshold, recovered, stuck again
+PHASES = [(24.0, 3), (85.0, 10), (24.0, 3), (85.0, 2)]
+
+
+@pytest.fixture
+def storm(app):
+    """Ids of a device and its RULES air temperature rules (thresholds 30, 31, ...)."""
+    with app.app_context():
+        db.session.execute(db.delete(AlarmNotification))
+        db.session.execute(db.delete(Alarm))
+        db.session.execute(db.delete(AlarmRule))
+        db.session.commit()
+        # Core deletes bypass the ORM hooks that reload the engine's rules and open alarms
+        alarm_engine.invalidate()
+        alarm_engine.invalidate_offline()
+        device = Device(control_id='storm-0', name='Storm Device', device_type='fan')
+        db.session.add(device)
+        db.session.flush()
+        rules = [AlarmRule(name=f'Hot {i}', device_id=device.id, sensor_metric='air_temperature',
+                           condition=AlarmCondition.GREATER_THAN, threshold_value=30 + i,
+                           severity=AlarmSeverity.WARNING, cooldown_period_seconds=0, is_active=True)
+                 for i in range(RULES)]
+        db.session.add_all(rules)
+        db.session.commit()
+        yield device.id, [rule.id for rule in rules]
+
+
+def replay(phases):
+    """Ingest the phases one reading per batch, every 10 seconds, as a gateway would."""
+    timestamp = datetime(2025, 1, 1)
+    for value, count in phases:
+        for _ in range(count):
+            ingest_readings([{'timestamp': timestamp.isoformat(), 'air_temperature': value}])
+            timestamp += timedelta(seconds=10)
+
+
+def rule_alarms(rule_id):
+    return Alarm.query.filter_by(triggered_by_rule_id=rule_id).order_by(Alarm.id).all()
+
+
+def test_one_alarm_per_trigger_without_coalescing(storm, monkeypatch):
+    monkeypatch.setattr(alarm_engine, 'coalesce', False)
+    device_id, rule_ids = storm
+    replay(PHASES)
+    for rule_id in rule_ids:
+        assert len(rule_alarms(rule_id)) == 12
+
+
+def test_triggers_coalesce_into_the_open_alarm_until_it_clears(storm):
+    device_id, rule_ids = storm
+    coalesced = alarm_engine.stats()['occurrences_coalesced']
+    replay(PHASES)
+    for rule_id in rule_ids:
+        first, second = rule_alarms(rule_id)
+        # The first failure is one alarm, cleared when the temperature recovered
+        assert (first.occurrence_count, first.status) == (10, AlarmStatus.CLEARED)
+        # The second failure opens a new one
+        assert (second.occurrence_count, second.status) == (2, AlarmStatus.ACTIVE)
+    assert alarm_engine.stats()['occurrences_coalesced'] - coalesced == RULES * (9 + 1)
+
+
+def test_offline_device_raises_no_rule_alarms(storm, client):
+    device_id, rule_ids = storm
+    suppressed = alarm_engine.stats()['suppressed_by_parent']
+    response = client.post('/api/alarms/device_offline', json={'device_id': device_id})
+    assert response.status_code in (200, 201), response.get_json()
+    replay(PHASES)
+    assert Alarm.query.filter(Alarm.triggered_by_rule_id.in_(rule_ids)).count() == 0
+    assert alarm_engine.stats()['suppressed_by_parent'] > suppressed
@@ -0,0 +1,125 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app.database import db
+from app.interlocks import interlock_status_cache
+from app.models import Device, SensorData
+
+# Statements a warm GET /api/devices runs: load_logged_in_user()'s user lookup
+WARM_STATEMENTS = 1
+DEVICE_TYPES = ['water_pump', 'drain_valve', 'fan']
+
+
+class StatementCounter:
+    """Counts the statements the current thread sends to the database (not those of background threads)."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.thread = threading.get_ident()
+        self.count = 0
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self.thread:
+            self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self._count)
+
+
+def add_devices(count, prefix='test'):
+    db.session.add_all(Device(control_id=f'{prefix}-{i}', name=f'Test {i}',
+                              device_type=DEVICE_TYPES[i % len(DEVICE_TYPES)])
+                       for i in range(count))
+    db.session.commit()
+
+
+def add_reading(minute, tank_water_volume):
+    db.session.add(SensorData(timestamp=datetime(2025, 1, 1) + timedelta(minutes=minute),
+                              tank_water_volume=tank_water_volume, water_ph=7.0))
+    db.session.commit()
+
+
+def get_devices(client):
+    response = client.get('/api/devices')
+    assert response.status_code == 200
+    return {device['control_id']: device for device in response.get_json()}
+
+
+@pytest.mark.parametrize('device_count', [1, 200])
+def test_warm_request_runs_constant_statements(app, client, device_count):
+    with app.app_context():
+        add_devices(device_count)
+        add_reading(0, 500.0)
+    assert len(get_devices(client)) == device_count  # Warms the device state and the caches
+
+    with app.app_context():
+        engine = db.engine
+    counts = []
+    with StatementCounter(engine) as counter:
+        for _ in range(5):
+            before = counter.count
+            get_devices(client)
+            counts.append(counter.count - before)
+    assert counts == [WARM_STATEMENTS] * 5
+
+
+def test_new_reading_invalidates_interlock_statuses(app, client):
+    with app.app_context():
+        add_devices(3)
+        add_reading(0, 500.0)
+    assert not get_devices(client)['test-0']['interlock']['blocked']
+    evaluations = interlock_status_cache.evaluations
+
+    with app.app_context():
+        add_reading(1, 5.0)
+    devices = get_devices(client)
+    assert devices['test-0']['interlock']['blocked']  # The water pump
+    assert not devices['test-2']['interlock']['blocked']  # The fan
+    assert interlock_status_cache.evaluations == evaluations + 1
+
+
+def test_interlock_rule_edit_invalidates_interlock_statuses(app, client):
+    with app.app_context():
+        add_devices(3)
+        add_reading(0, 500.0)
+    assert not get_devices(client)['test-2']['interlock']['blocked']
+
+    response = client.post('/api/interlock_rules', json={
+        'name': 'Fan tank test', 'device_type_match': 'FAN', 'action': 'ON',
+        'sensor_metric': 'tank_water_volume', 'condition': '<', 'threshold_value': 100, 'reason': 'Tank at {value}',
+    })
+    assert response.status_code == 201
+    rule_id = response.get_json()['id']
+    try:
+        assert not get_devices(client)['test-2']['interlock']['blocked']
+        assert client.put(f'/api/interlock_rules/{rule_id}', json={'threshold_value': 1000}).status_code == 200
+        interlock = get_devices(client)['test-2']['interlock']
+        assert interlock['blocked'] and interlock['reason'] == 'Tank at 500.0'
+        assert client.put(f'/api/interlock_rules/{rule_id}', json={'is_active': False}).status_code == 200
+        assert not get_devices(client)['test-2']['interlock']['blocked']
+    finally:
+        client.delete(f'/api/interlock_rules/{rule_id}')
+
+
+def test_device_change_invalidates_interlock_statuses(app, client):
+    with app.app_context():
+        add_devices(3)
+        add_reading(0, 5.0)
+    devices = get_devices(client)
+    assert devices['test-0']['interlock']['blocked'] and not devices['test-2']['interlock']['blocked']
+
+    with app.app_context():
+        add_devices(1, prefix='added')
+        fan = Device.query.filter_by(control_id='test-2').one()
+        fan.device_type = 'water_pump'
+        db.session.commit()
+    devices = get_devices(client)
+    assert devices['added-0']['interlock']['blocked']  # A new water pump
+    assert devices['test-2']['interlock']['blocked']  # The fan, now a water pump
@@ -0,0 +1,92 @@
+import re
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app.database import db
+from app.ingest import ingest_readings
+from app.models import SensorDataRollupCoverage
+from app.timeseries import wall_clock_epoch
+
+START = datetime(2025, 3, 1)
+DAYS = 60
+# Two months in at most 1000 points: served from the 1-hour rollups
+LONG_RANGE = {'sensors': 'tank_water_volume', 'start_time': START.isoformat(),
+              'end_time': (START + timedelta(days=DAYS)).isoformat()}
+RAW_TABLE = re.compile(r'\bsensordata\b')
+
+
+class StatementLog:
+    """Statements the current thread sends to the database."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.thread = threading.get_ident()
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self.thread:
+            self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+
+    def raw_reads(self):
+        return [statement for statement in self.statements if RAW_TABLE.search(statement)]
+
+
+def set_covered_from(epoch):
+    coverage = SensorDataRollupCoverage.__table__
+    db.session.execute(coverage.update().where(coverage.c.id == 1).values(covered_from=epoch))
+    db.session.commit()
+
+
+@pytest.fixture
+def engine(app):
+    """Two months of readings every 30 minutes, merged into the rollups by ingest."""
+    with app.app_context():
+        ingest_readings([{'timestamp': (START + timedelta(minutes=30 * i)).isoformat(),
+                          'tank_water_volume': float(i % 100)} for i in range(DAYS * 48)])
+        yield db.engine
+        set_covered_from(None)
+
+
+def get_long_range(client):
+    response = client.get('/api/historical_data', query_string=LONG_RANGE)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_long_range_reads_only_the_rollups(engine, client):
+    with StatementLog(engine) as log:
+        data = get_long_range(client)
+    assert data['metadata']['source'] == 'sensordata_rollup_1h'
+    assert data['metadata']['original_count'] == DAYS * 48
+    # The user lookup, the coverage watermark and one GROUP BY over the rollup tier
+    assert len(log.statements) == 3
+    assert log.raw_reads() == []
+
+
+def test_range_before_the_watermark_is_read_from_sensordata(engine, client):
+    covered = get_long_range(client)
+    # Readings of the first 20 days were stored before the rollup tables existed
+    set_covered_from(wall_clock_epoch(START + timedelta(days=20, minutes=17)))
+    with StatementLog(engine) as log:
+        data = get_long_range(client)
+    assert len(log.raw_reads()) == 1
+    assert data['metadata']['source'] == 'sensordata_rollup_1h'
+    assert (data['timestamps'], data['aggregates']) == (covered['timestamps'], covered['aggregates'])
+    assert data['metadata']['original_count'] == DAYS * 48
+
+
+def test_range_entirely_before_the_watermark_is_raw(engine, client):
+    set_covered_from(wall_clock_epoch(START + timedelta(days=DAYS + 1)))
+    data = get_long_range(client)
+    assert data['metadata']['source'] == 'raw'
+    assert data['metadata']['original_count'] == DAYS * 48
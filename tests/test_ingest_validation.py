@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+from app.database import db
+from app.ingest_validation import reading_validator
+from app.models import SensorData, SensorDataQuarantine
+from app.rollups import ROLLUP_TIERS
+
+START = datetime(2024, 5, 1, 12, 0)
+# soil_ph may change by 1 per minute: 6.0 -> 8.5 is too steep, one reading every 30 s
+STEP = [6.0] * 4 + [8.5] * 6
+SPIKE = [6.0] * 4 + [8.5] + [6.0] * 5
+
+
+def readings(values):
+    return [{'timestamp': (START + timedelta(seconds=30 * i)).isoformat(), 'soil_ph': value}
+            for i, value in enumerate(values)]
+
+
+def ingest(client, readings):
+    response = client.post('/api/ingest', json=readings, headers={'X-Source-Id': 'gw-1'})
+    assert response.status_code == 200, response.get_json()
+
+
+def stored(app):
+    with app.app_context():
+        values = db.session.execute(db.select(SensorData.soil_ph).order_by(SensorData.timestamp)).scalars().all()
+        quarantine = db.session.execute(
+            db.select(SensorDataQuarantine.value, SensorDataQuarantine.reason).order_by(SensorDataQuarantine.timestamp)
+        ).all()
+    return values, [tuple(row) for row in quarantine]
+
+
+def ingest_both_ways(app, client, values):
+    """(values, quarantine) after one upload and after one upload per reading."""
+    ingest(client, readings(values))
+    batch = stored(app)
+    with app.app_context():
+        db.session.execute(db.delete(SensorData))
+        db.session.execute(db.delete(SensorDataQuarantine))
+        for model in ROLLUP_TIERS:
+            db.session.execute(db.delete(model))
+        db.session.commit()
+    reading_validator.set_profile(reading_validator.profile)
+    for reading in readings(values):
+        ingest(client, [reading])
+    return batch, stored(app)
+
+
+def test_step_change_one_reading_per_request_is_stored(app, client):
+    batch, per_request = ingest_both_ways(app, client, STEP)
+    assert per_request == batch
+    assert per_request == (STEP, [])
+    # The withheld 8.5 reached the rollups once it was settled
+    with app.app_context():
+        finest = ROLLUP_TIERS[0]
+        sums = db.session.execute(db.select(finest.soil_ph_sum).order_by(finest.bucket_epoch)).scalars().all()
+    assert sums == [12.0, 12.0, 17.0, 17.0, 17.0]
+
+
+def test_spike_one_reading_per_request_is_quarantined(app, client):
+    batch, per_request = ingest_both_ways(app, client, SPIKE)
+    assert per_request == batch
+    assert per_request == (SPIKE[:4] + [None] + SPIKE[5:], [(8.5, 'rate')])
+
+
+def test_newest_steep_value_is_pending_until_the_next_reading(app, client):
+    ingest(client, readings(STEP[:5]))
+    assert stored(app) == (STEP[:4] + [None], [(8.5, 'pending')])
@@ -0,0 +1,95 @@
+import os
+from dotenv import load_dotenv
+from flask import Flask
+from sqlalchemy.schema import CreateColumn
+from app.database import db, init_app as init_db_app
+# Import all models to ensure they are registered with SQLAlchemy metadata
+from app.models import (Alarm, AlarmNotification, AlarmOfflineSetVersion, AlarmRule, AlarmRuleSetVersion,
+                        AlarmStateVersion, DeviceCommand, DeviceStateVersion, IngestKey, InterlockRule,
+                        InterlockRuleSetVersion, Scene, SensorData, SensorDataQuarantine, SensorDataRollupCoverage)
+from app.rollups import ROLLUP_TIERS, rebuild_rollups
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Create a minimal Flask app instance for context
+app = Flask(__name__)
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key')
+DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///instance/irrigodb.sqlite')
+app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# Initialize the database with the app
+init_db_app(app)
+
+# Columns added to existing tables after they were first created (db.create_all() skips them)
+NEW_COLUMNS = {
+    AlarmRule.__table__: ['duration_seconds', 'hysteresis'],
+    Alarm.__table__: ['occurrence_count', 'last_seen', 'updated_at'],
+    DeviceCommand.__table__: ['run_id', 'position', 'compensates_id'],
+    SensorData.__table__: ['source_id'],
+    SensorDataQuarantine.__table__: ['source_id'],
+}
+
+# Tables added after the alarm tables were first created
+# (the app stores the default interlock rules in interlock_rules on its next start)
+NEW_TABLES = [AlarmRuleSetVersion.__table__, AlarmStateVersion.__table__, AlarmOfflineSetVersion.__table__,
+              AlarmNotification.__table__, DeviceCommand.__table__, DeviceStateVersion.__table__, Scene.__table__,
+              InterlockRule.__table__, InterlockRuleSetVersion.__table__, IngestKey.__table__,
+              SensorDataQuarantine.__table__] + [model.__table__ for model in ROLLUP_TIERS] + [
+              SensorDataRollupCoverage.__table__]
+
+# Tables filled from the existing sensordata when they are created (a new coverage watermark
+# starts after the stored readings, so the existing rollups are recomputed to cover them)
+ROLLUP_TABLES = {model.__tablename__ for model in ROLLUP_TIERS} | {SensorDataRollupCoverage.__tablename__}
+
+# Tables whose model indexes are created when missing
+INDEXED_TABLES = [Alarm.__table__, DeviceCommand.__table__, SensorData.__table__]
+
+def update_schema():
+    """Adds missing alarm, device command, scene, interlock, ingest and rollup tables, columns and indexes to an existing database."""
+    with app.app_context():
+        inspector = db.inspect(db.engine)
+        added = 0
+        created = set()
+        with db.engine.begin() as connection:
+            existing_tables = set(inspector.get_table_names())
+            for table in NEW_TABLES:
+                if table.name in existing_tables:
+                    print(f"Table '{table.name}' already exists. Skipping.")
+                    continue
+                print(f"Creating table: {table.name}")
+                table.create(connection)
+                created.add(table.name)
+                added += 1
+            for table, column_names in NEW_COLUMNS.items():
+                if table.name not in existing_tables:
+                    continue # Created above with all of its columns
+                existing = {column['name'] for column in inspector.get_columns(table.name)}
+                for name in column_names:
+                    if name in existing:
+                        print(f"Column '{table.name}.{name}' already exists. Skipping.")
+                        continue
+                    definition = CreateColumn(table.c[name]).compile(dialect=connection.dialect)
+                    print(f"Adding column: {table.name}.{name}")
+                    connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {definition}")
+                    added += 1
+            for table in INDEXED_TABLES:
+                if table.name not in existing_tables:
+                    continue
+                existing = {index['name'] for index in inspector.get_indexes(table.name)}
+                for index in table.indexes:
+                    if index.name in existing:
+                        print(f"Index '{index.name}' already exists. Skipping.")
+                        continue
+                    print(f"Creating index: {index.name}")
+                    index.create(connection)
+                    added += 1
+        if created & ROLLUP_TABLES:
+            # Readings stored before the rollup tables existed never went through the insert hooks
+            for table_name, rows in rebuild_rollups().items():
+                print(f"Backfilled {table_name}: {rows} bucket(s).")
+        print(f"Added {added} table(s)/column(s)/index(es)." if added else "No new tables, columns or indexes needed to be added.")
+
+if __name__ == '__main__':
+    update_schema()